@@ -1,3 +1,83 @@
-from libcloud_mods import CTyunDriver
+import os
+import time
 
-print(CTyunDriver.list_vm_type())
+import click
+from flask import Flask
+from flask_migrate import Migrate
+from flask_restful import Api
+from werkzeug.local import LocalProxy
+
+from libcloud_mods import access_key, default_driver, registry
+from jobs import JobWorkerPool
+from models import db
+from resources.accounts import init_driver_registry
+from resources.changes import Changes, init_change_feed
+from resources.fleet import Node, NodeList, OrderList, SnapshotList, Topology, VolumeList
+from resources.hello import HelloWorld
+from resources.jobs import JobList, JobStatus, init_job_workers
+from resources.metrics import Metrics, init_request_metrics
+from resources.quotes import QuoteGrid, init_quote_engine
+from resources.sources import init_fleet_source
+from resources.warmup import init_warm_up
+from sync import InventorySync
+
+__version__ = '0.1.0'
+
+# the driver is built on first use, importing the app connects nothing
+CTyunDriver = LocalProxy(default_driver)
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql://localhost/xfoss_cmp')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['FLEET_SOURCE'] = os.environ.get('FLEET_SOURCE', 'database')
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['QUOTE_WARM_UP'] = bool(os.environ.get('QUOTE_WARM_UP'))
+app.config['CTYUN_WARM_UP'] = bool(os.environ.get('CTYUN_WARM_UP'))
+app.config['CHANGE_FEED_INTERVAL'] = float(os.environ.get('CHANGE_FEED_INTERVAL', 10))
+app.config['CHANGE_FEED_LOG'] = os.environ.get('CHANGE_FEED_LOG', 'database')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 0))
+# api tokens of the other CTyun accounts, as token:accessKey,token:accessKey
+app.config['CTYUN_API_TOKENS'] = dict(token.split(':', 1) for token in os.environ.get('CTYUN_API_TOKENS', '')
+        .split(',') if token)
+db.init_app(app)
+migrate = Migrate(app, db)
+init_driver_registry(app, registry, access_key)
+init_fleet_source(app, CTyunDriver)
+init_change_feed(app, CTyunDriver)
+init_request_metrics(app)
+init_quote_engine(app, CTyunDriver)
+init_warm_up(app, CTyunDriver)
+init_job_workers(app, CTyunDriver)
+
+api = Api(app)
+api.add_resource(HelloWorld, '/api/hello')
+api.add_resource(NodeList, '/api/nodes')
+api.add_resource(Node, '/api/nodes/<node_id>')
+api.add_resource(VolumeList, '/api/volumes')
+api.add_resource(SnapshotList, '/api/snapshots')
+api.add_resource(OrderList, '/api/orders')
+api.add_resource(Topology, '/api/zones/<int:zone_id>/topology')
+api.add_resource(Changes, '/api/changes')
+api.add_resource(JobList, '/api/jobs')
+api.add_resource(JobStatus, '/api/jobs/<job_id>')
+api.add_resource(QuoteGrid, '/api/quotes')
+api.add_resource(Metrics, '/metrics')
+
+
+@app.cli.command('sync-inventory')
+def sync_inventory():
+    """Stream the CTyun inventory into the database."""
+    print(InventorySync(CTyunDriver).run())
+
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=2, help='jobs run at the same time')
+def run_jobs(workers):
+    """Run the queued CTyun jobs until interrupted."""
+    pool = JobWorkerPool(app, CTyunDriver, size=workers)
+    pool.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop(timeout=30)
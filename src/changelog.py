@@ -0,0 +1,183 @@
+import datetime
+import json
+from contextlib import nullcontext
+from itertools import islice
+
+from flask import has_app_context
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from libcloud_mods.changefeed import CTYUN_CHANGE_FEED_SIZE, ChangeEvent, ChangeFeedExpiredError
+from models import FeedEvent, FeedLease, FeedState, db
+
+# seconds between two looks of a waiting reader for the events published by another process
+CHANGE_LOG_POLL_INTERVAL = 1.0
+# summaries written or deleted per statement
+CHANGE_LOG_BATCH_SIZE = 500
+
+
+def _event(record):
+    return ChangeEvent(record.id, record.type, record.kind, record.resource_id, json.loads(record.data), record.time)
+
+
+def _batches(values, size):
+    values = iter(values)
+    while True:
+        batch = list(islice(values, size))
+        if not batch:
+            return
+        yield batch
+
+
+class DatabaseChangeLog(object):
+    """
+    Log of a CTyunChangeFeed in the ctyun_feed_* tables, shared by every process using the database.
+
+    Event ids are the ids of the ctyun_feed_events rows, so a client resumes from its Last-Event-ID
+    in any uwsgi worker and across restarts. The process publishing holds the lease of the feed in
+    ctyun_feed_leases, claimed with a conditional UPDATE as the jobs are, the others only read.
+    """
+
+    def __init__(self, app, name='changes', maxlen=CTYUN_CHANGE_FEED_SIZE, poll_interval=CHANGE_LOG_POLL_INTERVAL):
+        """
+        :param app: Flask app of the database, the feed polls outside any request
+        :param name: name of the feed in ctyun_feed_leases
+        :param maxlen: events kept for resuming
+        :param poll_interval: seconds between two looks of a waiting reader for new events
+        """
+        self.app = app
+        self.name = name
+        self.maxlen = maxlen
+        self.poll_interval = poll_interval
+        # summaries as of the publish at _states_version, read again once another process published
+        self._states = None
+        self._states_version = None
+
+    def claim(self, worker, lease):
+        """
+        :return: True when worker holds the lease of the feed for the next lease seconds
+        """
+        now = datetime.datetime.utcnow()
+        values = {'worker': worker, 'lease_until': now + datetime.timedelta(seconds=lease)}
+        with self._context():
+            claimed = FeedLease.query.filter(FeedLease.name == self.name,
+                    db.or_(FeedLease.worker == worker, FeedLease.lease_until < now)).update(
+                    values, synchronize_session=False)
+            if claimed or FeedLease.query.filter(FeedLease.name == self.name).count():
+                db.session.commit()
+                return bool(claimed)
+            db.session.add(FeedLease(name=self.name, **values))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # claimed by another process meanwhile
+                db.session.rollback()
+                return False
+            return True
+
+    def load(self):
+        """
+        :return: dict of (kind, resource id) to the summary last published, None before the first publish
+        """
+        with self._context():
+            version = db.session.query(FeedLease.published_at).filter(FeedLease.name == self.name).scalar()
+            if version is not None and version != self._states_version:
+                self._states = dict(((state.kind, state.resource_id), json.loads(state.data))
+                        for state in FeedState.query)
+                self._states_version = version
+            db.session.commit()
+        return None if version is None else dict(self._states)
+
+    def append(self, events, changes):
+        """
+        :param events: list of (type, kind, resource id, data, time)
+        :param changes: dict of (kind, resource id) to its summary, None when removed
+        :return: the last sequence
+        """
+        now = datetime.datetime.utcnow()
+        with self._context():
+            try:
+                version = db.session.query(FeedLease.published_at).filter(FeedLease.name == self.name).scalar()
+                db.session.add_all([FeedEvent(type=event_type, kind=kind, resource_id=resource_id,
+                        data=json.dumps(data), time=event_time)
+                        for event_type, kind, resource_id, data, event_time in events])
+                self._write_states(changes)
+                if not FeedLease.query.filter(FeedLease.name == self.name).update(
+                        {'published_at': now}, synchronize_session=False):
+                    db.session.add(FeedLease(name=self.name, published_at=now))
+                db.session.flush()
+                last = self._last_id()
+                FeedEvent.query.filter(FeedEvent.id <= last - self.maxlen).delete(synchronize_session=False)
+                db.session.commit()
+            except BaseException:
+                db.session.rollback()
+                raise
+
+        if version is not None and version == self._states_version:
+            for key, summary in changes.items():
+                if summary is None:
+                    self._states.pop(key, None)
+                else:
+                    self._states[key] = summary
+            self._states_version = now
+        else:
+            self._states = self._states_version = None
+        return last
+
+    def last_sequence(self):
+        with self._context():
+            last = self._last_id()
+            db.session.commit()
+        return last
+
+    def since(self, sequence, kinds=None):
+        """
+        :return: (list of ChangeEvent following sequence, the last sequence)
+        :raise ChangeFeedExpiredError: when the events following sequence are no longer all held
+        """
+        with self._context():
+            first, last = db.session.query(func.min(FeedEvent.id), func.max(FeedEvent.id)).one()
+            last = last or 0
+            if sequence > last or (first is not None and sequence < first - 1):
+                db.session.commit()
+                raise ChangeFeedExpiredError('Event {} is no longer held'.format(sequence))
+            events = []
+            if sequence < last:
+                query = FeedEvent.query.filter(FeedEvent.id > sequence, FeedEvent.id <= last)
+                if kinds is not None:
+                    query = query.filter(FeedEvent.kind.in_(kinds))
+                events = [_event(record) for record in query.order_by(FeedEvent.id)]
+            db.session.commit()
+        return events, last
+
+    @staticmethod
+    def event_id(sequence):
+        return str(sequence)
+
+    @staticmethod
+    def sequence_of(event_id):
+        if not str(event_id).isdigit():
+            raise ChangeFeedExpiredError('Event {} is no longer held'.format(event_id))
+        return int(event_id)
+
+    def _context(self):
+        # a request has its app context already, a nested one would remove its session on teardown
+        return nullcontext() if has_app_context() else self.app.app_context()
+
+    @staticmethod
+    def _last_id():
+        return db.session.query(func.max(FeedEvent.id)).scalar() or 0
+
+    def _write_states(self, changes):
+        by_kind = {}
+        for (kind, resource_id), summary in changes.items():
+            by_kind.setdefault(kind, []).append((resource_id, summary))
+        table = FeedState.__table__
+        for kind, items in by_kind.items():
+            for batch in _batches(items, CHANGE_LOG_BATCH_SIZE):
+                db.session.execute(table.delete().where(table.c.kind == kind).where(
+                        table.c.resource_id.in_([resource_id for resource_id, _ in batch])))
+                rows = [{'kind': kind, 'resource_id': resource_id, 'data': json.dumps(summary)}
+                        for resource_id, summary in batch if summary is not None]
+                if rows:
+                    db.session.execute(table.insert().values(rows))
@@ -0,0 +1,209 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from libcloud_mods.endpoints import CTYUN_FORM_BUILDERS
+from models import Job, db
+
+# long-running driver funcs run as jobs
+JOB_OPERATIONS = ('buy_cloud', 'buy_data_disk', 'reinstall_vm', 'create_snapshot', 'rollback_snapshot',
+        'pay_order', 'refund_cloud', 'refund_disk')
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+# seconds a worker owns the job it runs, far above the timeouts and retries of one driver call
+JOB_LEASE = 900
+# seconds an idle worker waits before looking for jobs queued by other processes
+JOB_POLL_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue(object):
+    """
+    Persistent queue of driver calls in the ctyun_jobs table.
+
+    Workers of any process claim a queued job with a conditional UPDATE, only one of them wins it.
+    Orders are not idempotent, so a job is never run twice: a running job whose lease expired,
+    e.g. its process was killed, is failed and left for someone to check against the orders.
+    """
+
+    def __init__(self, session=None, lease=JOB_LEASE):
+        self.session = session or db.session
+        self.lease = lease
+
+    def enqueue(self, operation, params=None, access_key=None):
+        """
+        :param operation: one of JOB_OPERATIONS
+        :param params: dict of kwargs of the driver func
+        :param access_key: account running the job, None for the default one
+        :return: the queued Job
+        """
+        params = params or {}
+        if operation not in JOB_OPERATIONS:
+            raise Exception('Invalid param operation %s' % operation)
+        # raises TypeError as the driver func would, before anything is queued
+        CTYUN_FORM_BUILDERS[operation].bind((), params)
+        job = Job(id=uuid.uuid4().hex, operation=operation, params=json.dumps(params, sort_keys=True),
+                access_key=access_key, status=JOB_QUEUED, created_at=datetime.datetime.utcnow())
+        self.session.add(job)
+        self.session.commit()
+        return job
+
+    def get(self, job_id):
+        return self.session.query(Job).get(job_id)
+
+    def claim(self, worker):
+        """
+        :param worker: name of the claiming worker
+        :return: the oldest queued Job now running for worker, None when the queue is empty
+        """
+        now = datetime.datetime.utcnow()
+        self.fail_expired(now)
+        candidates = [job_id for job_id, in self.session.query(Job.id).filter(Job.status == JOB_QUEUED)
+                .order_by(Job.created_at, Job.id).limit(8)]
+        for job_id in candidates:
+            claimed = self.session.query(Job).filter(Job.id == job_id, Job.status == JOB_QUEUED).update(
+                    {'status': JOB_RUNNING, 'worker': worker, 'started_at': now,
+                        'lease_until': now + datetime.timedelta(seconds=self.lease)},
+                    synchronize_session=False)
+            self.session.commit()
+            if claimed:
+                return self.get(job_id)
+        # ends the read transaction, an idle worker holds nothing
+        self.session.commit()
+        return None
+
+    def finish(self, job, result=None, error=None):
+        job.status = JOB_FAILED if error is not None else JOB_SUCCEEDED
+        job.result = None if result is None else json.dumps(result)
+        job.error = error
+        job.finished_at = datetime.datetime.utcnow()
+        job.lease_until = None
+        self.session.commit()
+        return job
+
+    def fail_expired(self, now=None):
+        """
+        :return: count of running jobs whose lease expired, now failed
+        """
+        now = now or datetime.datetime.utcnow()
+        failed = self.session.query(Job).filter(Job.status == JOB_RUNNING, Job.lease_until < now).update(
+                {'status': JOB_FAILED, 'finished_at': now, 'lease_until': None,
+                    'error': 'Worker lost while running, check the orders before retrying'},
+                synchronize_session=False)
+        self.session.commit()
+        return failed
+
+
+def run_job(driver, job):
+    """
+    Call the driver func of job
+    :return: (response json, error or None)
+    """
+    try:
+        response_json = getattr(driver, job.operation)(**json.loads(job.params))
+    except Exception as e:
+        return None, '%s: %s' % (type(e).__name__, e)
+    if driver._is_success(response_json):
+        return response_json, None
+    if isinstance(response_json, dict):
+        return response_json, 'returnCode %s: %s' % (response_json.get('returnCode'), response_json.get('message'))
+    return None, 'Unexpected response %r' % (response_json,)
+
+
+class JobWorkerPool(object):
+    """
+    Threads running the queued jobs within an app context, each on its own database session.
+    Jobs of an account are run by its driver from the app registry, the others by driver.
+    """
+
+    def __init__(self, app, driver, size=2, poll_interval=JOB_POLL_INTERVAL):
+        self.app = app
+        self.driver = driver
+        self.size = size
+        self.poll_interval = poll_interval
+        self.name = '%s-%d' % (socket.gethostname(), os.getpid())
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return self._threads
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, args=('%s-%d' % (self.name, i),),
+                name='ctyun-job-worker-%d' % i, daemon=True) for i in range(self.size)]
+        for thread in self._threads:
+            thread.start()
+        return self._threads
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """
+        Wake an idle worker up, a job was just queued
+        """
+        self._wakeup.set()
+
+    def run_pending(self, worker=None):
+        """
+        Run the queued jobs in the calling thread, within an app context, until the queue is empty
+        :return: list of the finished Jobs
+        """
+        finished = []
+        queue = JobQueue()
+        while True:
+            job = queue.claim(worker or self.name)
+            if job is None:
+                return finished
+            finished.append(self._run_one(queue, job))
+
+    def _run(self, worker):
+        with self.app.app_context():
+            queue = JobQueue()
+            while not self._stop.is_set():
+                try:
+                    job = queue.claim(worker)
+                except Exception:
+                    logger.exception('Claiming a job failed')
+                    db.session.rollback()
+                    job = None
+                if job is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                job_id = job.id
+                try:
+                    self._run_one(queue, job)
+                except Exception:
+                    # the job stays running until its lease expires
+                    logger.exception('Finishing job %s failed', job_id)
+                    db.session.rollback()
+
+    def _run_one(self, queue, job):
+        registry = self.app.extensions.get('ctyun_registry')
+        if not job.access_key or registry is None:
+            result, error = run_job(self.driver, job)
+            return queue.finish(job, result, error)
+        try:
+            driver = registry.acquire(job.access_key)
+        except Exception as e:
+            return queue.finish(job, error='%s: %s' % (type(e).__name__, e))
+        try:
+            result, error = run_job(driver, job)
+        finally:
+            registry.release(driver)
+        return queue.finish(job, result, error)
@@ -1,6 +1,42 @@
+import os
+
 from libcloud.compute.providers import get_driver, set_driver
 
+from .registry import CTyunDriverRegistry
+
 set_driver('CTyun', 'libcloud_mods.ctyun', 'CTyunNodeDriver')
 
+access_key = os.environ.get('CTYUN_ACCESS_KEY', '')
+secret_key = os.environ.get('CTYUN_SECRET_KEY', '')
+# point the driver at another endpoint, e.g. the simulator of the tests: PYTHONPATH=src python -m tests.simulator
+api_host = os.environ.get('CTYUN_API_HOST') or None
+api_port = int(os.environ['CTYUN_API_PORT']) if os.environ.get('CTYUN_API_PORT') else None
+# file shared by the uwsgi workers to rate limit their CTyun calls together
+rate_limit_file = os.environ.get('CTYUN_RATE_LIMIT_FILE') or None
+# directory through which the uwsgi workers share their identical reads
+coalesce_dir = os.environ.get('CTYUN_COALESCE_DIR') or None
+
+# other accounts served, as accessKey:secretKey,accessKey:secretKey
+accounts = dict(account.split(':', 1) for account in os.environ.get('CTYUN_ACCOUNTS', '').split(',') if account)
+accounts.setdefault(access_key, secret_key)
+
 driver = get_driver('CTyun')
-CTyunDriver = driver(access_key, secret_key)
+# drivers are built on first use, in the process using them: nothing is connected at import,
+# before uwsgi forks its workers
+registry = CTyunDriverRegistry(accounts, driver_cls=driver, driver_kwargs={'host': api_host, 'port': api_port,
+        'ex_rate_limit_file': rate_limit_file, 'ex_coalesce_dir': coalesce_dir},
+        pinned=[access_key])
+
+
+def default_driver():
+    """
+    :return: the driver of the default account, CTYUN_ACCESS_KEY
+    """
+    return registry.get(access_key)
+
+
+def __getattr__(name):
+    # CTyunDriver is still importable, built on first import of the name
+    if name == 'CTyunDriver':
+        return default_driver()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,268 @@
+import asyncio
+import ssl
+import weakref
+
+from libcloud.common.exceptions import exception_from_message
+from libcloud.compute.types import InvalidCredsError
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from .ctyun import CTYUN_API_HOST, CTyunConnection, CTyunNodeDriver
+from .endpoints import CTYUN_ENDPOINTS, CTYUN_FORM_BUILDERS, CTYUN_FORM_HEADERS, endpoint_signature
+from .metrics import CTYUN_RATE_LIMIT_WAIT_SECONDS, track_ctyun_request
+from .utils import VKeySigner
+
+
+class _StaleConnection(Exception):
+    pass
+
+
+class AsyncCTyunResponse(object):
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class _LoopConnections(object):
+    """
+    Slots and idle keep-alive sockets of the connection in one event loop, neither can be used from another
+    """
+
+    def __init__(self, max_connections):
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = []
+
+
+class AsyncCTyunConnection(object):
+    """
+    Minimal asyncio HTTP/1.1 client for the CTyun api.
+
+    Keeps up to max_connections keep-alive sockets per event loop, further requests wait for a free one,
+    so thousands of calls can be in flight from one event loop. The driver can be used from successive
+    asyncio.run() calls, each loop gets its own sockets.
+    """
+
+    def __init__(self, user_id, key, secure=False, host=CTYUN_API_HOST, port=None, timeout=60,
+            max_connections=100):
+        self.user_id = user_id
+        self.key = key
+        self.secure = secure
+        self.host = host
+        self.port = port or (443 if secure else 80)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.driver = None
+        self._loops = weakref.WeakKeyDictionary()
+
+    def add_default_headers(self, headers):
+        return CTyunConnection.add_default_headers(self, headers)
+
+    @property
+    def _connections(self):
+        loop = asyncio.get_running_loop()
+        connections = self._loops.get(loop)
+        if connections is None:
+            connections = self._loops[loop] = _LoopConnections(self.max_connections)
+        return connections
+
+    async def request(self, action, headers=None, data=None, method='POST'):
+        headers = self.add_default_headers(dict(headers or {}))
+        body = (data or '').encode('utf-8')
+        head = ['%s %s HTTP/1.1' % (method, action), 'Host: %s' % self._host_header(),
+                'Content-Length: %d' % len(body), 'Connection: keep-alive']
+        head.extend('%s: %s' % item for item in headers.items())
+        raw = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+        retry_policy = getattr(self.driver, 'retry_policy', None)
+        if retry_policy is None:
+            return await self._attempt(action, body, raw, self.timeout)
+        return await retry_policy.call_async(action, lambda timeout: self._attempt(action, body, raw, timeout),
+                timeout=self.timeout)
+
+    async def _attempt(self, action, body, raw, timeout):
+        rate_limiter = getattr(self.driver, 'rate_limiter', None)
+        if rate_limiter is not None:
+            delay = rate_limiter.reserve(self.user_id, action, timeout)
+            CTYUN_RATE_LIMIT_WAIT_SECONDS.labels(action).observe(delay)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if timeout is not None:
+                    timeout -= delay
+
+        with track_ctyun_request(action, body) as tracked:
+            async with self._connections.slots:
+                response = await asyncio.wait_for(self._send(raw), timeout)
+
+            if response.status == 401:
+                raise InvalidCredsError(response.body or '401')
+            if response.status != 200:
+                raise exception_from_message(code=response.status, message=response.body,
+                        headers=response.headers)
+            tracked.done(response.status, response.body)
+        return response
+
+    async def close(self):
+        """
+        Close the idle sockets of the running loop, those of the loops closed already went with them
+        """
+        idle = self._connections.idle
+        while idle:
+            _, writer = idle.pop()
+            writer.close()
+
+    async def _send(self, raw):
+        idle = self._connections.idle
+        while idle:
+            reader, writer = idle.pop()
+            try:
+                return await self._exchange(reader, writer, raw, reused=True)
+            except _StaleConnection:
+                # the server closed this idle keep-alive socket before reading the request, try the next
+                continue
+        reader, writer = await self._open()
+        return await self._exchange(reader, writer, raw)
+
+    async def _exchange(self, reader, writer, raw, reused=False):
+        try:
+            try:
+                writer.write(raw)
+                await writer.drain()
+                status_line = await reader.readuntil(b'\r\n')
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                if reused and not getattr(e, 'partial', b''):
+                    raise _StaleConnection()
+                raise
+            response, keep_alive = await self._read_response(status_line, reader)
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self._connections.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _open(self):
+        context = None
+        if self.secure:
+            context = ssl.create_default_context()
+        return await asyncio.open_connection(self.host, self.port, ssl=context)
+
+    async def _read_response(self, status_line, reader):
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readuntil(b'\r\n')
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return AsyncCTyunResponse(int(status), headers, body.decode('utf-8')), keep_alive
+
+    def _host_header(self):
+        if int(self.port) in (80, 443):
+            return self.host
+        return '%s:%d' % (self.host, int(self.port))
+
+
+def _async_endpoint(endpoint):
+    builder = CTYUN_FORM_BUILDERS[endpoint.name]
+
+    async def method(self, *args, **kwargs):
+        data = builder.build(self.signer, args, kwargs)
+        result = await self.connection.request(endpoint.path, headers=CTYUN_FORM_HEADERS, data=data, method='POST')
+        return json.loads(result.body)
+
+    method.__name__ = endpoint.name
+    method.__qualname__ = 'AsyncCTyunNodeDriver.%s' % endpoint.name
+    method.__doc__ = 'Awaitable %s, posts %s' % (endpoint.name, endpoint.path)
+    method.__signature__ = endpoint_signature(endpoint)
+    return method
+
+
+class AsyncCTyunNodeDriver(object):
+    """
+    asyncio variant of CTyunNodeDriver, every CTyun func returns an awaitable
+    with the same params, signing and json result as the blocking driver
+    """
+    connectionCls = AsyncCTyunConnection
+    name = CTyunNodeDriver.name
+
+    def __init__(self, key, secret=None, secure=False, host=None, port=None, timeout=60,
+            max_connections=100, rate_limiter=None, retry_policy=None):
+        """
+        :param rate_limiter: CTyunRateLimiter, e.g. the one of a CTyunNodeDriver to share its limits
+        :param retry_policy: CTyunRetryPolicy, e.g. the one of a CTyunNodeDriver to share its circuit breakers
+        """
+        self.key = key
+        self.secret = secret
+        self.accesskey = key or ''
+        self.screctkey = secret or ''
+        self.signer = VKeySigner(self.accesskey, self.screctkey)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.connection = self.connectionCls(key, secret, secure=secure, host=host or CTYUN_API_HOST,
+                port=port, timeout=timeout, max_connections=max_connections)
+        self.connection.driver = self
+
+    async def close(self):
+        await self.connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # libcloud driver public func #
+    async def list_nodes(self, page_no=1, page_size=2):
+        response_json = await self.get_vm_list(page_no=page_no, page_size=page_size)
+        return self._to_nodes(response_json['returnObj']['VMList'])
+
+    async def reboot_node(self, node):
+        response_json = await self.restart_vm(node.id)
+        return response_json['returnCode'] == 200
+
+    async def stop_node(self, node):
+        response_json = await self.stop_vm(node.id)
+        return response_json['returnCode'] == 200
+
+    async def start_node(self, node):
+        response_json = await self.start_vm(node.id)
+        return response_json['returnCode'] == 200
+
+    async def list_volumes(self, zone_id=1, page_no=1, page_size=10):
+        response_json = await self.get_data_disk_list(zone_id=zone_id, page_no=page_no, page_size=page_size)
+        return [self._to_volume(el) for el in response_json['returnObj']['DiskList']]
+
+    _to_nodes = CTyunNodeDriver._to_nodes
+    _to_node = CTyunNodeDriver._to_node
+    _to_volume = CTyunNodeDriver._to_volume
+    _to_snapshot = CTyunNodeDriver._to_snapshot
+
+
+for _endpoint in CTYUN_ENDPOINTS:
+    setattr(AsyncCTyunNodeDriver, _endpoint.name, _async_endpoint(_endpoint))
+del _endpoint
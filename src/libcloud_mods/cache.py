@@ -0,0 +1,136 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache whose entries expire after a per-call ttl.
+
+    An expired entry is still served for stale_ttl seconds while a background
+    thread reloads it (stale-while-revalidate), past that the caller loads it itself.
+    """
+
+    def __init__(self, maxsize=128, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    def get_or_load(self, key, loader, ttl, stale_ttl=0, cacheable=None):
+        """
+        :param key: hashable cache key
+        :param loader: func without params which loads the value
+        :param ttl: seconds the loaded value is fresh
+        :param stale_ttl: seconds an expired value may still be served while reloading
+        :param cacheable: optional predicate, values failing it are returned but not stored
+        :return: cached or loaded value
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < expires + stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, loader, ttl, cacheable),
+                                daemon=True).start()
+                    return value
+            self.misses += 1
+
+        value = loader()
+        self._store(key, value, ttl, cacheable)
+        return value
+
+    def get(self, key, default=None):
+        """
+        :return: the fresh value of key, default when it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() >= entry[1]:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl):
+        self._store(key, value, ttl, None)
+
+    def invalidate(self, key=None):
+        """
+        Drop one entry, or every entry when key is None
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'stale_hits': self.stale_hits,
+                    'misses': self.misses,
+                    'refresh_errors': self.refresh_errors}
+
+    def _refresh(self, key, loader, ttl, cacheable):
+        try:
+            self._store(key, loader(), ttl, cacheable)
+        except Exception:
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value, ttl, cacheable):
+        if cacheable is not None and not cacheable(value):
+            return
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def catalog_cached(func):
+    """
+    Serve a read-only driver func from driver.catalog_cache, keyed on func name and params,
+    using the ttl configured for that func in driver.catalog_ttl
+    """
+    name = func.__name__
+    signature = inspect.signature(func)
+    # the endpoint funcs advertise their signature without self
+    binds_self = 'self' in signature.parameters
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        cache = self.catalog_cache
+        if cache is None:
+            return func(self, *args, **kwargs)
+        # positional and keyword calls of the same params share one key, wrong calls raise TypeError here
+        bound = signature.bind(self, *args, **kwargs) if binds_self else signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name,) + tuple(value for param, value in bound.arguments.items() if param != 'self')
+        ttl = self.catalog_ttl[name]
+        return cache.get_or_load(key, lambda: func(self, *args, **kwargs), ttl,
+                stale_ttl=self.catalog_stale_ttl, cacheable=self._is_success)
+    return wrapper
@@ -0,0 +1,304 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from itertools import islice
+
+from .ctyun import CTYUN_NODE_STATE, CTYUN_VOLUME_STATE
+
+# seconds between two reconciliations of the fleet
+CTYUN_CHANGE_FEED_INTERVAL = 10
+# events kept for the clients resuming from an event id
+CTYUN_CHANGE_FEED_SIZE = 10000
+# seconds without any reader after which the feed stops polling
+CTYUN_CHANGE_FEED_IDLE_TIMEOUT = 300
+
+CREATED = 'created'
+DELETED = 'deleted'
+STATE_CHANGED = 'state_changed'
+IP_CHANGED = 'ip_changed'
+DUE_DATE_CHANGED = 'due_date_changed'
+EVENT_TYPES = (CREATED, DELETED, STATE_CHANGED, IP_CHANGED, DUE_DATE_CHANGED)
+FEED_KINDS = ('nodes', 'volumes', 'snapshots')
+
+STATE_NAMES = {
+    'nodes': dict((state, name) for name, state in CTYUN_NODE_STATE.items()),
+    'volumes': dict((state, name) for name, state in CTYUN_VOLUME_STATE.items()),
+    'snapshots': {},
+}
+
+ChangeEvent = namedtuple('ChangeEvent', ['id', 'type', 'kind', 'resource_id', 'data', 'time'])
+
+
+class ChangeFeedExpiredError(Exception):
+    """
+    The event id to resume from is no longer held, e.g. dropped from the buffer or issued before a restart,
+    the client has to reload the fleet and go on from the last event id
+    """
+
+
+def _state_name(kind, state):
+    return STATE_NAMES[kind].get(state, state)
+
+
+def _ips(resource):
+    return {'publicIP': list(getattr(resource, 'public_ips', None) or []),
+            'privateIP': list(getattr(resource, 'private_ips', None) or [])}
+
+
+def resource_summary(kind, resource):
+    """
+    :return: dict of the fields of resource the events are computed from, json serializable
+    """
+    extra = resource.extra or {}
+    data = {'name': resource.name, 'state': _state_name(kind, resource.state), 'zoneId': extra.get('zoneId')}
+    if kind == 'nodes':
+        data.update(_ips(resource))
+    if kind != 'snapshots':
+        data['dueDate'] = extra.get('dueDate')
+    else:
+        data['vmId'] = extra.get('vmId')
+    return data
+
+
+def change_events(kind, old, new):
+    """
+    Typed changes between two summaries of a resource, old None when created and new None when deleted
+    :return: list of (type, data)
+    """
+    if old is None:
+        return [(CREATED, new)]
+    if new is None:
+        return [(DELETED, old)]
+    events = []
+    if old['state'] != new['state']:
+        events.append((STATE_CHANGED, {'from': old['state'], 'to': new['state']}))
+    if kind == 'nodes':
+        old_ips = {'publicIP': old['publicIP'], 'privateIP': old['privateIP']}
+        new_ips = {'publicIP': new['publicIP'], 'privateIP': new['privateIP']}
+        if old_ips != new_ips:
+            events.append((IP_CHANGED, {'from': old_ips, 'to': new_ips}))
+    if old.get('dueDate') != new.get('dueDate'):
+        events.append((DUE_DATE_CHANGED, {'from': old.get('dueDate'), 'to': new.get('dueDate')}))
+    return events
+
+
+class ChangeLog(object):
+    """
+    Events and last published summaries of the feed held by this process.
+    Ids are '<epoch>-<sequence>', the epoch changing with each process so that an id from before a restart
+    is told apart from a held one.
+    """
+    # readers are woken up by the feed publishing, nothing else appends
+    poll_interval = None
+
+    def __init__(self, maxlen=CTYUN_CHANGE_FEED_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.events = deque(maxlen=maxlen)
+        self.sequence = 0
+        self.states = None
+        self._lock = threading.Lock()
+
+    def claim(self, worker, lease):
+        """
+        :return: True when worker may publish for lease seconds, the only process always may
+        """
+        return True
+
+    def load(self):
+        """
+        :return: dict of (kind, resource id) to the summary last published, None before the first publish
+        """
+        with self._lock:
+            return None if self.states is None else dict(self.states)
+
+    def append(self, events, changes):
+        """
+        :param events: list of (type, kind, resource id, data, time)
+        :param changes: dict of (kind, resource id) to its summary, None when removed
+        :return: the last sequence
+        """
+        with self._lock:
+            for event_type, kind, resource_id, data, event_time in events:
+                self.sequence += 1
+                self.events.append(ChangeEvent(self.sequence, event_type, kind, resource_id, data, event_time))
+            states = self.states or {}
+            for key, summary in changes.items():
+                if summary is None:
+                    states.pop(key, None)
+                else:
+                    states[key] = summary
+            self.states = states
+            return self.sequence
+
+    def last_sequence(self):
+        return self.sequence
+
+    def since(self, sequence, kinds=None):
+        """
+        :return: (list of ChangeEvent following sequence, the last sequence)
+        :raise ChangeFeedExpiredError: when the events following sequence are no longer all held
+        """
+        with self._lock:
+            last = self.sequence
+            if sequence > last or (self.events and sequence < self.events[0].id - 1):
+                raise ChangeFeedExpiredError('Event {} is no longer held'.format(self.event_id(sequence)))
+            if sequence == last:
+                return [], last
+            # ids are consecutive, the events following sequence start at this offset
+            return [event for event in islice(self.events, sequence - self.events[0].id + 1, None)
+                    if kinds is None or event.kind in kinds], last
+
+    def event_id(self, sequence):
+        return '%s-%d' % (self.epoch, sequence)
+
+    def sequence_of(self, event_id):
+        epoch, _, sequence = str(event_id).rpartition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            raise ChangeFeedExpiredError('Event {} is no longer held'.format(event_id))
+        return int(sequence)
+
+
+class CTyunChangeFeed(object):
+    """
+    Typed events of the fleet, computed from the refreshes of a CTyunInventory and read by every client.
+
+    Reading starts a daemon thread refreshing the inventory every interval seconds, it stops once nobody
+    has read for idle_timeout seconds. Each refresh is compared with the summaries last published to the log,
+    so the changes meanwhile, refreshes made by others included, are caught up by the next one.
+    With a log shared by the processes, e.g. DatabaseChangeLog, the events and their ids are the same in every
+    worker: one process at a time holds the lease of the log and publishes, the others only read.
+    """
+
+    def __init__(self, inventory, log=None, interval=CTYUN_CHANGE_FEED_INTERVAL, maxlen=CTYUN_CHANGE_FEED_SIZE,
+            idle_timeout=CTYUN_CHANGE_FEED_IDLE_TIMEOUT, clock=time.time):
+        """
+        :param inventory: CTyunInventory reconciled with the listings
+        :param log: ChangeLog or a log shared by the processes, defaults to a ChangeLog of maxlen events
+        :param interval: seconds between two refreshes
+        :param maxlen: events kept for resuming by the default log
+        :param idle_timeout: seconds without reader after which the polling stops
+        """
+        self.inventory = inventory
+        self.log = log if log is not None else ChangeLog(maxlen)
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        # a publisher lost for this long hands the log over to another process
+        self.lease = 3 * interval
+        self._clock = clock
+        self._last_read = None
+        self._published = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def last_event_id(self):
+        return self.log.event_id(self.log.last_sequence())
+
+    @property
+    def worker(self):
+        # after the fork, each uwsgi worker has its own pid
+        return '%s-%d' % (socket.gethostname(), os.getpid())
+
+    def poll(self):
+        """
+        Reconcile the fleet once and publish its changes when this process holds the log,
+        the other processes leave the backend alone
+        :return: count of events published
+        """
+        if not self.log.claim(self.worker, self.lease):
+            return 0
+        self.inventory.refresh()
+        return self.publish()
+
+    def publish(self):
+        """
+        Compare the inventory with the summaries last published and append the changes to the log,
+        the first publish only records the summaries
+        :return: count of events published
+        """
+        now = self._clock()
+        current = dict(((kind, resource.id), resource_summary(kind, resource)) for kind in FEED_KINDS
+                for resource in self.inventory.list(kind))
+        with self._condition:
+            previous = self.log.load()
+            if previous is None:
+                self.log.append([], current)
+                return 0
+            events = []
+            changes = {}
+            for key, summary in current.items():
+                old = previous.get(key)
+                if old != summary:
+                    changes[key] = summary
+                    events.extend((event_type, key[0], key[1], data, now)
+                            for event_type, data in change_events(key[0], old, summary))
+            for key, old in previous.items():
+                if key not in current:
+                    changes[key] = None
+                    events.append((DELETED, key[0], key[1], old, now))
+            if changes:
+                self.log.append(events, changes)
+            if events:
+                self._published += 1
+                self._condition.notify_all()
+            return len(events)
+
+    def read(self, after=None, timeout=0, kinds=None):
+        """
+        Events following the event id after, waiting up to timeout seconds for one when there is none yet
+        :param after: event id to resume from, None starts from now
+        :param kinds: only events of these kinds
+        :return: (list of ChangeEvent, event id to resume from)
+        """
+        self._last_read = self._clock()
+        self._ensure_polling()
+        deadline = time.monotonic() + timeout
+        sequence = self.log.last_sequence() if after is None else self.log.sequence_of(after)
+        while True:
+            published = self._published
+            events, sequence = self.log.since(sequence, kinds)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0 or self._stop.is_set():
+                return events, self.log.event_id(sequence)
+            with self._condition:
+                if published == self._published:
+                    # another process may append to a shared log
+                    self._condition.wait(remaining if self.log.poll_interval is None
+                            else min(remaining, self.log.poll_interval))
+
+    def event_id(self, event):
+        return self.log.event_id(event.id)
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ctyun-change-feed', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._last_read is not None and self._clock() - self._last_read > self.idle_timeout:
+                return
+            try:
+                self.poll()
+            except Exception:
+                # the next round tries again, the changes meanwhile show up in its diff
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def _ensure_polling(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._condition:
+                self.start()
@@ -1,29 +1,93 @@
 import base64
+import logging
+import threading
 import types
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-from libcloud.utils.py3 import urlencode
+import requests
 from libcloud.utils.py3 import b
-from utils import md5
+from .cache import TTLCache, catalog_cached
+from .endpoints import CTYUN_ENDPOINTS, CTYUN_ENDPOINTS_BY_NAME, CTYUN_FORM_BUILDERS, CTYUN_FORM_HEADERS, \
+        endpoint_signature
+from .jsonstream import JsonArrayStream
+from .metrics import CTYUN_ERRORS, CTYUN_RATE_LIMIT_WAIT_SECONDS, CTYUN_RESPONSE_BYTES, track_ctyun_request
+from .pool import CTyunConnectionPool, PooledConnection
+from .ratelimit import CTyunRateLimiter
+from .records import CTyunNodeRecord, CTyunSnapshotRecord, CTyunVolumeRecord
+from .resilience import CircuitOpenError, CTyunCircuitBreaker, CTyunHttpConnection, CTyunRetryPolicy, \
+        DeadlineExceededError
+from .singleflight import CTyunRequestCoalescer
+from .utils import VKeySigner
 
 try:
     import simplejson as json
 except ImportError:
     import json
 
-from libcloud.common.base import JsonResponse, ConnectionUserAndKey
+from libcloud.common.base import JsonResponse, ConnectionUserAndKey, RawResponse
+from libcloud.common.exceptions import BaseHTTPError, exception_from_message
 from libcloud.common.types import MalformedResponseError
 from libcloud.compute.providers import Provider
 from libcloud.compute.types import InvalidCredsError
-from libcloud.compute.base import Node, NodeDriver, StorageVolume
+from libcloud.compute.base import Node, NodeDriver, StorageVolume, VolumeSnapshot
 from libcloud.compute.base import NodeSize, NodeImage, NodeLocation
 
 CTYUN_API_HOST = '42.123.120.96'
 
+logger = logging.getLogger(__name__)
+
 CTYUN_NODE_STATE = dict(starting=10, running=0, restarting=1,
         stopped=5, stopping=11, restoreing=12, dueed=9)
 CTYUN_VOLUME_STATE = {'unbind': 0, 'bind': 2, 'binding': 7, 'unbinding': 9,
         '1': 10, '2': 11}
 
+# item list key inside returnObj for each paginated listing api
+CTYUN_LIST_KEYS = {'/api/getVMList': 'VMList',
+        '/api/getDatadiskList': 'DiskList',
+        '/api/snapshotList': 'snapshotList',
+        '/api/getOrderList': 'orderList'}
+CTYUN_TOTAL_KEY = 'totalCount'
+# bytes read at a time from a streamed listing
+CTYUN_STREAM_CHUNK_SIZE = 16384
+
+# seconds the near-static catalog apis are served from memory
+CTYUN_CATALOG_TTL = {'list_zone': 3600, 'list_vm_type': 3600, 'list_os': 3600}
+CTYUN_CATALOG_STALE_TTL = 600
+CTYUN_DEFAULT_PAGE_SIZE = 100
+CTYUN_DEFAULT_BULK_CONCURRENCY = 10
+# seconds an unused connection of the parallel listings and bulk calls is kept open, without a pool
+CTYUN_WORKER_IDLE_TIMEOUT = 60
+
+# outcome of one item of a bulk operation, error is the raised exception if any
+CTyunBulkResult = namedtuple('CTyunBulkResult', ['item', 'success', 'result', 'error'])
+
+
+class CTyunListingError(Exception):
+    """
+    A page of a listing answered a returnCode other than 200, the listing is incomplete
+    """
+
+    def __init__(self, listing, response_json):
+        """
+        :param listing: name or path of the listing
+        :param response_json: the failed page
+        """
+        message = response_json.get('message') if isinstance(response_json, dict) else None
+        return_code = response_json.get('returnCode') if isinstance(response_json, dict) else None
+        super(CTyunListingError, self).__init__('%s failed with returnCode %s: %s' % (listing, return_code,
+                message))
+        self.listing = listing
+        self.return_code = return_code
+        self.response_json = response_json
+
+
+# a VM with its data disks and snapshots, volumes or snapshots None when they could not be listed
+CTyunTopologyEntry = namedtuple('CTyunTopologyEntry', ['node', 'volumes', 'snapshots'])
+# entries in nodes order, plus the disks and snapshots of the zone owned by none of the nodes
+CTyunTopology = namedtuple('CTyunTopology', ['entries', 'unattached_volumes', 'unattached_snapshots'])
+
 
 class CTyunResponse(JsonResponse):
     def parse_body(self):
@@ -44,6 +108,47 @@ class CTyunResponse(JsonResponse):
         return self.body
 
 
+class CTyunStreamResponse(RawResponse):
+    """
+    Response whose body is left on the wire, decoded element by element with iter_items
+    """
+    # api path, set by CTyunConnection for the metrics
+    action = None
+
+    def __init__(self, connection, response=None):
+        super(CTyunStreamResponse, self).__init__(connection, response=response)
+        self._stream = response
+
+    def raise_for_status(self):
+        """
+        Read the body of a failed response and raise as CTyunResponse would
+        """
+        if self.success():
+            return
+        body = b''.join(self.iter_content(CTYUN_STREAM_CHUNK_SIZE)).decode('utf-8', 'replace')
+        self.close()
+        if int(self.status) == 401:
+            raise InvalidCredsError(body or '401: %s' % self.error)
+        raise exception_from_message(code=self.status, message=body, headers=self.headers)
+
+    def iter_items(self, path):
+        """
+        :param path: keys leading to a list from the top of the body, e.g. ('returnObj', 'VMList')
+        :return: JsonArrayStream of the list, its document holds the rest of the body once iterated
+        """
+        return JsonArrayStream(self._chunks(), path)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+    def _chunks(self):
+        received = CTYUN_RESPONSE_BYTES.labels(self.action)
+        for chunk in self.iter_content(CTYUN_STREAM_CHUNK_SIZE):
+            received.inc(len(chunk))
+            yield chunk
+
+
 class CTyunNodeSize(NodeSize):
     def __init__(self, id, name, cpu, ram, disk, price, driver):
         self.id = id
@@ -63,6 +168,8 @@ class CTyunConnection(ConnectionUserAndKey):
     host = CTYUN_API_HOST
     secure = True
     responseCls = CTyunResponse
+    rawResponseCls = CTyunStreamResponse
+    conn_class = CTyunHttpConnection
     allow_insecure = True
 
     def add_default_headers(self, headers):
@@ -70,20 +177,115 @@ class CTyunConnection(ConnectionUserAndKey):
         headers['Authorization'] = 'Basic %s' % user_b64
         return headers
 
+    def request(self, action, *args, **kwargs):
+        """
+        ConnectionUserAndKey.request through the retry policy and circuit breaker of the driver if any,
+        identical reads in flight share one call when the driver coalesces them, streamed ones excepted
+        """
+        coalescer = getattr(self.driver, 'coalescer', None)
+        if coalescer is not None and coalescer.coalesces(action) and not kwargs.get('raw'):
+            return coalescer.request(action, kwargs.get('data'), lambda: self._request(action, *args, **kwargs))
+        return self._request(action, *args, **kwargs)
+
+    def _request(self, action, *args, **kwargs):
+        retry_policy = getattr(self.driver, 'retry_policy', None)
+        if retry_policy is None:
+            return self._attempt(action, self.timeout, *args, **kwargs)
+        return retry_policy.call(action, lambda timeout: self._attempt(action, timeout, *args, **kwargs),
+                timeout=self.timeout)
+
+    def _attempt(self, action, timeout, *args, **kwargs):
+        """
+        Send the request once within timeout seconds, held back first by the rate limiter of the driver
+        if any, and recorded in the ctyun_* metrics labelled by action.
+        The rate limit wait counts in timeout, a call which would wait past it fails with DeadlineExceededError
+        """
+        rate_limiter = getattr(self.driver, 'rate_limiter', None)
+        if rate_limiter is not None:
+            max_wait = timeout if isinstance(timeout, (int, float)) else None
+            waited = rate_limiter.acquire(self.user_id, action, max_wait)
+            CTYUN_RATE_LIMIT_WAIT_SECONDS.labels(action).observe(waited)
+            if max_wait is not None:
+                timeout = max_wait - waited
+        if self.connection is None:
+            self.connect()
+        with self.connection.call_timeout(timeout), track_ctyun_request(action, kwargs.get('data')) as tracked:
+            response = super(CTyunConnection, self).request(action, *args, **kwargs)
+            if kwargs.get('raw'):
+                # the body is counted as it is streamed
+                response.action = action
+                response.raise_for_status()
+                tracked.done(response.status, None)
+            else:
+                tracked.done(response.status, response.body, response.object)
+        return response
+
 
 class CTyunNodeDriver(NodeDriver):
     connectionCls = CTyunConnection
     api_name = 'ctyun'
     name = 'CTyun'
 
-    def __init__(self, key, secret=None, secure=False, host=None, port=None, **kwargs):
+    def __init__(self, key, secret=None, secure=False, host=None, port=None,
+            ex_catalog_cache=True, ex_catalog_cache_size=128, ex_catalog_ttl=None,
+            ex_catalog_stale_ttl=CTYUN_CATALOG_STALE_TTL, ex_pool_size=None, ex_pool_idle_timeout=60,
+            ex_rate_limits=None, ex_rate_limit_file=None, ex_max_attempts=3, ex_retry_classes=('read',),
+            ex_call_deadline=30, ex_breaker_threshold=5, ex_breaker_reset_timeout=30, ex_coalesce_reads=True,
+            ex_coalesce_dir=None, **kwargs):
+        """
+        :param ex_catalog_cache: serve list_zone, list_vm_type and list_os from memory
+        :param ex_catalog_cache_size: max cached catalog responses, least recently used are evicted
+        :param ex_catalog_ttl: dict overriding CTYUN_CATALOG_TTL per func name
+        :param ex_catalog_stale_ttl: seconds an expired catalog response is served while it is reloaded
+        :param ex_pool_size: share a thread-safe pool of this many keep-alive connections between threads,
+            None keeps the single libcloud connection
+        :param ex_pool_idle_timeout: seconds an unused pooled connection is kept open
+        :param ex_rate_limits: dict of endpoint class or (access key, endpoint class) to (calls per second, burst),
+            see CTyunRateLimiter, calls over the limit wait for their turn
+        :param ex_rate_limit_file: file sharing the rate limits between the processes of the host,
+            rate limiting with CTYUN_DEFAULT_RATE_LIMITS when ex_rate_limits is not given
+        :param ex_max_attempts: attempts of a call failing with a timeout, a connection error or a 429/5xx,
+            1 disables retries
+        :param ex_retry_classes: endpoint classes retried, reads only by default as writes and orders
+            are not idempotent
+        :param ex_call_deadline: seconds a call may take with all its attempts, None for no deadline
+        :param ex_breaker_threshold: transient failures in a row opening the circuit of an endpoint,
+            None disables the circuit breaker
+        :param ex_breaker_reset_timeout: seconds an open circuit fails fast before a trial call
+        :param ex_coalesce_reads: identical concurrent reads share one call and its response
+        :param ex_coalesce_dir: directory shared by the processes of the host to coalesce their reads too
+        """
         host = host or CTYUN_API_HOST
         self.accesskey = key or ''
         self.screctkey = secret or ''
+        self.signer = VKeySigner(self.accesskey, self.screctkey)
+        self._local = threading.local()
+        self._worker_pool = None
+        self._worker_pool_lock = threading.Lock()
+        self.catalog_cache = TTLCache(maxsize=ex_catalog_cache_size) if ex_catalog_cache else None
+        self.catalog_ttl = dict(CTYUN_CATALOG_TTL, **(ex_catalog_ttl or {}))
+        self.catalog_stale_ttl = ex_catalog_stale_ttl
+        self.pool = None
+        self.rate_limiter = None
+        if ex_rate_limits is not None or ex_rate_limit_file is not None:
+            self.rate_limiter = CTyunRateLimiter(limits=ex_rate_limits, path=ex_rate_limit_file)
+        breaker = None
+        if ex_breaker_threshold:
+            breaker = CTyunCircuitBreaker(failure_threshold=ex_breaker_threshold,
+                    reset_timeout=ex_breaker_reset_timeout)
+        self.retry_policy = CTyunRetryPolicy(max_attempts=ex_max_attempts, deadline=ex_call_deadline,
+                retry_classes=ex_retry_classes, breaker=breaker)
+        self.coalescer = None
+        if ex_coalesce_reads or ex_coalesce_dir:
+            self.coalescer = CTyunRequestCoalescer(directory=ex_coalesce_dir)
         super(CTyunNodeDriver, self).__init__(key=key, secret=secret,
                 secure=secure,
                 host=host, port=port,
                 **kwargs)
+        if ex_pool_size:
+            self.pool = CTyunConnectionPool(self._new_connection, size=ex_pool_size,
+                    idle_timeout=ex_pool_idle_timeout)
+            self._pooled_connection = PooledConnection(self.pool, self._connection)
 
         # libcloud driver public func #
     def list_nodes(self, page_no=1, page_size=2):
@@ -119,620 +321,422 @@ class CTyunNodeDriver(NodeDriver):
         response_json = self.get_data_disk_list(zone_id=zone_id, page_no=page_no, page_size=page_size)
         vols_json = response_json['returnObj']['DiskList']
         vols = [self._to_volume(el) for el in vols_json]
-        print(vols)
         return vols
 
-    # CTyun func#
-    def list_zone(self):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey)
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/loadZoneList', headers=headers, data=data, method='POST')
-
-        return json.loads(result.body)
-
-    def list_vm_type(self):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey)
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/loadVMTypeList', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def list_os(self, zoneid):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, zoneid),
-                'zoneId': zoneid
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/loadOSList', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_new_order_price(self, cpu, memory, datahd, os, bw, ordernum, periodtype, periodnum, zoneid):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, cpu, memory, datahd, os, bw, ordernum, periodtype,
-                    periodnum, zoneid),
-                'cpu': cpu,
-                'memory': memory,
-                'datahd': datahd,
-                'os': os,
-                'bw': bw,
-                'orderNum': ordernum,
-                'periodType': periodtype,
-                'periodNum': periodnum,
-                'zoneId': zoneid
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getNewOrderPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def buy_cloud(self, cpu, memory, datahd, os, bw, ordernum, periodtype, periodnum, zoneid):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, cpu, memory, datahd, os, bw, ordernum, periodtype,
-                    periodnum, zoneid),
-                'cpu': cpu,
-                'memory': memory,
-                'datahd': datahd,
-                'os': os,
-                'bw': bw,
-                'orderNum': ordernum,
-                'periodType': periodtype,
-                'periodNum': periodnum,
-                'zoneId': zoneid
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/buyCloud', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_renew_order_price(self, periodtype, periodnum, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, periodtype, periodnum, vm_id),
-                'periodType': periodtype,
-                'periodNum': periodnum,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getRenewOrderPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def renew_cloud(self, periodtype, periodnum, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, periodtype, periodnum, vm_id),
-                'periodType': periodtype,
-                'periodNum': periodnum,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/renewCloud', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_upgrade_order_price(self, cpu, memory, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, cpu, memory, vm_id),
-                'cpu': cpu,
-                'memory': memory,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getUpgradeOrderPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def upgrade_cloud(self, cpu, memory, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, cpu, memory, vm_id),
-                'cpu': cpu,
-                'memory': memory,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/upgradeCloud', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_data_disk_price(self, datahd=10, periodnum=1, zoneid=1):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, datahd, periodnum, zoneid),
-                'datahd': datahd,
-                'periodNum': periodnum,
-                'zoneId': zoneid
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getDatadiskPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def buy_data_disk(self, datahd, periodnum=1, zoneid=1):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, datahd, periodnum, zoneid),
-                'datahd': datahd,
-                'periodNum': periodnum,
-                'zoneId': zoneid
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/buyDatadisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def iter_nodes(self, page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1, compact=False, stream=False):
+        """
+        Walk every page of getVMList, yielding nodes as each page arrives
+        :param page_size: Page Size
+        :param concurrency: max pages fetched at the same time
+        :param compact: yield CTyunNodeRecord instead, e.g. to hold the whole fleet in memory
+        :param stream: decode each page node by node as it arrives, pages one at a time,
+            so large page sizes cost one node of memory instead of a page
+        :return: generator of Node Objects
+        """
+        to_node = self._to_node_record if compact else self._to_node
+        for element in self._listing('get_vm_list', page_size, concurrency, stream):
+            yield to_node(element)
 
-    def get_renew_data_disk_price(self, disk_id, periodnum):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, periodnum),
-                'diskId': disk_id,
-                'periodNum': periodnum
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def iter_volumes(self, zone_id=1, page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1, compact=False,
+            stream=False):
+        """
+        Walk every page of getDatadiskList, yielding volumes as each page arrives
+        :param zone_id: Zone Id
+        :param page_size: Page Size
+        :param concurrency: max pages fetched at the same time
+        :param compact: yield CTyunVolumeRecord instead, with zone_id as their zoneId
+        :param stream: decode each page volume by volume as it arrives, see iter_nodes
+        :return: generator of StorageVolume Objects
+        """
+        for element in self._listing('get_data_disk_list', page_size, concurrency, stream, zone_id=zone_id):
+            yield self._to_volume_record(element, zone_id) if compact else self._to_volume(element)
 
-        result = self.connection.request('/api/getRenewDatadiskPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def iter_snapshots(self, zone_id=1, page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1, compact=False,
+            stream=False):
+        """
+        Walk every page of snapshotList, yielding snapshots as each page arrives
+        :param zone_id: Zone Id
+        :param page_size: Page Size
+        :param concurrency: max pages fetched at the same time
+        :param compact: yield CTyunSnapshotRecord instead, with zone_id as their zoneId when they have none
+        :param stream: decode each page snapshot by snapshot as it arrives, see iter_nodes
+        :return: generator of VolumeSnapshot Objects
+        """
+        for element in self._listing('get_snapshot_list', page_size, concurrency, stream, zone_id=zone_id):
+            yield self._to_snapshot_record(element, zone_id) if compact else self._to_snapshot(element)
 
-    def renew_data_disk(self, disk_id, periodnum):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, periodnum),
-                'diskId': disk_id,
-                'periodNum': periodnum
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/renewDatadisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_upgrade_bandwidth_price(self, bw, zone_id, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, bw, zone_id, vm_id),
-                'bw': bw,
-                'zoneId': zone_id,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getUpgradeBandwidthPrice', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def upgrade_bandwidth(self, bw, zone_id, vm_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, bw, zone_id, vm_id),
-                'bw': bw,
-                'zoneId': zone_id,
-                'id': vm_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def iter_orders(self, page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1, stream=False):
+        """
+        Walk every page of getOrderList, yielding the order json as each page arrives
+        :param page_size: Page Size
+        :param concurrency: max pages fetched at the same time
+        :param stream: decode each page order by order as it arrives, see iter_nodes
+        :return: generator of order dicts
+        """
+        return self._listing('get_order_list', page_size, concurrency, stream)
 
-        result = self.connection.request('/api/upgradeBandwidth', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def ex_start_nodes(self, nodes, concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        :param nodes: Node Objects to start
+        :param concurrency: max calls in flight
+        :return: list of CTyunBulkResult in nodes order
+        """
+        return self._run_bulk(lambda node: self.start_vm(node.id), nodes, concurrency)
 
-    def pay_order(self, order_id, cash):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, order_id, cash),
-                'orderId': order_id,
-                'cash': cash
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def ex_stop_nodes(self, nodes, concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        :param nodes: Node Objects to stop
+        :param concurrency: max calls in flight
+        :return: list of CTyunBulkResult in nodes order
+        """
+        return self._run_bulk(lambda node: self.stop_vm(node.id), nodes, concurrency)
 
-        result = self.connection.request('/api/payOrder', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def ex_reboot_nodes(self, nodes, concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        :param nodes: Node Objects to reboot
+        :param concurrency: max calls in flight
+        :return: list of CTyunBulkResult in nodes order
+        """
+        return self._run_bulk(lambda node: self.restart_vm(node.id), nodes, concurrency)
 
-    def refund_cloud(self, vm_id, refund_detail):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id, refund_detail),
-                'id': vm_id,
-                'refundDetail': refund_detail
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def ex_band_data_disks(self, pairs, concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        :param pairs: (disk_id, vm_id) tuples to bind
+        :param concurrency: max calls in flight
+        :return: list of CTyunBulkResult in pairs order
+        """
+        return self._run_bulk(lambda pair: self.band_data_disk(*pair), pairs, concurrency)
 
-        result = self.connection.request('/api/refundCloud', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def ex_unband_data_disks(self, pairs, concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        :param pairs: (disk_id, vm_id) tuples to unbind
+        :param concurrency: max calls in flight
+        :return: list of CTyunBulkResult in pairs order
+        """
+        return self._run_bulk(lambda pair: self.unband_data_disk(*pair), pairs, concurrency)
 
-    def refund_disk(self, disk_id, refund_detail):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, refund_detail),
-                'diskId': disk_id,
-                'refundDetail': refund_detail
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def ex_catalog_cache_stats(self):
+        """
+        :return: hit/miss counters of the catalog cache, None when it is disabled
+        """
+        if self.catalog_cache is None:
+            return None
+        return self.catalog_cache.stats()
 
-        result = self.connection.request('/api/refundDisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def ex_pool_stats(self):
+        """
+        :return: usage counters of the connection pool, None when pooling is disabled
+        """
+        if self.pool is None:
+            return None
+        return self.pool.stats()
 
-    def get_order_list(self, page_no=1, page_size=2):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, page_no, page_size),
-                'pageNo': page_no,
-                'pageSize': page_size
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def ex_close(self):
+        """
+        Close the http sessions of the driver and of its pool, a later call opens new ones
+        """
+        for pool in (self.pool, self._worker_pool):
+            if pool is not None:
+                pool.close()
+        session = getattr(self._connection.connection, 'session', None)
+        if session is not None:
+            session.close()
+        if self.rate_limiter is not None:
+            self.rate_limiter.close()
+
+    def ex_warm_up(self, zone_ids=None):
+        """
+        Fill the catalog cache ahead of the first requests: list_zone and list_vm_type, then list_os of
+        every zone, sent concurrently so the pool opens a keep-alive connection for each call in flight
+        :param zone_ids: zones of list_os, defaults to the zones of list_zone
+        :return: list of CTyunBulkResult
+        """
+        concurrency = self.pool.size if self.pool is not None else 1
+        results = self._run_bulk(lambda func: func(), [self.list_zone, self.list_vm_type], concurrency)
+        if zone_ids is None:
+            zones = results[0].result.get('returnObj') if results[0].success else None
+            zone_ids = [zone['zoneId'] for zone in zones or [] if isinstance(zone, dict) and 'zoneId' in zone]
+        return results + self._run_bulk(self.list_os, zone_ids, concurrency)
+
+    def ex_get_fleet_topology(self, zone_id=1, nodes=None, page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1,
+            fallback_concurrency=CTYUN_DEFAULT_BULK_CONCURRENCY):
+        """
+        Each VM of a zone with its data disks and snapshots, in a constant number of listings per zone
+        instead of one getDiskListByVmId and one getSnapshotsByVmId per VM.
+
+        getDatadiskList and snapshotList of the zone are walked once and hash joined to the VMs:
+        disks by vmId, else by vmName when one VM has it, snapshots by vmId. The per VM apis are only called
+        for the VMs sharing the vmName of a disk without vmId, or for every VM when a listing fails.
+        :param zone_id: Zone Id
+        :param nodes: the VMs to join, e.g. a page of a fleet view, defaults to every VM of the zone
+        :param page_size: Page Size of the listings
+        :param concurrency: max pages fetched at the same time
+        :param fallback_concurrency: max per VM calls in flight
+        :return: CTyunTopology
+        """
+        if nodes is None:
+            nodes = [node for node in self.iter_nodes(page_size=page_size, concurrency=concurrency)
+                    if str(node.extra.get('zoneId')) == str(zone_id)]
+        nodes = list(nodes)
+        node_ids = set(node.id for node in nodes)
+        ids_by_name = {}
+        for node in nodes:
+            ids_by_name.setdefault(node.name, []).append(node.id)
+        volumes = dict((node.id, []) for node in nodes)
+        snapshots = dict((node.id, []) for node in nodes)
+        unattached_volumes = []
+        unattached_snapshots = []
+
+        fallback_volumes = set()
+        elements = self._zone_elements('get_data_disk_list', zone_id, page_size, concurrency)
+        if elements is None:
+            fallback_volumes.update(node_ids)
+            elements = []
+        for element in elements:
+            vm_id = element.get('vmId')
+            if vm_id:
+                owners = [vm_id] if vm_id in node_ids else []
+            elif element.get('vmName'):
+                owners = ids_by_name.get(element['vmName'], [])
+            else:
+                owners = []
+            if len(owners) == 1:
+                volumes[owners[0]].append(self._to_volume(element))
+                continue
+            if owners:
+                # the disk belongs to one of the VMs with its name, their own listing tells which
+                fallback_volumes.update(owners)
+            unattached_volumes.append(self._to_volume(element))
+
+        fallback_snapshots = set()
+        elements = self._zone_elements('get_snapshot_list', zone_id, page_size, concurrency)
+        if elements is None:
+            fallback_snapshots.update(node_ids)
+            elements = []
+        for element in elements:
+            vm_id = element.get('vmId')
+            if vm_id in node_ids:
+                snapshots[vm_id].append(self._to_snapshot(element))
+            else:
+                unattached_snapshots.append(self._to_snapshot(element))
+
+        # the per VM apis name their lists as the zone listings do
+        disk_list_key = CTYUN_LIST_KEYS[CTYUN_ENDPOINTS_BY_NAME['get_data_disk_list'].path]
+        snapshot_list_key = CTYUN_LIST_KEYS[CTYUN_ENDPOINTS_BY_NAME['get_snapshot_list'].path]
+        for result in self._run_bulk(self.get_disk_list_by_vmid, sorted(fallback_volumes), fallback_concurrency):
+            volumes[result.item] = [self._to_volume(element) for element in
+                    (result.result.get('returnObj') or {}).get(disk_list_key) or []] if result.success else None
+        if fallback_volumes:
+            # the disks found by the per VM listings are no longer unattached
+            attached = set(volume.id for vm_id in fallback_volumes for volume in volumes[vm_id] or ())
+            unattached_volumes = [volume for volume in unattached_volumes if volume.id not in attached]
+        for result in self._run_bulk(lambda vm_id: self.get_snapshots_by_vmid(vm_id, zone_id),
+                sorted(fallback_snapshots), fallback_concurrency):
+            snapshots[result.item] = [self._to_snapshot(element) for element in
+                    (result.result.get('returnObj') or {}).get(snapshot_list_key) or []] if result.success else None
+
+        return CTyunTopology([CTyunTopologyEntry(node, volumes[node.id], snapshots[node.id]) for node in nodes],
+                unattached_volumes, unattached_snapshots)
+
+    def _zone_elements(self, name, zone_id, page_size, concurrency):
+        """
+        :param name: paginated listing func of a zone, e.g. 'get_data_disk_list'
+        :return: list of every json element of the listing, None when a page failed
+        """
+        try:
+            return list(self._listing(name, page_size, concurrency, False, zone_id=zone_id))
+        except (CTyunListingError, BaseHTTPError, requests.RequestException, CircuitOpenError,
+                DeadlineExceededError) as e:
+            logger.warning('%s of zone %s failed, falling back to per-VM calls: %s', name, zone_id, e)
+            return None
 
-        result = self.connection.request('/api/getOrderList', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    @staticmethod
+    def _is_success(response_json):
+        return isinstance(response_json, dict) and response_json.get('returnCode') == 200
 
-    def get_order_detail(self, order_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, order_id),
-                'orderId': order_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    def _iter_pages(self, fetch, list_key, page_size, concurrency=1, **kwargs):
+        """
+        Fetch a paginated listing and yield its elements in page order
 
-        result = self.connection.request('/api/getOrderDetail', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+        With concurrency > 1 the total count is read from the first page and the
+        remaining pages are fetched by a thread pool, each worker on its own or a pooled connection.
+        At most 2 * concurrency pages are buffered, whatever the size of the listing.
+        :param fetch: listing func taking page_no and page_size, e.g. self.get_vm_list
+        :param list_key: key of the item list inside returnObj
+        :param page_size: Page Size
+        :param concurrency: max pages fetched at the same time
+        :param kwargs: other params of the listing func
+        :return: generator of json elements
+        """
+        if page_size < 1:
+            raise Exception('Invalid param page_size must be positive')
+        if concurrency < 1:
+            raise Exception('Invalid param concurrency must be positive')
+
+        page_no = 1
+        fetched = 0
+        while True:
+            elements, total = self._fetch_page(fetch, list_key, page_no, page_size, **kwargs)
+            for element in elements:
+                yield element
+
+            fetched += len(elements)
+            if len(elements) < page_size or (total is not None and fetched >= total):
+                return
+            if concurrency > 1 and total is not None:
+                break
+            page_no += 1
+
+        last_page = (total + page_size - 1) // page_size
+        pages = iter(range(page_no + 1, last_page + 1))
+        fetch_page = self._on_worker_connection(self._fetch_page, concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = deque()
+            for page_no in islice(pages, 2 * concurrency):
+                pending.append(executor.submit(fetch_page, fetch, list_key, page_no, page_size, **kwargs))
+            while pending:
+                elements, _ = pending.popleft().result()
+                page_no = next(pages, None)
+                if page_no is not None:
+                    pending.append(executor.submit(fetch_page, fetch, list_key, page_no, page_size, **kwargs))
+                for element in elements:
+                    yield element
+
+    def _listing(self, name, page_size, concurrency, stream, **kwargs):
+        """
+        :param name: paginated listing func, e.g. 'get_vm_list'
+        :return: generator of its json elements, see _iter_pages and _stream_pages
+        """
+        list_key = CTYUN_LIST_KEYS[CTYUN_ENDPOINTS_BY_NAME[name].path]
+        if stream:
+            return self._stream_pages(name, list_key, page_size, **kwargs)
+        return self._iter_pages(getattr(self, name), list_key, page_size, concurrency=concurrency, **kwargs)
 
-    def cancel_order(self, order_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, order_id),
-                'orderId': order_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/cancelOrder', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def buy_trial_cloud(self, cpu, memory, datahd, os, bw, zone_id):
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, cpu, memory, datahd, os, bw, zone_id),
-                'cpu': cpu,
-                'memory': memory,
-                'datahd': datahd,
-                'os': os,
-                'bw': bw,
-                'zoneId': zone_id
-                }
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/buyTrialCloud', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_vm_list(self, page_no=1, page_size=2):
-        # int:pageNo, page No.
-        # int:pageSize, items of each page
-        # int:uid, user id
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, page_no, page_size),
-                'pageNo': page_no,
-                'pageSize': page_size}
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        result = self.connection.request('/api/getVMList', headers=headers, data=data, method='POST')
-        # json_obj = json.loads(result.body)
-        return json.loads(result.body)
-    # return result.body
-
-    def get_vm_list_by_orderid(self, order_id):
-        # str:order_id
-        # str:uid
-        if not order_id:
-            raise Exception('Invalid param order_id is empty')
-
-        data = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, order_id),
-                'orderId': order_id}
-        data = urlencode(data)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getVMListByOrderId', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_vm_detail_info(self, vm_id):
-        # str:id, vm id
-        # str:uid, user id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getVMDetailInfo', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_vm_password(self, vm_id):
-        # str:id, vm id
-        # str:uid, user id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getVMPassword', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def reset_vm_password(self, vm_id):
-        # str:id, vm id
-        # str:uid, user id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/resetVMPassword', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_vm_status(self, vm_id):
-        # str:id, vm id
-        # str:uid, user id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getVMStatus', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def start_vm(self, vm_id):
-        # str:id, vm id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/startVM', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def stop_vm(self, vm_id):
-        # str:id, vm id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/stopVM', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def restart_vm(self, vm_id):
-        # str:id, vm id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/restartVM', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_reinstall_os(self, vm_id):
-        # str:id, vm id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getreinstallOS', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def reinstall_vm(self, vm_id, os_type=1):
-        # str:id, vm id
-        # int:os,
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id, os_type),
-                'id': vm_id,
-                'os': os_type}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/reinstallVM', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_data_disk_list(self, zone_id=1, page_no=1, page_size=1):
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, page_no, page_size, zone_id),
-                'pageNo': page_no,
-                'pageSize': page_size,
-                'zoneId': zone_id, }
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getDatadiskList', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_disk_list_by_orderid(self, order_id):
-        # str:order_id, order id
-        if not order_id:
-            raise Exception('Invalid param order_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, order_id),
-                'orderId': order_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getDiskListByOrderId', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_disk_list_by_vmid(self, vm_id):
-        # str:id, vm id
-        # str:uid, user id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id),
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getDiskListByVmId', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def rename_data_disk(self, disk_id, new_name='renameme', zone_id=1):
-        # str:disk_id, disk id
-        if not disk_id:
-            raise Exception('Invalid param disk_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, new_name, zone_id),
-                'diskId': disk_id,
-                'newName': new_name,
-                'zoneId': zone_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/renameDatadisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def band_data_disk(self, disk_id, vm_id):
-        # str:disk_id, disk id
-        # str:id, vm id
-        if not disk_id:
-            raise Exception('Invalid param disk_id is empty')
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, vm_id),
-                'diskId': disk_id,
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/bandDatadisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def unband_data_disk(self, disk_id, vm_id):
-        # str:disk_id, disk id
-        # str:id, vm id
-        if not disk_id:
-            raise Exception('Invalid param disk_id is empty')
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id, vm_id),
-                'diskId': disk_id,
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/unbandDatadisk', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_disk_status(self, disk_id):
-        # str:disk_id, disk id
-        # str:id, vm id
-        if not disk_id:
-            raise Exception('Invalid param disk_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, disk_id),
-                'diskId': disk_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getDiskStatus', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_snapshot_list(self, zone_id=1, page_no=1, page_size=1):
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, zone_id, page_no, page_size),
-                'pageNo': page_no,
-                'pageSize': page_size,
-                'zoneId': zone_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/snapshotList', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def create_snapshot(self, vm_id, snapshot_name='renameme'):
-        # str:id, vm id
-        if not vm_id:
-            raise Exception('Invalid param vm_id is empty')
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id, snapshot_name),
-                'snapshotName': snapshot_name,
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/createSnapshot', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_vm_snapshot_status(self, snapshot_id, zone_id=1):
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, snapshot_id, zone_id),
-                'snapshotId': snapshot_id,
-                'zoneId': zone_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/vmSnapshotStatus', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def remove_snapshot(self, vm_id, snapshot_id):
-        if not vm_id:
-            raise Exception('Invalid param: vm_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id, snapshot_id),
-                'snapshotId': snapshot_id,
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/removeSnapshot', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def rollback_snapshot(self, zone_id, snapshot_id):
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, snapshot_id, zone_id),
-                'snapshotId': snapshot_id,
-                'zoneId': zone_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/rollbackSnapshot', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
-
-    def get_snapshots_by_vmid(self, vm_id, zone_id):
-        if not vm_id:
-            raise Exception('Invalid param: vm_id is empty')
-        if not zone_id:
-            raise Exception('Invalid param: zone_id is empty')
-
-        request_body = {'accessKey': self.accesskey,
-                'vKey': md5(self.accesskey, self.screctkey, vm_id, zone_id),
-                'zoneId': zone_id,
-                'id': vm_id}
-        data = urlencode(request_body)
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        result = self.connection.request('/api/getSnapshotsByVmId', headers=headers, data=data, method='POST')
-        return json.loads(result.body)
+    def _stream_pages(self, name, list_key, page_size, **kwargs):
+        """
+        Walk a paginated listing one page after the other, decoding the elements of each page
+        one at a time as its bytes arrive: besides the body chunk being read, only the element being
+        decoded is held, whatever page_size
+        :param name: paginated listing func, e.g. 'get_vm_list'
+        :param list_key: key of the item list inside returnObj
+        :param kwargs: other params of the listing func
+        :return: generator of json elements
+        """
+        if page_size < 1:
+            raise Exception('Invalid param page_size must be positive')
+
+        path = CTYUN_ENDPOINTS_BY_NAME[name].path
+        builder = CTYUN_FORM_BUILDERS[name]
+        page_no = 1
+        fetched = 0
+        while True:
+            data = builder.build(self.signer, (), dict(kwargs, page_no=page_no, page_size=page_size))
+            response = self.connection.request(path, headers=CTYUN_FORM_HEADERS, data=data, method='POST',
+                    raw=True, stream=True)
+            elements = response.iter_items(('returnObj', list_key))
+            count = 0
+            try:
+                for element in elements:
+                    count += 1
+                    yield element
+            finally:
+                response.close()
+
+            document = elements.document
+            if not self._is_success(document):
+                if isinstance(document, dict) and document.get('returnCode') is not None:
+                    CTYUN_ERRORS.labels(path, 'api', document['returnCode']).inc()
+                raise CTyunListingError(name, document)
+            return_obj = document.get('returnObj') if isinstance(document, dict) else None
+            total = return_obj.get(CTYUN_TOTAL_KEY) if isinstance(return_obj, dict) else None
+            fetched += count
+            if count < page_size or (total is not None and fetched >= int(total)):
+                return
+            page_no += 1
+
+    def _run_bulk(self, call, items, concurrency):
+        """
+        Run call on every item with at most concurrency calls in flight, a failing item never stops the others
+        :param call: func taking one item and returning the response json
+        :return: list of CTyunBulkResult in items order
+        """
+        if concurrency < 1:
+            raise Exception('Invalid param concurrency must be positive')
+
+        def run(item):
+            try:
+                response_json = call(item)
+            except Exception as e:
+                return CTyunBulkResult(item, False, None, e)
+            return CTyunBulkResult(item, self._is_success(response_json), response_json, None)
+
+        items = list(items)
+        if not items:
+            return []
+        concurrency = min(concurrency, len(items))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self._on_worker_connection(run, concurrency), items))
+
+    def _fetch_page(self, fetch, list_key, page_no, page_size, **kwargs):
+        """
+        :return: (elements of the page, total count or None)
+        """
+        response_json = fetch(page_no=page_no, page_size=page_size, **kwargs)
+        if not self._is_success(response_json):
+            # an empty page would end the walk as if the listing were complete
+            raise CTyunListingError(getattr(fetch, '__name__', fetch), response_json)
+        return_obj = response_json.get('returnObj') or {}
+        total = return_obj.get(CTYUN_TOTAL_KEY)
+        return return_obj.get(list_key) or [], (int(total) if total is not None else None)
+
+    @property
+    def connection(self):
+        """
+        The connection of the current thread: a worker of a parallel listing gets its own,
+        otherwise the pool when pooling is enabled, else the single driver connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            return connection
+        if self.pool is not None:
+            return self._pooled_connection
+        return self._connection
+
+    @connection.setter
+    def connection(self, connection):
+        self._connection = connection
+
+    def _new_connection(self):
+        template = self._connection
+        connection = self.connectionCls(self.key, self.secret, self.secure,
+                template.host, template.port, timeout=template.timeout)
+        connection.driver = self
+        connection.connect()
+        return connection
+
+    def _on_worker_connection(self, func, concurrency):
+        """
+        :return: func run by a worker thread on a connection of its own: the pool when pooling is enabled,
+            else one borrowed for the call from the worker connections kept alive across the parallel calls
+        """
+        if self.pool is not None:
+            return func
+        with self._worker_pool_lock:
+            if self._worker_pool is None:
+                self._worker_pool = CTyunConnectionPool(self._new_connection, size=concurrency,
+                        idle_timeout=CTYUN_WORKER_IDLE_TIMEOUT)
+            pool = self._worker_pool
+            pool.size = max(pool.size, concurrency)
+
+        def run(*args, **kwargs):
+            connection = pool.acquire()
+            self._local.connection = connection
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.connection = None
+                pool.release(connection)
+        return run
 
     def _to_nodes(self, objects):
         return [self._to_node(el) for el in objects]
@@ -782,3 +786,81 @@ class CTyunNodeDriver(NodeDriver):
 
         return StorageVolume(id=disk_id, name=name, size=int(size),
                 driver=self, state=state, extra=extra)
+
+    def _to_snapshot(self, element):
+        """
+        Convert the json data to a Volume Snapshot Object
+        :param element: json element
+        :return: a VolumeSnapshot Object
+        """
+        snapshot_id = element.get('snapshotId', element.get('id'))
+        extra = {
+                'vmId': element.get('vmId'),
+                'zoneId': element.get('zoneId'),
+                'status': element.get('status'),
+                }
+
+        return VolumeSnapshot(id=snapshot_id, driver=self, size=element.get('size'),
+                extra=extra, created=element.get('createDate'),
+                state=element.get('status'), name=element.get('snapshotName'))
+
+    def _to_node_record(self, element):
+        """
+        :return: a CTyunNodeRecord with the fields of _to_node
+        """
+        return CTyunNodeRecord(element['id'], element['vmName'], CTYUN_NODE_STATE[element['vmStatus']],
+                element['publicIP'], element['privateIP'], element['applyDate'], element['dueDate'],
+                element['zoneId'], self)
+
+    def _to_volume_record(self, element, zone_id=None):
+        """
+        :return: a CTyunVolumeRecord with the fields of _to_volume
+        """
+        return CTyunVolumeRecord(element['id'], element['diskName'], CTYUN_VOLUME_STATE[element['diskStatus']],
+                int(element['diskSize']), element['diskId'], element['isSysVolume'], element['isPackaged'],
+                CTYUN_VOLUME_STATE[str(element['status'])], element['applyDate'], element['dueDate'],
+                element['vmName'], zone_id, self)
+
+    def _to_snapshot_record(self, element, zone_id=None):
+        """
+        :return: a CTyunSnapshotRecord with the fields of _to_snapshot
+        """
+        snapshot_zone_id = element.get('zoneId')
+        return CTyunSnapshotRecord(element.get('snapshotId', element.get('id')), element.get('snapshotName'),
+                element.get('status'), element.get('size'), element.get('createDate'), element.get('vmId'),
+                zone_id if snapshot_zone_id is None else snapshot_zone_id, self)
+
+
+def _response_json(result):
+    """
+    :return: the body as parsed once by CTyunResponse, shared with the coalesced callers and the caches
+        so it must not be changed, a body which is not json is parsed here to raise as before
+    """
+    response_json = getattr(result, 'object', None)
+    if isinstance(response_json, (dict, list)):
+        return response_json
+    return json.loads(result.body)
+
+
+def _endpoint_method(endpoint):
+    builder = CTYUN_FORM_BUILDERS[endpoint.name]
+    path = endpoint.path
+
+    def method(self, *args, **kwargs):
+        data = builder.build(self.signer, args, kwargs)
+        result = self.connection.request(path, headers=CTYUN_FORM_HEADERS, data=data, method='POST')
+        return _response_json(result)
+
+    method.__name__ = endpoint.name
+    method.__qualname__ = 'CTyunNodeDriver.%s' % endpoint.name
+    method.__doc__ = 'Posts %s, returns its json' % endpoint.path
+    method.__signature__ = endpoint_signature(endpoint)
+    if endpoint.name in CTYUN_CATALOG_TTL:
+        method = catalog_cached(method)
+    return method
+
+
+# CTyun func, one per entry of the endpoint table #
+for _endpoint in CTYUN_ENDPOINTS:
+    setattr(CTyunNodeDriver, _endpoint.name, _endpoint_method(_endpoint))
+del _endpoint
@@ -0,0 +1,199 @@
+import inspect
+from collections import namedtuple
+from urllib.parse import quote_plus
+
+from .utils import VKeySigner
+
+# form field name of each func param, params not listed keep their own name
+CTYUN_FIELD_NAMES = {'zoneid': 'zoneId', 'zone_id': 'zoneId', 'vm_id': 'id', 'disk_id': 'diskId',
+        'order_id': 'orderId', 'snapshot_id': 'snapshotId', 'ordernum': 'orderNum',
+        'periodtype': 'periodType', 'periodnum': 'periodNum', 'page_no': 'pageNo',
+        'page_size': 'pageSize', 'refund_detail': 'refundDetail', 'new_name': 'newName',
+        'snapshot_name': 'snapshotName', 'os_type': 'os'}
+
+CTyunEndpoint = namedtuple('CTyunEndpoint', ['name', 'path', 'params', 'signed', 'defaults', 'required'])
+
+
+def _endpoint(name, path, params='', signed=None, defaults=None, required=''):
+    """
+    :param name: driver func name
+    :param path: api path
+    :param params: func params in signature order, space separated
+    :param signed: params in vKey order, defaults to the signature order
+    :param defaults: dict of param default values
+    :param required: params which must not be empty, space separated
+    """
+    params = tuple(params.split())
+    signed = tuple(signed.split()) if signed is not None else params
+    return CTyunEndpoint(name, path, params, signed, defaults or {}, tuple(required.split()))
+
+
+_ORDER_PARAMS = 'cpu memory datahd os bw ordernum periodtype periodnum zoneid'
+
+CTYUN_ENDPOINTS = [
+    _endpoint('list_zone', '/api/loadZoneList'),
+    _endpoint('list_vm_type', '/api/loadVMTypeList'),
+    _endpoint('list_os', '/api/loadOSList', 'zoneid'),
+    _endpoint('get_new_order_price', '/api/getNewOrderPrice', _ORDER_PARAMS),
+    _endpoint('buy_cloud', '/api/buyCloud', _ORDER_PARAMS),
+    _endpoint('get_renew_order_price', '/api/getRenewOrderPrice', 'periodtype periodnum vm_id'),
+    _endpoint('renew_cloud', '/api/renewCloud', 'periodtype periodnum vm_id'),
+    _endpoint('get_upgrade_order_price', '/api/getUpgradeOrderPrice', 'cpu memory vm_id'),
+    _endpoint('upgrade_cloud', '/api/upgradeCloud', 'cpu memory vm_id'),
+    _endpoint('get_data_disk_price', '/api/getDatadiskPrice', 'datahd periodnum zoneid',
+            defaults={'datahd': 10, 'periodnum': 1, 'zoneid': 1}),
+    _endpoint('buy_data_disk', '/api/buyDatadisk', 'datahd periodnum zoneid',
+            defaults={'periodnum': 1, 'zoneid': 1}),
+    _endpoint('get_renew_data_disk_price', '/api/getRenewDatadiskPrice', 'disk_id periodnum'),
+    _endpoint('renew_data_disk', '/api/renewDatadisk', 'disk_id periodnum'),
+    _endpoint('get_upgrade_bandwidth_price', '/api/getUpgradeBandwidthPrice', 'bw zone_id vm_id'),
+    _endpoint('upgrade_bandwidth', '/api/upgradeBandwidth', 'bw zone_id vm_id'),
+    _endpoint('pay_order', '/api/payOrder', 'order_id cash'),
+    _endpoint('refund_cloud', '/api/refundCloud', 'vm_id refund_detail'),
+    _endpoint('refund_disk', '/api/refundDisk', 'disk_id refund_detail'),
+    _endpoint('get_order_list', '/api/getOrderList', 'page_no page_size',
+            defaults={'page_no': 1, 'page_size': 2}),
+    _endpoint('get_order_detail', '/api/getOrderDetail', 'order_id'),
+    _endpoint('cancel_order', '/api/cancelOrder', 'order_id'),
+    _endpoint('buy_trial_cloud', '/api/buyTrialCloud', 'cpu memory datahd os bw zone_id'),
+    _endpoint('get_vm_list', '/api/getVMList', 'page_no page_size',
+            defaults={'page_no': 1, 'page_size': 2}),
+    _endpoint('get_vm_list_by_orderid', '/api/getVMListByOrderId', 'order_id', required='order_id'),
+    _endpoint('get_vm_detail_info', '/api/getVMDetailInfo', 'vm_id', required='vm_id'),
+    _endpoint('get_vm_password', '/api/getVMPassword', 'vm_id', required='vm_id'),
+    _endpoint('reset_vm_password', '/api/resetVMPassword', 'vm_id', required='vm_id'),
+    _endpoint('get_vm_status', '/api/getVMStatus', 'vm_id', required='vm_id'),
+    _endpoint('start_vm', '/api/startVM', 'vm_id', required='vm_id'),
+    _endpoint('stop_vm', '/api/stopVM', 'vm_id', required='vm_id'),
+    _endpoint('restart_vm', '/api/restartVM', 'vm_id', required='vm_id'),
+    _endpoint('get_reinstall_os', '/api/getreinstallOS', 'vm_id', required='vm_id'),
+    _endpoint('reinstall_vm', '/api/reinstallVM', 'vm_id os_type', defaults={'os_type': 1},
+            required='vm_id'),
+    _endpoint('get_data_disk_list', '/api/getDatadiskList', 'zone_id page_no page_size',
+            signed='page_no page_size zone_id', defaults={'zone_id': 1, 'page_no': 1, 'page_size': 1}),
+    _endpoint('get_disk_list_by_orderid', '/api/getDiskListByOrderId', 'order_id', required='order_id'),
+    _endpoint('get_disk_list_by_vmid', '/api/getDiskListByVmId', 'vm_id', required='vm_id'),
+    _endpoint('rename_data_disk', '/api/renameDatadisk', 'disk_id new_name zone_id',
+            defaults={'new_name': 'renameme', 'zone_id': 1}, required='disk_id'),
+    _endpoint('band_data_disk', '/api/bandDatadisk', 'disk_id vm_id', required='disk_id vm_id'),
+    _endpoint('unband_data_disk', '/api/unbandDatadisk', 'disk_id vm_id', required='disk_id vm_id'),
+    _endpoint('get_disk_status', '/api/getDiskStatus', 'disk_id', required='disk_id'),
+    _endpoint('get_snapshot_list', '/api/snapshotList', 'zone_id page_no page_size',
+            defaults={'zone_id': 1, 'page_no': 1, 'page_size': 1}),
+    _endpoint('create_snapshot', '/api/createSnapshot', 'vm_id snapshot_name',
+            defaults={'snapshot_name': 'renameme'}, required='vm_id'),
+    _endpoint('get_vm_snapshot_status', '/api/vmSnapshotStatus', 'snapshot_id zone_id',
+            defaults={'zone_id': 1}),
+    _endpoint('remove_snapshot', '/api/removeSnapshot', 'vm_id snapshot_id', required='vm_id'),
+    _endpoint('rollback_snapshot', '/api/rollbackSnapshot', 'zone_id snapshot_id',
+            signed='snapshot_id zone_id'),
+    _endpoint('get_snapshots_by_vmid', '/api/getSnapshotsByVmId', 'vm_id zone_id',
+            required='vm_id zone_id'),
+]
+
+CTYUN_ENDPOINTS_BY_NAME = dict((endpoint.name, endpoint) for endpoint in CTYUN_ENDPOINTS)
+
+
+def endpoint_class(endpoint):
+    """
+    :return: 'order' for the apis placing, paying or cancelling orders, 'read' for the other
+        queries (prices included), 'write' for the apis changing resources
+    """
+    if endpoint.name.startswith(('buy_', 'renew_', 'upgrade_', 'refund_')) or \
+            endpoint.name in ('pay_order', 'cancel_order'):
+        return 'order'
+    if endpoint.name.startswith(('get_', 'list_')):
+        return 'read'
+    return 'write'
+
+
+CTYUN_PATH_CLASSES = dict((endpoint.path, endpoint_class(endpoint)) for endpoint in CTYUN_ENDPOINTS)
+# apis answering secrets, their responses are never shared nor written to disk
+CTYUN_SECRET_PATHS = frozenset(endpoint.path for endpoint in CTYUN_ENDPOINTS
+        if endpoint.name in ('get_vm_password', 'reset_vm_password'))
+
+
+def endpoint_signature(endpoint):
+    """
+    :return: inspect.Signature of the driver func, without self
+    """
+    return inspect.Signature([
+        inspect.Parameter(param, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                default=endpoint.defaults.get(param, inspect.Parameter.empty))
+        for param in endpoint.params])
+
+
+_MISSING = object()
+
+
+def _quote(value):
+    # as urlencode quotes a value
+    return quote_plus(value if isinstance(value, (str, bytes)) else str(value))
+
+
+class CTyunFormBuilder(object):
+    """
+    Signed form body of one endpoint, compiled once from its table entry:
+    params are bound by position without inspect, field names are quoted ahead
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.params = endpoint.params
+        self._positions = dict((param, i) for i, param in enumerate(endpoint.params))
+        self._defaults = tuple(endpoint.defaults.get(param, _MISSING) for param in endpoint.params)
+        self._signed = tuple(self._positions[param] for param in endpoint.signed)
+        self._required = tuple(self._positions[param] for param in endpoint.required)
+        self._fields = tuple('&%s=' % quote_plus(CTYUN_FIELD_NAMES.get(param, param)) for param in endpoint.params)
+
+    def bind(self, args, kwargs):
+        """
+        :return: values of the func params in signature order, defaults applied
+        :raise TypeError: as the func itself would for a wrong call
+        """
+        count = len(self.params)
+        if not kwargs and len(args) == count:
+            return args
+        if len(args) > count:
+            raise TypeError('%s() takes %d positional arguments but %d were given'
+                    % (self.endpoint.name, count, len(args)))
+        values = list(args) + list(self._defaults[len(args):])
+        for name, value in kwargs.items():
+            i = self._positions.get(name)
+            if i is None:
+                raise TypeError("%s() got an unexpected keyword argument '%s'" % (self.endpoint.name, name))
+            if i < len(args):
+                raise TypeError("%s() got multiple values for argument '%s'" % (self.endpoint.name, name))
+            values[i] = value
+        for i, value in enumerate(values):
+            if value is _MISSING:
+                raise TypeError("%s() missing required argument: '%s'" % (self.endpoint.name, self.params[i]))
+        return values
+
+    def build(self, signer, args, kwargs):
+        """
+        :param signer: VKeySigner of the account
+        :return: urlencoded form body, fields in signature order after accessKey and vKey
+        """
+        values = self.bind(args, kwargs)
+        for i in self._required:
+            if not values[i]:
+                raise Exception('Invalid param %s is empty' % self.params[i])
+        parts = ['accessKey=', _quote(signer.access_key), '&vKey=', signer.sign(*[values[i] for i in self._signed])]
+        for field, value in zip(self._fields, values):
+            parts.append(field)
+            parts.append(_quote(value))
+        return ''.join(parts)
+
+
+CTYUN_FORM_BUILDERS = dict((endpoint.name, CTyunFormBuilder(endpoint)) for endpoint in CTYUN_ENDPOINTS)
+# headers of every CTyun call, libcloud copies them before adding its own
+CTYUN_FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def build_form(endpoint, accesskey, secretkey, *args, **kwargs):
+    """
+    Bind the func params, check the required ones and build the signed form body
+    :return: urlencoded form body
+    """
+    return CTYUN_FORM_BUILDERS[endpoint.name].build(VKeySigner(accesskey, secretkey), args, kwargs)
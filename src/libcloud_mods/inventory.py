@@ -0,0 +1,343 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import islice
+
+from .ctyun import CTYUN_DEFAULT_PAGE_SIZE
+
+InventoryDiff = namedtuple('InventoryDiff', ['added', 'changed', 'removed'])
+
+
+def _signature(resource):
+    """
+    :return: hashable value which changes whenever any listed field of the resource changes
+    """
+    return (resource.name, resource.state,
+            tuple(getattr(resource, 'public_ips', ()) or ()),
+            tuple(getattr(resource, 'private_ips', ()) or ()),
+            getattr(resource, 'size', None),
+            tuple(sorted((resource.extra or {}).items())))
+
+
+class IndexedTable(object):
+    """
+    Resources by id plus one secondary index per field, each mapping a value to the set of ids
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: dict of index name to func returning the values of a resource, as a tuple
+        """
+        self.fields = fields
+        self.rows = {}
+        self.signatures = {}
+        self.indexes = dict((name, {}) for name in fields)
+        self._sorted_keys = {}
+        self._sorted_ids = None
+
+    def upsert(self, resource):
+        """
+        :return: 'added', 'changed' or None when the resource is unchanged
+        """
+        signature = _signature(resource)
+        previous = self.rows.get(resource.id)
+        if previous is not None and self.signatures[resource.id] == signature:
+            return None
+        if previous is not None:
+            self._unindex(previous)
+        else:
+            self._sorted_ids = None
+        self.rows[resource.id] = resource
+        self.signatures[resource.id] = signature
+        for name, values in self.fields.items():
+            index = self.indexes[name]
+            for value in values(resource):
+                if value not in index:
+                    index[value] = set()
+                    self._sorted_keys.pop(name, None)
+                index[value].add(resource.id)
+        return 'changed' if previous is not None else 'added'
+
+    def remove(self, resource_id):
+        resource = self.rows.pop(resource_id, None)
+        if resource is not None:
+            del self.signatures[resource_id]
+            self._sorted_ids = None
+            self._unindex(resource)
+        return resource
+
+    def sorted_ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.rows)
+        return self._sorted_ids
+
+    def lookup(self, name, value):
+        return set(self.indexes[name].get(value, ()))
+
+    def range(self, name, low=None, high=None):
+        """
+        :return: ids whose value of index name is between low and high, both inclusive
+        """
+        keys = self._sorted_keys.get(name)
+        if keys is None:
+            keys = self._sorted_keys[name] = sorted(self.indexes[name])
+        start = 0 if low is None else bisect_left(keys, low)
+        end = len(keys) if high is None else bisect_right(keys, high)
+        ids = set()
+        for key in keys[start:end]:
+            ids.update(self.indexes[name][key])
+        return ids
+
+    def _unindex(self, resource):
+        for name, values in self.fields.items():
+            index = self.indexes[name]
+            for value in values(resource):
+                ids = index.get(value)
+                if ids is None:
+                    continue
+                ids.discard(resource.id)
+                if not ids:
+                    del index[value]
+                    self._sorted_keys.pop(name, None)
+
+
+def _one(func):
+    def values(resource):
+        value = func(resource)
+        return () if value is None or value == '' else (value,)
+    return values
+
+
+NODE_INDEXES = {
+    'zoneId': _one(lambda node: node.extra.get('zoneId')),
+    'state': _one(lambda node: node.state),
+    'publicIP': lambda node: tuple(node.public_ips),
+    'privateIP': lambda node: tuple(node.private_ips),
+    'vmName': _one(lambda node: node.name),
+    'dueDate': _one(lambda node: node.extra.get('dueDate')),
+}
+
+VOLUME_INDEXES = {
+    'zoneId': _one(lambda volume: volume.extra.get('zoneId')),
+    'state': _one(lambda volume: volume.state),
+    'diskName': _one(lambda volume: volume.name),
+    'vmName': _one(lambda volume: volume.extra.get('vmName')),
+    'dueDate': _one(lambda volume: volume.extra.get('dueDate')),
+}
+
+SNAPSHOT_INDEXES = {
+    'zoneId': _one(lambda snapshot: snapshot.extra.get('zoneId')),
+    'vmId': _one(lambda snapshot: snapshot.extra.get('vmId')),
+    'state': _one(lambda snapshot: snapshot.state),
+    'snapshotName': _one(lambda snapshot: snapshot.name),
+}
+
+# index holding the name of each kind, used for prefix queries
+NAME_INDEXES = {'nodes': 'vmName', 'volumes': 'diskName', 'snapshots': 'snapshotName'}
+
+
+class CTyunInventory(object):
+    """
+    In-memory copy of the fleet with secondary indexes.
+
+    refresh() walks the listings and diffs them against the previous snapshot,
+    only added, changed and removed resources touch the indexes.
+    version is bumped and last_modified set whenever a refresh changes anything.
+    The subscribed listeners are told of the changes of every refresh after the first one.
+    """
+
+    def __init__(self, driver, zone_ids=(1,), page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1, compact=False):
+        """
+        :param driver: CTyunNodeDriver
+        :param zone_ids: zones whose volumes and snapshots are listed
+        :param page_size: Page Size of the listings
+        :param concurrency: max pages fetched at the same time
+        :param compact: hold read-only CTyun records instead of libcloud objects, a fraction of their memory
+        """
+        self.driver = driver
+        self.zone_ids = tuple(zone_ids)
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.compact = compact
+        self.nodes = IndexedTable(NODE_INDEXES)
+        self.volumes = IndexedTable(VOLUME_INDEXES)
+        self.snapshots = IndexedTable(SNAPSHOT_INDEXES)
+        self.version = 0
+        self.last_modified = None
+        self.refreshed_at = None
+        self.listeners = []
+        self._lock = threading.RLock()
+
+    def subscribe(self, listener):
+        """
+        :param listener: called with the dict of InventoryDiff and a dict of kind to {id: previous resource}
+            of the changed and removed resources, under the lock of the inventory so it must be quick
+        """
+        with self._lock:
+            self.listeners.append(listener)
+
+    def refresh(self):
+        """
+        Every listing is walked before anything is applied, a failed page leaves the previous snapshot as it was
+        :return: dict with an InventoryDiff of ids for 'nodes', 'volumes' and 'snapshots'
+        :raise CTyunListingError: when a page of a listing failed
+        """
+        nodes = list(self.driver.iter_nodes(page_size=self.page_size, concurrency=self.concurrency,
+                compact=self.compact))
+        volumes = []
+        snapshots = []
+        for zone_id in self.zone_ids:
+            if self.compact:
+                # records carry zone_id already
+                volumes.extend(self.driver.iter_volumes(zone_id=zone_id, page_size=self.page_size,
+                        concurrency=self.concurrency, compact=True))
+                snapshots.extend(self.driver.iter_snapshots(zone_id=zone_id, page_size=self.page_size,
+                        concurrency=self.concurrency, compact=True))
+                continue
+            for volume in self.driver.iter_volumes(zone_id=zone_id, page_size=self.page_size,
+                    concurrency=self.concurrency):
+                volume.extra.setdefault('zoneId', zone_id)
+                volumes.append(volume)
+            for snapshot in self.driver.iter_snapshots(zone_id=zone_id, page_size=self.page_size,
+                    concurrency=self.concurrency):
+                if snapshot.extra.get('zoneId') is None:
+                    snapshot.extra['zoneId'] = zone_id
+                snapshots.append(snapshot)
+
+        with self._lock:
+            previous = {'nodes': {}, 'volumes': {}, 'snapshots': {}}
+            diffs = {'nodes': self._apply(self.nodes, nodes, previous['nodes']),
+                    'volumes': self._apply(self.volumes, volumes, previous['volumes']),
+                    'snapshots': self._apply(self.snapshots, snapshots, previous['snapshots'])}
+            now = time.time()
+            changed = any(any(diff) for diff in diffs.values())
+            if self.last_modified is None or changed:
+                self.version += 1
+                self.last_modified = now
+            if changed and self.refreshed_at is not None:
+                for listener in self.listeners:
+                    listener(diffs, previous)
+            self.refreshed_at = now
+            return diffs
+
+    def get_node(self, node_id):
+        with self._lock:
+            return self.nodes.rows.get(node_id)
+
+    def get_volume(self, volume_id):
+        with self._lock:
+            return self.volumes.rows.get(volume_id)
+
+    def list(self, kind):
+        """
+        :param kind: 'nodes', 'volumes' or 'snapshots'
+        :return: list of the resources sorted by id
+        """
+        return self.query(kind)
+
+    def query(self, kind, state=None, zone_id=None, due_from=None, due_to=None, name_prefix=None,
+            after=None, limit=None):
+        """
+        Keyset query over the indexes, every given criteria must match
+        :param kind: 'nodes', 'volumes' or 'snapshots'
+        :param after: only resources whose id sorts after this one
+        :param limit: max resources returned
+        :return: list of the resources sorted by id
+        """
+        with self._lock:
+            table = getattr(self, kind)
+            criteria = []
+            if state is not None:
+                criteria.append(table.lookup('state', state))
+            if zone_id is not None:
+                criteria.append(self._zone_ids(table, zone_id))
+            if due_from is not None or due_to is not None:
+                criteria.append(table.range('dueDate', due_from, due_to))
+            if name_prefix:
+                criteria.append(table.range(NAME_INDEXES[kind], name_prefix, name_prefix + '\U0010ffff'))
+
+            if criteria:
+                ids = sorted(resource_id for resource_id in set.intersection(*criteria)
+                        if after is None or resource_id > after)
+            else:
+                ids = table.sorted_ids()
+                if after is not None:
+                    ids = islice(ids, bisect_right(ids, after), None)
+            return [table.rows[resource_id] for resource_id in islice(ids, limit)]
+
+    def find_nodes(self, zone_id=None, state=None, ip=None, name=None, due_from=None, due_to=None):
+        """
+        Nodes matching every given criteria, ip matches the public or the private ip
+        :return: list of Node Objects
+        """
+        with self._lock:
+            criteria = []
+            if zone_id is not None:
+                criteria.append(self._zone_ids(self.nodes, zone_id))
+            if state is not None:
+                criteria.append(self.nodes.lookup('state', state))
+            if ip is not None:
+                criteria.append(self.nodes.lookup('publicIP', ip) | self.nodes.lookup('privateIP', ip))
+            if name is not None:
+                criteria.append(self.nodes.lookup('vmName', name))
+            if due_from is not None or due_to is not None:
+                criteria.append(self.nodes.range('dueDate', due_from, due_to))
+            return self._select(self.nodes, criteria)
+
+    def find_volumes(self, zone_id=None, state=None, vm_name=None, name=None, due_from=None, due_to=None):
+        """
+        Volumes matching every given criteria
+        :return: list of StorageVolume Objects
+        """
+        with self._lock:
+            criteria = []
+            if zone_id is not None:
+                criteria.append(self._zone_ids(self.volumes, zone_id))
+            if state is not None:
+                criteria.append(self.volumes.lookup('state', state))
+            if vm_name is not None:
+                criteria.append(self.volumes.lookup('vmName', vm_name))
+            if name is not None:
+                criteria.append(self.volumes.lookup('diskName', name))
+            if due_from is not None or due_to is not None:
+                criteria.append(self.volumes.range('dueDate', due_from, due_to))
+            return self._select(self.volumes, criteria)
+
+    @staticmethod
+    def _zone_ids(table, zone_id):
+        """
+        :return: ids of the resources of zone_id, CTyun returns zoneId as a number or a string
+        """
+        zone_ids = set([zone_id, str(zone_id)])
+        if str(zone_id).isdigit():
+            zone_ids.add(int(zone_id))
+        return set().union(*[table.lookup('zoneId', value) for value in zone_ids])
+
+    @staticmethod
+    def _apply(table, resources, previous):
+        """
+        :param previous: filled with the replaced resource of each changed and removed id
+        """
+        added, changed = [], []
+        seen = set()
+        for resource in resources:
+            seen.add(resource.id)
+            old = table.rows.get(resource.id)
+            outcome = table.upsert(resource)
+            if outcome == 'added':
+                added.append(resource.id)
+            elif outcome == 'changed':
+                changed.append(resource.id)
+                previous[resource.id] = old
+        removed = [resource_id for resource_id in table.rows if resource_id not in seen]
+        for resource_id in removed:
+            previous[resource_id] = table.remove(resource_id)
+        return InventoryDiff(added, changed, removed)
+
+    @staticmethod
+    def _select(table, criteria):
+        if not criteria:
+            return list(table.rows.values())
+        ids = set.intersection(*sorted(criteria, key=len))
+        return [table.rows[resource_id] for resource_id in ids]
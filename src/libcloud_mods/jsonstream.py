@@ -0,0 +1,157 @@
+import codecs
+import json
+from json.decoder import scanstring
+
+_WHITESPACE = ' \t\n\r'
+# consumed text kept in the buffer before it is dropped
+_COMPACT_AT = 65536
+
+
+class JsonArrayStream(object):
+    """
+    Incremental decoder of one array of a json document, e.g. returnObj.VMList of a listing.
+
+    Iterating yields the elements of the array at path one at a time as the chunks arrive, only the
+    element being decoded is buffered. Once iterated, document holds the rest of the json document
+    with the array left empty, e.g. its returnCode and totalCount.
+    """
+
+    def __init__(self, chunks, path):
+        """
+        :param chunks: iterable of bytes or str, e.g. the iter_content of a streamed response
+        :param path: keys leading to the array from the top-level object, e.g. ('returnObj', 'VMList')
+        """
+        self.path = tuple(path)
+        self.document = None
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        if self._peek() != '{':
+            # not an object, e.g. an error page, decoded whole
+            self._read_all()
+            self.document = json.loads(self._buffer[self._pos:])
+            return
+        self._pos += 1
+        self.document = {}
+        for element in self._object(self.document, self.path):
+            yield element
+        self._end()
+
+    def _object(self, container, path):
+        """
+        Decode the members of an object whose '{' is consumed into container,
+        yielding the elements of the array at path when it is found inside
+        """
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                self._fail('Expecting property name enclosed in double quotes')
+            key = self._string()
+            if self._peek() != ':':
+                self._fail("Expecting ':' delimiter")
+            self._pos += 1
+            following = self._peek()
+            if path and key == path[0] and following == '[' and len(path) == 1:
+                self._pos += 1
+                container[key] = []
+                for element in self._array():
+                    yield element
+            elif path and key == path[0] and following == '{' and len(path) > 1:
+                self._pos += 1
+                container[key] = {}
+                for element in self._object(container[key], path[1:]):
+                    yield element
+            else:
+                container[key] = self._value()
+            delimiter = self._peek()
+            self._pos += 1
+            if delimiter == '}':
+                return
+            if delimiter != ',':
+                self._fail("Expecting ',' delimiter")
+
+    def _array(self):
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            delimiter = self._peek()
+            self._pos += 1
+            if delimiter == ']':
+                return
+            if delimiter != ',':
+                self._fail("Expecting ',' delimiter")
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._more():
+                    raise
+                continue
+            # a number or a literal may go on in the next chunk
+            if end < len(self._buffer) or not self._more():
+                self._pos = end
+                return value
+
+    def _string(self):
+        while True:
+            try:
+                value, end = scanstring(self._buffer, self._pos + 1)
+            except ValueError:
+                if not self._more():
+                    raise
+                continue
+            self._pos = end
+            return value
+
+    def _peek(self):
+        """
+        Skip whitespace
+        :return: next char, '' at the end of the document
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._more():
+                return self._buffer[self._pos:self._pos + 1]
+
+    def _more(self):
+        """
+        Append the next chunk to the buffer, dropping the consumed text
+        :return: False at the end of the chunks
+        """
+        if self._eof:
+            return False
+        if self._pos >= _COMPACT_AT:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self._buffer += text
+                return True
+        self._eof = True
+        self._buffer += self._decoder.decode(b'', final=True)
+        return False
+
+    def _read_all(self):
+        while self._more():
+            pass
+
+    def _end(self):
+        if self._peek():
+            self._fail('Extra data')
+
+    def _fail(self, message):
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
@@ -0,0 +1,339 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# seconds, the CTyun api answers in tens of ms up to several seconds for orders
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Child(object):
+    def __init__(self, metric, values):
+        self.metric = metric
+        self.values = values
+
+    def inc(self, amount=1):
+        self.metric._update(self.values, amount)
+
+    def dec(self, amount=1):
+        self.metric._update(self.values, -amount)
+
+    def observe(self, value):
+        self.metric._observe(self.values, value)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, registry, name, doc, labels=()):
+        self.registry = registry
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.samples = {}
+        self._children = {}
+
+    def labels(self, *values):
+        """
+        :return: the child of these label values, with inc/dec or observe
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, _Child(self, tuple(str(value) for value in values)))
+        return child
+
+    def _update(self, values, amount):
+        with self.registry.lock:
+            self.samples[values] = self.samples.get(values, 0) + amount
+        self.registry.changed()
+
+    def dump(self):
+        return {'kind': self.kind, 'doc': self.doc, 'labels': self.label_names,
+                'samples': [[list(values), list(value) if isinstance(value, list) else value]
+                    for values, value in self.samples.items()]}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+
+class Gauge(Metric):
+    """
+    Summed over the live processes only, the gauges of exited processes are dropped
+    """
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(registry, name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _observe(self, values, value):
+        with self.registry.lock:
+            sample = self.samples.get(values)
+            if sample is None:
+                # non cumulative bucket counts, the last one is +Inf, then sum
+                sample = self.samples[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[bisect_left(self.buckets, value)] += 1
+            sample[-1] += value
+        self.registry.changed()
+
+    def dump(self):
+        dumped = super(Histogram, self).dump()
+        dumped['buckets'] = self.buckets
+        return dumped
+
+
+class MetricsRegistry(object):
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+
+    With a directory every process (e.g. each uwsgi worker) writes its samples to
+    <directory>/metrics-<pid>.json at most every flush_interval seconds and when it exits,
+    exposition() of any process then adds up the samples of all of them. The samples changed
+    since the last write are written by a timer thread once flush_interval seconds passed, so
+    the last ones of a burst of requests are seen by the other processes too.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, clock=time.monotonic):
+        """
+        :param directory: directory shared by the processes, None keeps the samples of this process only
+        :param flush_interval: min seconds between two writes of the samples of this process
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.metrics = {}
+        self._flushed_at = None
+        self._dirty = False
+        self._timer = None
+        atexit.register(self.flush)
+
+    def counter(self, name, doc, labels=()):
+        return self._register(Counter(self, name, doc, labels))
+
+    def gauge(self, name, doc, labels=()):
+        return self._register(Gauge(self, name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, doc, labels, buckets))
+
+    def configure(self, directory):
+        """
+        Share the samples through directory from now on, e.g. app.config['METRICS_DIR']
+        """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.directory = directory
+            self._flushed_at = None
+        self.changed()
+
+    def changed(self):
+        self._dirty = True
+        if self.directory is None:
+            return
+        now = self.clock()
+        if self._flushed_at is None or now - self._flushed_at >= self.flush_interval:
+            self.flush()
+        else:
+            self._schedule(self._flushed_at + self.flush_interval - now)
+
+    def _schedule(self, delay):
+        # a forked uwsgi worker inherits the timer of its parent stopped
+        with self.lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Write the samples of this process to the shared directory
+        """
+        if self.directory is None or not self._dirty:
+            return
+        with self.lock:
+            self._flushed_at = self.clock()
+            self._dirty = False
+            dumped = json.dumps(self.dump())
+        path = self._path(os.getpid())
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            f.write(dumped)
+        os.replace(tmp_path, path)
+
+    def dump(self):
+        with self.lock:
+            return dict((name, metric.dump()) for name, metric in self.metrics.items())
+
+    def collect(self):
+        """
+        :return: dict of metric name to its dump, summed over every process sharing the directory
+        """
+        dumps = [(os.getpid(), self.dump())]
+        if self.directory is not None:
+            for entry in os.listdir(self.directory):
+                if not (entry.startswith('metrics-') and entry.endswith('.json')):
+                    continue
+                pid = int(entry[len('metrics-'):-len('.json')])
+                if pid == os.getpid():
+                    continue
+                try:
+                    with open(os.path.join(self.directory, entry)) as f:
+                        dumps.append((pid, json.load(f)))
+                except (OSError, ValueError):
+                    # the process is writing or removed its file meanwhile
+                    continue
+
+        merged = {}
+        for pid, dump in dumps:
+            alive = pid == os.getpid() or self._alive(pid)
+            for name, metric in dump.items():
+                if metric['kind'] == 'gauge' and not alive:
+                    continue
+                target = merged.setdefault(name, dict(metric, samples={}))
+                for values, value in metric['samples']:
+                    values = tuple(values)
+                    current = target['samples'].get(values)
+                    if current is None:
+                        target['samples'][values] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target['samples'][values] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target['samples'][values] = current + value
+        return merged
+
+    def exposition(self):
+        """
+        :return: every metric in the Prometheus text format 0.0.4
+        """
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append('# HELP %s %s' % (name, metric['doc']))
+            lines.append('# TYPE %s %s' % (name, metric['kind']))
+            label_names = metric['labels']
+            for values, value in sorted(metric['samples'].items()):
+                if metric['kind'] != 'histogram':
+                    lines.append('%s%s %s' % (name, _format_labels(label_names, values), _format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(tuple(metric['buckets']) + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(label_names, values,
+                            ('le', _format_value(bound))), cumulative))
+                lines.append('%s_sum%s %s' % (name, _format_labels(label_names, values), _format_value(value[-1])))
+                lines.append('%s_count%s %d' % (name, _format_labels(label_names, values), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise Exception('Invalid param name %s is already registered' % metric.name)
+            self.metrics[metric.name] = metric
+        return metric
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-%d.json' % pid)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+REGISTRY = MetricsRegistry(directory=os.environ.get('METRICS_DIR') or None)
+
+CTYUN_REQUEST_SECONDS = REGISTRY.histogram('ctyun_request_duration_seconds',
+        'Latency of the CTyun api calls', ['path'])
+CTYUN_REQUEST_BYTES = REGISTRY.counter('ctyun_request_bytes_total', 'Bytes of the CTyun api request bodies',
+        ['path'])
+CTYUN_RESPONSE_BYTES = REGISTRY.counter('ctyun_response_bytes_total', 'Bytes of the CTyun api response bodies',
+        ['path'])
+CTYUN_ERRORS = REGISTRY.counter('ctyun_errors_total',
+        'CTyun api calls which failed, by http status or returnCode', ['path', 'kind', 'code'])
+CTYUN_RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram('ctyun_rate_limit_wait_seconds',
+        'Time the CTyun api calls were held back by the rate limiter', ['path'])
+CTYUN_RETRIES = REGISTRY.counter('ctyun_retries_total', 'CTyun api calls sent again after a transient failure',
+        ['path'])
+CTYUN_SHORT_CIRCUITS = REGISTRY.counter('ctyun_short_circuits_total',
+        'CTyun api calls failed fast by an open circuit breaker', ['path'])
+CTYUN_COALESCED = REGISTRY.counter('ctyun_coalesced_total',
+        'CTyun api reads answered by an identical call in flight, in this process or another one of the host',
+        ['path', 'scope'])
+CTYUN_IN_FLIGHT = REGISTRY.gauge('ctyun_requests_in_flight', 'CTyun api calls waiting for their response',
+        ['path'])
+
+
+def _size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return len(body)
+
+
+class track_ctyun_request(object):
+    """
+    Context manager recording one CTyun api call, call done(status, body, response_json)
+    once the response is read. An exception raised inside counts as an http or transport error.
+    """
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data
+        self.started = None
+
+    def __enter__(self):
+        CTYUN_IN_FLIGHT.labels(self.path).inc()
+        CTYUN_REQUEST_BYTES.labels(self.path).inc(_size(self.data))
+        self.started = time.perf_counter()
+        return self
+
+    def done(self, status, body, response_json=None):
+        CTYUN_RESPONSE_BYTES.labels(self.path).inc(_size(body))
+        return_code = response_json.get('returnCode') if isinstance(response_json, dict) else None
+        if return_code is not None and return_code != 200:
+            CTYUN_ERRORS.labels(self.path, 'api', return_code).inc()
+
+    def __exit__(self, exc_type, exc, tb):
+        CTYUN_REQUEST_SECONDS.labels(self.path).observe(time.perf_counter() - self.started)
+        CTYUN_IN_FLIGHT.labels(self.path).dec()
+        if exc is not None:
+            code = getattr(exc, 'code', None)
+            if isinstance(code, int):
+                CTYUN_ERRORS.labels(self.path, 'http', code).inc()
+            else:
+                CTYUN_ERRORS.labels(self.path, 'transport', exc_type.__name__).inc()
+        return False
@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class CTyunConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive connections.
+
+    Each pooled connection keeps its own http session, so a connection handed out
+    again reuses the already established TCP/TLS session. Idle connections are
+    reused most-recently-used first and closed once idle for idle_timeout seconds.
+    """
+
+    def __init__(self, factory, size=4, idle_timeout=60, clock=time.monotonic):
+        """
+        :param factory: func without params returning a new connected connection
+        :param size: max connections open at the same time
+        :param idle_timeout: seconds an unused connection is kept open
+        """
+        if size < 1:
+            raise Exception('Invalid param size must be positive')
+
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.waits = 0
+
+    def acquire(self, timeout=None):
+        """
+        :param timeout: seconds to wait for a free connection, None waits forever
+        :return: a connection, to be given back with release()
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            self._expire_idle()
+            while not self._idle and self._in_use >= self.size:
+                self.waits += 1
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError('No free connection in pool of size %d' % self.size)
+                self._cond.wait(remaining)
+                self._expire_idle()
+
+            self._in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()[0]
+            self.created += 1
+
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection):
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((connection, self.clock()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """
+        Close every idle connection, connections in use are closed when given back after the idle timeout
+        """
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.popleft()[0])
+
+    def stats(self):
+        with self._cond:
+            return {'size': self.size,
+                    'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'created': self.created,
+                    'reused': self.reused,
+                    'expired': self.expired,
+                    'waits': self.waits}
+
+    def _expire_idle(self):
+        now = self.clock()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            self._close(self._idle.popleft()[0])
+            self.expired += 1
+
+    @staticmethod
+    def _close(connection):
+        session = getattr(connection.connection, 'session', None)
+        if session is not None:
+            session.close()
+
+
+class PooledConnection(object):
+    """
+    Stands in for the driver connection, every request runs on a connection borrowed from the pool.
+    Other attributes are read from the template connection.
+    """
+
+    def __init__(self, pool, template):
+        self.pool = pool
+        self.template = template
+
+    def request(self, *args, **kwargs):
+        with self.pool.connection() as connection:
+            return connection.request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
@@ -0,0 +1,185 @@
+import itertools
+import threading
+from collections import namedtuple
+
+from .cache import TTLCache
+from .endpoints import CTYUN_ENDPOINTS_BY_NAME, endpoint_signature
+
+# the price apis, all side-effect free
+CTYUN_QUOTE_FUNCS = ('get_new_order_price', 'get_data_disk_price', 'get_upgrade_order_price',
+        'get_renew_order_price', 'get_upgrade_bandwidth_price', 'get_renew_data_disk_price')
+CTYUN_QUOTE_TTL = 300
+CTYUN_QUOTE_CONCURRENCY = 16
+# keys of the price inside returnObj, the first one found is used
+CTYUN_PRICE_KEYS = ('price', 'totalPrice', 'finalPrice', 'amount')
+
+# one quote: func name, dict of its params, price or None, response json, raised exception or None
+CTyunQuote = namedtuple('CTyunQuote', ['func', 'params', 'price', 'response', 'error'])
+
+_SIGNATURES = dict((name, endpoint_signature(CTYUN_ENDPOINTS_BY_NAME[name])) for name in CTYUN_QUOTE_FUNCS)
+
+
+def price_of(response_json):
+    """
+    :return: the price found in returnObj of a price api response, None if there is none
+    """
+    if not isinstance(response_json, dict) or response_json.get('returnCode') != 200:
+        return None
+    return_obj = response_json.get('returnObj')
+    if isinstance(return_obj, (int, float)):
+        return return_obj
+    if isinstance(return_obj, dict):
+        for key in CTYUN_PRICE_KEYS:
+            if return_obj.get(key) is not None:
+                return return_obj[key]
+    return None
+
+
+class CTyunQuoteEngine(object):
+    """
+    Price quotes of many configurations at once.
+
+    Quotes are memoized for ttl seconds on the exact func and params, the missing ones of a
+    batch are fetched in parallel, so a grid of configurations costs one round trip of the api.
+    """
+
+    def __init__(self, driver, ttl=CTYUN_QUOTE_TTL, maxsize=4096, concurrency=CTYUN_QUOTE_CONCURRENCY):
+        """
+        :param driver: CTyunNodeDriver
+        :param ttl: seconds a quote is reused
+        :param maxsize: max memoized quotes, least recently used are evicted
+        :param concurrency: max price calls in flight
+        """
+        self.driver = driver
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.cache = TTLCache(maxsize=maxsize)
+        self._warm_up_thread = None
+        self._stop = threading.Event()
+
+    def quote(self, func, *args, **kwargs):
+        """
+        :param func: one of CTYUN_QUOTE_FUNCS
+        :return: CTyunQuote
+        """
+        return self.quote_many([(func, self._params(func, *args, **kwargs))])[0]
+
+    def quote_many(self, requests, driver=None):
+        """
+        :param requests: iterable of (func, dict of params)
+        :param driver: driver of the account quoted, defaults to the driver of the engine
+        :return: list of CTyunQuote in requests order, identical requests are fetched once
+        """
+        driver = driver or self.driver
+        keys = []
+        for func, params in requests:
+            params = self._params(func, **params)
+            keys.append((func, tuple(params.items())))
+
+        responses = {}
+        missing = []
+        for key in keys:
+            if key in responses:
+                continue
+            responses[key] = self.cache.get((driver.accesskey,) + key)
+            if responses[key] is None:
+                missing.append(key)
+
+        def fetch(key):
+            return self._fetch(driver, key)
+
+        for result in driver._run_bulk(fetch, missing, self.concurrency):
+            responses[result.item] = result.error if result.error is not None else result.result
+
+        quotes = []
+        for func, params in keys:
+            response = responses[(func, params)]
+            if isinstance(response, Exception):
+                quotes.append(CTyunQuote(func, dict(params), None, None, response))
+            else:
+                quotes.append(CTyunQuote(func, dict(params), price_of(response), response, None))
+        return quotes
+
+    def new_order_grid(self, cpu, memory, datahd=(0,), bw=(1,), periods=((1, 1),), zones=(1,), os=1, ordernum=1,
+            driver=None):
+        """
+        Quote every combination of the given values with get_new_order_price
+        :param cpu: cpu counts
+        :param memory: memory sizes
+        :param datahd: data disk sizes
+        :param bw: bandwidths
+        :param periods: (periodtype, periodnum) pairs
+        :param zones: zone ids
+        :param driver: driver of the account quoted, defaults to the driver of the engine
+        :return: list of CTyunQuote, in itertools.product order
+        """
+        return self.quote_many(self._new_order_requests(itertools.product(cpu, memory), datahd, bw, periods, zones,
+                os, ordernum), driver=driver)
+
+    def warm_up(self, datahd=(0,), bw=(1,), periods=((1, 1),), zones=(1,), os=1):
+        """
+        Quote every vm type of list_vm_type with each of the given values, e.g. the SKUs of the order page
+        :return: list of CTyunQuote
+        """
+        response_json = self.driver.list_vm_type()
+        if not self.driver._is_success(response_json):
+            return []
+        vm_types = response_json.get('returnObj') or []
+        if isinstance(vm_types, dict):
+            vm_types = next((value for value in vm_types.values() if isinstance(value, list)), [])
+        sizes = [(vm_type['cpu'], vm_type['memory']) for vm_type in vm_types
+                if isinstance(vm_type, dict) and 'cpu' in vm_type and 'memory' in vm_type]
+        return self.quote_many(self._new_order_requests(sizes, datahd, bw, periods, zones, os, 1))
+
+    def start_warm_up(self, interval=None, **kwargs):
+        """
+        Run warm_up(**kwargs) now and then every interval seconds in a daemon thread,
+        interval defaults to 80% of ttl so the common quotes never expire
+        """
+        if self._warm_up_thread is not None:
+            return self._warm_up_thread
+        interval = interval or self.ttl * 0.8
+
+        def run():
+            while True:
+                try:
+                    self.warm_up(**kwargs)
+                except Exception:
+                    # the next round tries again, quotes are still fetched on demand meanwhile
+                    pass
+                if self._stop.wait(interval):
+                    return
+
+        self._stop.clear()
+        self._warm_up_thread = threading.Thread(target=run, name='ctyun-quote-warm-up', daemon=True)
+        self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def stop_warm_up(self):
+        self._stop.set()
+        self._warm_up_thread = None
+
+    def _fetch(self, driver, key):
+        func, params = key
+        response_json = getattr(driver, func)(**dict(params))
+        if driver._is_success(response_json):
+            self.cache.put((driver.accesskey,) + key, response_json, self.ttl)
+        return response_json
+
+    @staticmethod
+    def _params(func, *args, **kwargs):
+        """
+        :return: dict of every param of func in signature order, defaults applied
+        """
+        if func not in _SIGNATURES:
+            raise Exception('Invalid param func %s is not a price api' % func)
+        values = _SIGNATURES[func].bind(*args, **kwargs)
+        values.apply_defaults()
+        return dict(values.arguments)
+
+    @staticmethod
+    def _new_order_requests(sizes, datahd, bw, periods, zones, os, ordernum):
+        return [('get_new_order_price', {'cpu': cpu, 'memory': memory, 'datahd': disk, 'os': os, 'bw': band,
+                'ordernum': ordernum, 'periodtype': periodtype, 'periodnum': periodnum, 'zoneid': zone})
+                for (cpu, memory), disk, band, (periodtype, periodnum), zone
+                in itertools.product(sizes, datahd, bw, periods, zones)]
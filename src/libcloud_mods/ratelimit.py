@@ -0,0 +1,157 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .endpoints import CTYUN_PATH_CLASSES
+from .resilience import DeadlineExceededError
+
+# (calls per second, burst) of each endpoint class, shared by every process using the same file
+CTYUN_DEFAULT_RATE_LIMITS = {'read': (20, 20), 'write': (5, 5), 'order': (2, 2)}
+# a schedule this many seconds ahead is treated as corrupt (e.g. the clock was set back) and restarted
+CTYUN_RATE_LIMIT_MAX_QUEUE = 300
+
+_MAGIC = b'CTYRL001'
+_SLOT = struct.Struct('<Qd')
+
+
+class CTyunRateLimiter(object):
+    """
+    Token buckets of the CTyun api calls, one per access key and endpoint class.
+
+    Each bucket keeps the theoretical arrival time of the next call (GCRA): a call reserves the next
+    free slot and sleeps until it, so callers are served in arrival order, bursts are capped at
+    burst calls and the sustained throughput sits at rate instead of alternating bursts and
+    throttling errors. With a path the buckets live in a mmap-ed file guarded by flock, shared
+    by every process of the host, e.g. all uwsgi workers.
+    """
+
+    def __init__(self, limits=None, path=None, slots=256, clock=time.time, sleep=time.sleep):
+        """
+        :param limits: dict of endpoint class ('read', 'write', 'order') or (access key, endpoint class)
+            to (calls per second, burst), classes without a limit are not limited.
+            Defaults to CTYUN_DEFAULT_RATE_LIMITS
+        :param path: file shared by the processes, None keeps the buckets in this process
+        :param slots: max buckets of the shared file
+        """
+        self.limits = dict(CTYUN_DEFAULT_RATE_LIMITS if limits is None else limits)
+        self.path = path
+        self.slots = slots
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._tats = {}
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def limit_of(self, access_key, path):
+        """
+        :return: (endpoint class, (calls per second, burst) or None)
+        """
+        endpoint_class = CTYUN_PATH_CLASSES.get(path, 'write')
+        limit = self.limits.get((access_key, endpoint_class), self.limits.get(endpoint_class))
+        return endpoint_class, limit
+
+    def reserve(self, access_key, path, max_wait=None):
+        """
+        Take the next slot of the bucket of the call
+        :param max_wait: seconds the call may wait, None for no bound
+        :return: seconds to wait before sending the call
+        :raise DeadlineExceededError: when the slot is max_wait or more ahead, it is then left to the next calls
+        """
+        endpoint_class, limit = self.limit_of(access_key, path)
+        if not limit:
+            return 0.0
+        rate, burst = limit
+        interval = 1.0 / rate
+        tolerance = (max(burst, 1) - 1) * interval
+        key = '%s|%s' % (access_key, endpoint_class)
+
+        with self._lock:
+            if self.path is None:
+                now = self.clock()
+                tat = self._next_tat(self._tats.get(key), now)
+                delay = self._check_wait(path, tat - tolerance - now, max_wait)
+                self._tats[key] = tat + interval
+            else:
+                self._open()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    now = self.clock()
+                    offset = self._slot_of(key)
+                    tat = self._next_tat(_SLOT.unpack_from(self._map, offset)[1], now)
+                    delay = self._check_wait(path, tat - tolerance - now, max_wait)
+                    _SLOT.pack_into(self._map, offset, self._hash(key), tat + interval)
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return delay
+
+    def acquire(self, access_key, path, max_wait=None):
+        """
+        Block until the call may be sent
+        :param max_wait: seconds the call may wait, see reserve
+        :return: seconds waited
+        """
+        delay = self.reserve(access_key, path, max_wait)
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = self._fd = self._pid = None
+
+    @staticmethod
+    def _check_wait(path, delay, max_wait):
+        delay = max(delay, 0.0)
+        if max_wait is not None and delay > 0 and delay >= max_wait:
+            raise DeadlineExceededError('CTyun %s would wait %.1fs for the rate limit, past its deadline of %.1fs'
+                    % (path, delay, max_wait))
+        return delay
+
+    @staticmethod
+    def _next_tat(tat, now):
+        if tat is None or tat < now or tat - now > CTYUN_RATE_LIMIT_MAX_QUEUE:
+            return now
+        return tat
+
+    def _open(self):
+        # a flock is shared with the parent through an inherited fd, each process opens its own
+        if self._pid == os.getpid():
+            return
+        size = len(_MAGIC) + self.slots * _SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            shared = mmap.mmap(fd, size)
+            if shared[:len(_MAGIC)] != _MAGIC:
+                shared[:] = b'\0' * size
+                shared[:len(_MAGIC)] = _MAGIC
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map, self._pid = fd, shared, os.getpid()
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'little') | 1
+
+    def _slot_of(self, key):
+        """
+        :return: offset of the bucket of key in the shared file, linear probing from its hash
+        """
+        key_hash = self._hash(key)
+        for probe in range(self.slots):
+            offset = len(_MAGIC) + ((key_hash + probe) % self.slots) * _SLOT.size
+            slot_hash = _SLOT.unpack_from(self._map, offset)[0]
+            if slot_hash == key_hash or slot_hash == 0:
+                return offset
+        raise Exception('Invalid param slots %d buckets are all taken in %s' % (self.slots, self.path))
@@ -0,0 +1,127 @@
+from collections.abc import Mapping
+
+from libcloud.compute.base import Node, StorageVolume, VolumeSnapshot
+
+
+class RecordExtra(Mapping):
+    """
+    Read-only extra dict of a record, reading its slots
+    """
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key):
+        return getattr(self.record, self.record.extra_fields[key])
+
+    def __iter__(self):
+        return iter(self.record.extra_fields)
+
+    def __len__(self):
+        return len(self.record.extra_fields)
+
+
+class CTyunRecord(object):
+    """
+    Compact, read-only stand-in for a libcloud resource of a bulk listing.
+
+    The fields live in __slots__ instead of an instance dict plus an extra dict and lists,
+    public_ips, private_ips and extra are built when read, a change to them is not kept.
+    to_libcloud() materializes the full libcloud object when one is needed.
+    """
+    __slots__ = ()
+    # extra key to slot
+    extra_fields = {}
+
+    @property
+    def extra(self):
+        return RecordExtra(self)
+
+    def __repr__(self):
+        return '<%s: id=%s, name=%s, state=%s>' % (type(self).__name__, self.id, self.name, self.state)
+
+
+class CTyunNodeRecord(CTyunRecord):
+    __slots__ = ('id', 'name', 'state', 'public_ip', 'private_ip', 'apply_date', 'due_date', 'zone_id', 'driver')
+    extra_fields = {'applyDate': 'apply_date', 'dueDate': 'due_date', 'zoneId': 'zone_id'}
+    size = None
+
+    def __init__(self, id, name, state, public_ip, private_ip, apply_date, due_date, zone_id, driver):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.public_ip = public_ip
+        self.private_ip = private_ip
+        self.apply_date = apply_date
+        self.due_date = due_date
+        self.zone_id = zone_id
+        self.driver = driver
+
+    @property
+    def public_ips(self):
+        return [self.public_ip] if self.public_ip else []
+
+    @property
+    def private_ips(self):
+        return [self.private_ip] if self.private_ip else []
+
+    def to_libcloud(self):
+        """
+        :return: a Node Object
+        """
+        return Node(id=self.id, name=self.name, state=self.state, public_ips=self.public_ips,
+                private_ips=self.private_ips, driver=self.driver, extra=dict(self.extra))
+
+
+class CTyunVolumeRecord(CTyunRecord):
+    __slots__ = ('id', 'name', 'state', 'size', 'disk_id', 'is_sys_volume', 'is_packaged', 'status',
+            'apply_date', 'due_date', 'vm_name', 'zone_id', 'driver')
+    extra_fields = {'diskId': 'disk_id', 'isSysVolume': 'is_sys_volume', 'isPackaged': 'is_packaged',
+            'status': 'status', 'applyDate': 'apply_date', 'dueDate': 'due_date', 'vmName': 'vm_name',
+            'zoneId': 'zone_id'}
+
+    def __init__(self, id, name, state, size, disk_id, is_sys_volume, is_packaged, status, apply_date, due_date,
+            vm_name, zone_id, driver):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.size = size
+        self.disk_id = disk_id
+        self.is_sys_volume = is_sys_volume
+        self.is_packaged = is_packaged
+        self.status = status
+        self.apply_date = apply_date
+        self.due_date = due_date
+        self.vm_name = vm_name
+        self.zone_id = zone_id
+        self.driver = driver
+
+    def to_libcloud(self):
+        """
+        :return: a StorageVolume Object
+        """
+        return StorageVolume(id=self.id, name=self.name, size=self.size, driver=self.driver, state=self.state,
+                extra=dict(self.extra))
+
+
+class CTyunSnapshotRecord(CTyunRecord):
+    __slots__ = ('id', 'name', 'state', 'size', 'created', 'vm_id', 'zone_id', 'driver')
+    extra_fields = {'vmId': 'vm_id', 'zoneId': 'zone_id', 'status': 'state'}
+
+    def __init__(self, id, name, state, size, created, vm_id, zone_id, driver):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.size = size
+        self.created = created
+        self.vm_id = vm_id
+        self.zone_id = zone_id
+        self.driver = driver
+
+    def to_libcloud(self):
+        """
+        :return: a VolumeSnapshot Object
+        """
+        return VolumeSnapshot(id=self.id, driver=self.driver, size=self.size, extra=dict(self.extra),
+                created=self.created, state=self.state, name=self.name)
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .ctyun import CTyunNodeDriver
+
+
+class UnknownAccountError(Exception):
+    pass
+
+
+class CTyunDriverRegistry(object):
+    """
+    One warm driver per CTyun account, keyed by access key.
+
+    Drivers are built on first use with their connection pool, kept in a bounded LRU and evicted
+    either least recently used past maxsize or unused for idle_timeout seconds. An evicted driver
+    is closed once the callers which acquired it released it, at once when none holds it.
+    """
+
+    def __init__(self, accounts=None, maxsize=32, idle_timeout=600, driver_cls=CTyunNodeDriver, driver_kwargs=None,
+            pinned=(), clock=time.monotonic):
+        """
+        :param accounts: dict of access key to secret key, or func returning the secret key of an access key
+            or None when the account is unknown
+        :param maxsize: max warm drivers
+        :param idle_timeout: seconds an unused driver is kept
+        :param driver_kwargs: kwargs of every driver, e.g. host, port, ex_pool_size
+        :param pinned: access keys whose driver is never evicted, e.g. the default account
+        """
+        if maxsize < 1:
+            raise Exception('Invalid param maxsize must be positive')
+
+        self.accounts = accounts if accounts is not None else {}
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.driver_cls = driver_cls
+        self.driver_kwargs = dict({'ex_pool_size': 4}, **(driver_kwargs or {}))
+        self.pinned = frozenset(pinned)
+        self.clock = clock
+        self._drivers = OrderedDict()
+        self._lock = threading.Lock()
+        self._creating = {}
+        # id of the drivers acquired to [driver, count of holders], and those to close on their last release
+        self._holders = {}
+        self._retired = set()
+        self.created = 0
+        self.evicted = 0
+
+    def acquire(self, access_key):
+        """
+        As get, the driver is not closed if evicted until release(driver)
+        :return: the driver of access_key
+        :raise UnknownAccountError: when there is no secret key for access_key
+        """
+        return self.get(access_key, hold=True)
+
+    def release(self, driver):
+        """
+        Give back a driver of acquire, closing it if it was evicted meanwhile
+        """
+        with self._lock:
+            holders = self._holders.get(id(driver))
+            if holders is None:
+                return
+            holders[1] -= 1
+            if holders[1] > 0:
+                return
+            del self._holders[id(driver)]
+            if id(driver) not in self._retired:
+                return
+            self._retired.discard(id(driver))
+        driver.ex_close()
+
+    def get(self, access_key, hold=False):
+        """
+        :param hold: count the caller as a holder of the driver until release(driver), see acquire
+        :return: the driver of access_key, built if it is not warm
+        :raise UnknownAccountError: when there is no secret key for access_key
+        """
+        expired = []
+        try:
+            while True:
+                with self._lock:
+                    now = self.clock()
+                    expired.extend(self._expire(now))
+                    entry = self._drivers.get(access_key)
+                    if entry is not None:
+                        entry[1] = now
+                        self._drivers.move_to_end(access_key)
+                        if hold:
+                            self._hold(entry[0])
+                        return entry[0]
+                    creating = self._creating.get(access_key)
+                    if creating is None:
+                        creating = self._creating[access_key] = threading.Event()
+                        break
+                # another thread is building this driver
+                creating.wait()
+
+            try:
+                driver = self._create(access_key)
+                with self._lock:
+                    self._drivers[access_key] = [driver, self.clock()]
+                    self.created += 1
+                    if hold:
+                        self._hold(driver)
+                    evictable = [key for key in self._drivers if key not in self.pinned]
+                    for key in evictable[:max(len(self._drivers) - self.maxsize, 0)]:
+                        expired.extend(self._retire(self._drivers.pop(key)[0]))
+                        self.evicted += 1
+                return driver
+            finally:
+                with self._lock:
+                    del self._creating[access_key]
+                creating.set()
+        finally:
+            for driver in expired:
+                driver.ex_close()
+
+    def evict_idle(self):
+        """
+        Close the drivers unused for idle_timeout seconds
+        :return: number of drivers closed
+        """
+        with self._lock:
+            expired = self._expire(self.clock())
+        for driver in expired:
+            driver.ex_close()
+        return len(expired)
+
+    def close(self):
+        with self._lock:
+            drivers = []
+            for entry in self._drivers.values():
+                drivers.extend(self._retire(entry[0]))
+            self._drivers.clear()
+        for driver in drivers:
+            driver.ex_close()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._drivers), 'maxsize': self.maxsize, 'created': self.created,
+                    'evicted': self.evicted}
+
+    def __contains__(self, access_key):
+        with self._lock:
+            return access_key in self._drivers
+
+    def _create(self, access_key):
+        if callable(self.accounts):
+            secret_key = self.accounts(access_key)
+        else:
+            secret_key = self.accounts.get(access_key)
+        if secret_key is None:
+            raise UnknownAccountError('Unknown CTyun access key %s' % access_key)
+        return self.driver_cls(access_key, secret_key, **self.driver_kwargs)
+
+    def _hold(self, driver):
+        # the lock is held
+        holders = self._holders.setdefault(id(driver), [driver, 0])
+        holders[1] += 1
+
+    def _retire(self, driver):
+        """
+        The lock is held
+        :return: [driver] when it can be closed now, else [] and it is closed on its last release
+        """
+        if id(driver) in self._holders:
+            self._retired.add(id(driver))
+            return []
+        return [driver]
+
+    def _expire(self, now):
+        """
+        Pop the drivers idle for idle_timeout, the lock is held
+        :return: the drivers to close
+        """
+        expired = []
+        for access_key, (driver, used_at) in list(self._drivers.items()):
+            if now - used_at < self.idle_timeout:
+                break
+            if access_key in self.pinned:
+                continue
+            del self._drivers[access_key]
+            self.evicted += 1
+            expired.extend(self._retire(driver))
+        return expired
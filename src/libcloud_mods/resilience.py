@@ -0,0 +1,284 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from libcloud.common.exceptions import BaseHTTPError
+from libcloud.http import ALLOW_REDIRECTS, LibcloudConnection
+from libcloud.utils.py3 import urlparse
+
+from .endpoints import CTYUN_PATH_CLASSES
+from .metrics import CTYUN_RETRIES, CTYUN_SHORT_CIRCUITS
+
+# http statuses worth another attempt, the CTyun api is overloaded or restarting
+CTYUN_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """
+    The endpoint failed too often lately, the call was not sent
+    """
+
+    def __init__(self, path, retry_in):
+        super(CircuitOpenError, self).__init__('CTyun %s is failing, circuit open for %.1fs more' % (path, retry_in))
+        self.path = path
+        self.retry_in = retry_in
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+def is_transient(error):
+    """
+    :return: True when error is a timeout, a connection failure or a retryable http status
+    """
+    if isinstance(error, BaseHTTPError):
+        return error.code in CTYUN_RETRY_STATUSES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+            socket.timeout, ConnectionError, asyncio.TimeoutError))
+
+
+class CTyunHttpConnection(LibcloudConnection):
+    """
+    LibcloudConnection sending every request, raw ones included, with the timeout of its call,
+    requests ignores the session.timeout set by LibcloudConnection.
+
+    Threads may share the connection: the timeout given by call_timeout and the response
+    belong to the calling thread, libcloud does not pass the timeout down to request
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._calls = threading.local()
+        super(CTyunHttpConnection, self).__init__(*args, **kwargs)
+
+    @property
+    def response(self):
+        return getattr(self._calls, 'response', None)
+
+    @response.setter
+    def response(self, response):
+        self._calls.response = response
+
+    @contextmanager
+    def call_timeout(self, timeout):
+        """
+        Send the requests of the calling thread within timeout seconds meanwhile
+        """
+        previous = getattr(self._calls, 'timeout', None)
+        self._calls.timeout = timeout
+        try:
+            yield
+        finally:
+            self._calls.timeout = previous
+
+    def request(self, method, url, body=None, headers=None, raw=False, stream=False, timeout=None):
+        url = urlparse.urljoin(self.host, url)
+        headers = self._normalize_headers(headers=headers)
+
+        self.response = self.session.request(
+            method=method.lower(),
+            url=url,
+            data=body,
+            headers=headers,
+            allow_redirects=ALLOW_REDIRECTS,
+            stream=stream,
+            verify=self.verification,
+            timeout=self._timeout(timeout)
+        )
+
+    def prepared_request(self, method, url, body=None, headers=None, raw=False, stream=False, timeout=None):
+        headers = self._normalize_headers(headers=headers)
+        prepped = self.session.prepare_request(requests.Request(method, ''.join([self.host, url]), data=body,
+                headers=headers))
+        self.response = self.session.send(prepped, stream=stream,
+                verify=self.ca_cert if self.ca_cert is not None else self.verify,
+                timeout=self._timeout(timeout))
+
+    def _timeout(self, timeout):
+        return timeout or getattr(self._calls, 'timeout', None) or self.session.timeout
+
+
+class CTyunCircuitBreaker(object):
+    """
+    One circuit per api path: failure_threshold transient failures in a row open it, calls then
+    fail fast with CircuitOpenError for reset_timeout seconds, after which a single trial call
+    is let through and closes it again on success.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        if failure_threshold < 1:
+            raise Exception('Invalid param failure_threshold must be positive')
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        # path to [consecutive failures, opened at or None, trial call running]
+        self._circuits = {}
+
+    def before_call(self, path):
+        """
+        :raise CircuitOpenError: when the circuit of path is open
+        """
+        with self._lock:
+            circuit = self._circuits.get(path)
+            if circuit is None or circuit[1] is None:
+                return
+            retry_in = circuit[1] + self.reset_timeout - self.clock()
+            if retry_in > 0 or circuit[2]:
+                CTYUN_SHORT_CIRCUITS.labels(path).inc()
+                raise CircuitOpenError(path, max(retry_in, 0))
+            circuit[2] = True
+
+    def release(self, path):
+        """
+        Give up the trial call claimed by before_call without an outcome, e.g. it was never sent
+        or was cancelled, the next call is then the trial
+        """
+        with self._lock:
+            circuit = self._circuits.get(path)
+            if circuit is not None:
+                circuit[2] = False
+
+    def record(self, path, success):
+        with self._lock:
+            circuit = self._circuits.setdefault(path, [0, None, False])
+            circuit[2] = False
+            if success:
+                circuit[0], circuit[1] = 0, None
+                return
+            circuit[0] += 1
+            if circuit[1] is not None or circuit[0] >= self.failure_threshold:
+                circuit[1] = self.clock()
+
+    def state(self, path):
+        """
+        :return: 'closed', 'open' or 'half_open'
+        """
+        with self._lock:
+            circuit = self._circuits.get(path)
+            if circuit is None or circuit[1] is None:
+                return 'closed'
+            return 'open' if circuit[1] + self.reset_timeout > self.clock() else 'half_open'
+
+
+class CTyunRetryPolicy(object):
+    """
+    Retries the transient failures of the idempotent calls with full jitter exponential backoff,
+    every attempt of a call fits in its deadline.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.2, max_delay=5, deadline=30, retry_classes=('read',),
+            breaker=None, clock=time.monotonic, sleep=time.sleep, rand=random.random):
+        """
+        :param max_attempts: attempts of a call, 1 disables retries
+        :param base_delay: max seconds before the first retry, doubled at each retry
+        :param max_delay: upper bound of the delay between two attempts
+        :param deadline: seconds a call may take with all its attempts, None for no deadline
+        :param retry_classes: endpoint classes safe to send again, see endpoints.endpoint_class
+        :param breaker: CTyunCircuitBreaker or None
+        """
+        if max_attempts < 1:
+            raise Exception('Invalid param max_attempts must be positive')
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_classes = tuple(retry_classes)
+        self.breaker = breaker
+        self.clock = clock
+        self.sleep = sleep
+        self.rand = rand
+
+    def call(self, path, attempt, timeout=None):
+        """
+        :param attempt: func sending the call once, taking the timeout of this attempt in seconds
+        :param timeout: max seconds of one attempt, None leaves it to the deadline
+        :return: the result of the first successful attempt
+        """
+        deadline = None if self.deadline is None else self.clock() + self.deadline
+        tries = 0
+        while True:
+            attempt_timeout = self._before_attempt(path, deadline, timeout)
+            tries += 1
+            try:
+                result = attempt(attempt_timeout)
+            except Exception as e:
+                delay = self._after_failure(path, e, tries, deadline)
+                CTYUN_RETRIES.labels(path).inc()
+                self.sleep(delay)
+                continue
+            except BaseException:
+                self._release(path)
+                raise
+            self._record(path, True)
+            return result
+
+    async def call_async(self, path, attempt, timeout=None):
+        """
+        call for an attempt returning an awaitable
+        """
+        deadline = None if self.deadline is None else self.clock() + self.deadline
+        tries = 0
+        while True:
+            attempt_timeout = self._before_attempt(path, deadline, timeout)
+            tries += 1
+            try:
+                result = await attempt(attempt_timeout)
+            except Exception as e:
+                delay = self._after_failure(path, e, tries, deadline)
+                CTYUN_RETRIES.labels(path).inc()
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # e.g. asyncio.CancelledError
+                self._release(path)
+                raise
+            self._record(path, True)
+            return result
+
+    def _before_attempt(self, path, deadline, timeout):
+        """
+        :return: timeout of the next attempt
+        """
+        if self.breaker is not None:
+            self.breaker.before_call(path)
+        if deadline is None:
+            return timeout
+        remaining = deadline - self.clock()
+        if remaining <= 0:
+            self._release(path)
+            raise DeadlineExceededError('CTyun %s did not answer within %ss' % (path, self.deadline))
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _after_failure(self, path, error, tries, deadline):
+        """
+        :return: seconds to wait before the next attempt, error is raised again when there is none
+        """
+        if isinstance(error, DeadlineExceededError):
+            # the call was not sent, e.g. it would have waited for the rate limit past its deadline
+            self._release(path)
+            raise error
+        transient = is_transient(error)
+        # any other error came from an endpoint which answered
+        self._record(path, not transient)
+        if not transient or tries >= self.max_attempts or \
+                CTYUN_PATH_CLASSES.get(path, 'write') not in self.retry_classes:
+            raise error
+        delay = self.rand() * min(self.max_delay, self.base_delay * 2 ** (tries - 1))
+        if deadline is not None and self.clock() + delay >= deadline:
+            raise error
+        return delay
+
+    def _record(self, path, success):
+        if self.breaker is not None:
+            self.breaker.record(path, success)
+
+    def _release(self, path):
+        if self.breaker is not None:
+            self.breaker.release(path)
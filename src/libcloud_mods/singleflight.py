@@ -0,0 +1,226 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from .endpoints import CTYUN_PATH_CLASSES, CTYUN_SECRET_PATHS
+from .metrics import CTYUN_COALESCED
+
+
+class CoalescedResponse(object):
+    """
+    Response of a call answered by another process, with the attributes the driver reads
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        try:
+            self.object = json.loads(body)
+        except ValueError:
+            self.object = body
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CTyunRequestCoalescer(object):
+    """
+    Single-flight of the identical concurrent reads: while a call is in flight, the same call
+    (same api path and signed form) from another thread waits for it and gets its response
+    instead of being sent again.
+
+    With a directory the processes of the host coalesce too: the first one holds a flock on
+    <directory>/<key hash>.lock while its call runs, the others hold a shared flock on
+    <key hash>.wait while they wait for it. Only when someone waits the response is left in
+    <key hash>.json, the first process removes it once the waiters released <key hash>.wait.
+    The directory and its files are private to the user, the apis answering secrets are never coalesced.
+    """
+
+    def __init__(self, directory=None, classes=('read',), wait_timeout=30, result_ttl=60, clock=time.time,
+            sleep=time.sleep):
+        """
+        :param directory: directory shared by the processes, None coalesces within this process only
+        :param classes: endpoint classes coalesced, see endpoints.endpoint_class
+        :param wait_timeout: max seconds waiting for the call of another process before sending it
+        :param result_ttl: seconds the files left behind, e.g. by a killed process, are kept in directory
+        """
+        self.directory = directory
+        self.classes = tuple(classes)
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._calls = 0
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            if os.stat(directory).st_uid != os.geteuid():
+                raise Exception('Invalid param directory %s is owned by another user' % directory)
+            os.chmod(directory, 0o700)
+
+    def coalesces(self, path):
+        return path not in CTYUN_SECRET_PATHS and CTYUN_PATH_CLASSES.get(path, 'write') in self.classes
+
+    def request(self, path, data, send):
+        """
+        :param data: the signed form body, part of the key
+        :param send: func without params sending the call and returning its response
+        :return: the response, shared with the identical calls in flight
+        """
+        key = '%s?%s' % (path, data or '')
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            CTYUN_COALESCED.labels(path, 'process').inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if self.directory is None:
+                flight.result = send()
+            else:
+                flight.result = self._request_host(path, key, send)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _request_host(self, path, key, send):
+        name = hashlib.md5(key.encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.directory, name + '.lock')
+        wait_path = os.path.join(self.directory, name + '.wait')
+        result_path = os.path.join(self.directory, name + '.json')
+        started = self.clock()
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                response = self._wait_for(fd, wait_path, result_path, started)
+                if response is not None:
+                    CTYUN_COALESCED.labels(path, 'host').inc()
+                    return response
+                # the other process failed or is too slow
+                return send()
+
+            with self._lock:
+                self._calls += 1
+                prune = self._calls % 100 == 0
+            if prune:
+                self._prune()
+            wait_fd = os.open(wait_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                try:
+                    response = send()
+                    waited = self._has_waiters(wait_fd)
+                    if waited:
+                        self._write(result_path, response)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                if waited:
+                    self._remove_when_read(wait_fd, result_path)
+                return response
+            finally:
+                os.close(wait_fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _has_waiters(wait_fd):
+        try:
+            fcntl.flock(wait_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(wait_fd, fcntl.LOCK_UN)
+        return False
+
+    def _remove_when_read(self, wait_fd, result_path):
+        """
+        Remove the response once the waiters released their shared flock, or after wait_timeout
+        """
+        deadline = self.clock() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(wait_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if self.clock() >= deadline:
+                    break
+                self.sleep(0.005)
+        try:
+            os.remove(result_path)
+        except OSError:
+            pass
+        fcntl.flock(wait_fd, fcntl.LOCK_UN)
+
+    def _wait_for(self, fd, wait_path, result_path, started):
+        """
+        :return: the response of the process holding the lock, None if it left none
+        """
+        deadline = started + self.wait_timeout
+        wait_fd = os.open(wait_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # tells the process holding the lock to leave its response
+            fcntl.flock(wait_fd, fcntl.LOCK_SH)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if self.clock() >= deadline:
+                        return None
+                    self.sleep(0.005)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            try:
+                with open(result_path) as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                return None
+        finally:
+            os.close(wait_fd)
+        if stored['at'] < started:
+            return None
+        return CoalescedResponse(stored['status'], stored['headers'], stored['body'])
+
+    def _write(self, result_path, response):
+        stored = json.dumps({'at': self.clock(), 'status': response.status,
+                'headers': dict(response.headers or {}), 'body': response.body})
+        tmp_path = '%s.%d.%d.tmp' % (result_path, os.getpid(), threading.get_ident())
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(stored)
+        os.replace(tmp_path, result_path)
+
+    def _prune(self):
+        expired = self.clock() - self.result_ttl
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(('.json', '.lock', '.wait')):
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                if os.stat(path).st_mtime < expired:
+                    os.remove(path)
+            except OSError:
+                continue
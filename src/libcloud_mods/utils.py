@@ -1,5 +1,6 @@
 import hashlib
 
+
 def md5(access_key='', secret_key='', *args):
     """
     :param access_key: accesskey
@@ -7,15 +8,30 @@ def md5(access_key='', secret_key='', *args):
     :param args: other post params
     :return: md5 encoded vkey
     """
-    m2 = hashlib.md5()
-    vkey = '' + access_key
-    for param in args:
-        if not isinstance(param, str): 
-            param = str(param)
-        vkey = vkey + '_' + param
+    vkey = '_'.join([access_key] + [param if isinstance(param, str) else str(param) for param in args]
+            + [secret_key])
+    return hashlib.md5(vkey.encode('utf-8')).hexdigest()
+
+
+class VKeySigner(object):
+    """
+    md5 vKey of one account, same digest as md5(access_key, secret_key, *args):
+    the hash state of the access key is computed once and copied for each call
+    """
+
+    def __init__(self, access_key='', secret_key=''):
+        self.access_key = access_key
+        self._prefix = hashlib.md5(access_key.encode('utf-8'))
+        self._suffix = ('_' + secret_key).encode('utf-8')
 
-    vkey = vkey + '_' + secret_key
-    m2.update(vkey.encode('utf-8'))
-    # print vkey
-    print(m2.hexdigest())
-    return m2.hexdigest()
+    def sign(self, *args):
+        """
+        :param args: other post params, in vKey order
+        :return: md5 encoded vkey
+        """
+        m = self._prefix.copy()
+        if args:
+            m.update(('_' + '_'.join([param if isinstance(param, str) else str(param) for param in args]))
+                    .encode('utf-8'))
+        m.update(self._suffix)
+        return m.hexdigest()
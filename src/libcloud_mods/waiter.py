@@ -0,0 +1,202 @@
+import time
+from collections import OrderedDict
+
+from libcloud.compute.base import Node, StorageVolume, VolumeSnapshot
+
+from .ctyun import CTYUN_DEFAULT_PAGE_SIZE, CTYUN_NODE_STATE, CTYUN_VOLUME_STATE, CTyunListingError
+
+
+def _status_of(response_json, field):
+    """
+    :return: the status found in returnObj of a get*Status response
+    """
+    return_obj = response_json.get('returnObj')
+    if isinstance(return_obj, dict):
+        return return_obj.get(field, return_obj.get('status'))
+    return return_obj
+
+
+class CTyunWaiter(object):
+    """
+    Polls many pending VMs, disks and snapshots in shared rounds until each reaches its target state.
+
+    Each round asks for every still pending resource at once, either with one bulk listing
+    (getVMList, getDatadiskList, snapshotList) when that takes fewer calls than the per-item
+    status apis, or with the per-item calls run concurrently. Rounds back off while nothing
+    changes and restart at interval as soon as a resource moves.
+    """
+
+    def __init__(self, driver, interval=2, max_interval=30, backoff=1.5, bulk_threshold=10,
+            concurrency=10, page_size=CTYUN_DEFAULT_PAGE_SIZE, zone_id=1, clock=time.monotonic,
+            sleep=time.sleep):
+        """
+        :param driver: CTyunNodeDriver
+        :param interval: seconds between rounds while resources are changing
+        :param max_interval: upper bound of the backed off interval
+        :param backoff: interval multiplier of a round without any change
+        :param bulk_threshold: pending resources of one kind from which a bulk listing is used,
+            until a listing has shown how many pages it takes
+        :param concurrency: max per-item status calls in flight
+        :param page_size: Page Size of the bulk listings
+        :param zone_id: zone of volumes and snapshots without zoneId in extra
+        """
+        self.driver = driver
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.bulk_threshold = bulk_threshold
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.zone_id = zone_id
+        self.clock = clock
+        self.sleep = sleep
+        self.api_calls = 0
+        self._listing_pages = {}
+
+    def iter_until_state(self, resources, target_state, timeout=600):
+        """
+        :param resources: Node, StorageVolume or VolumeSnapshot Objects, kinds may be mixed
+        :param target_state: state name, e.g. 'running', or its CTYUN_NODE_STATE/CTYUN_VOLUME_STATE value
+        :param timeout: seconds to wait
+        :return: generator yielding each resource as soon as it reaches target_state,
+            with its state attribute updated
+        """
+        pending = OrderedDict(((self._kind(r), r.id), r) for r in resources)
+        last_states = {}
+        deadline = self.clock() + timeout
+        interval = self.interval
+        while pending:
+            states = self._poll(list(pending.values()))
+            changed = False
+            for key, resource in list(pending.items()):
+                if key not in states:
+                    continue
+                state = states[key]
+                changed = changed or last_states.get(key, state) != state
+                last_states[key] = state
+                if state == self._target(key[0], target_state):
+                    del pending[key]
+                    resource.state = state
+                    changed = True
+                    yield resource
+
+            remaining = deadline - self.clock()
+            if not pending or remaining <= 0:
+                return
+            interval = self.interval if changed else min(interval * self.backoff, self.max_interval)
+            self.sleep(min(interval, remaining))
+
+    def wait_until_state(self, resources, target_state, timeout=600):
+        """
+        :return: (resources which reached target_state, resources still pending at timeout)
+        """
+        resources = list(resources)
+        ready = list(self.iter_until_state(resources, target_state, timeout))
+        ready_ids = set((self._kind(r), r.id) for r in ready)
+        return ready, [r for r in resources if (self._kind(r), r.id) not in ready_ids]
+
+    def _poll(self, resources):
+        """
+        :return: dict of (kind, id) to current state, for the resources found
+        """
+        states = {}
+        for kind in ('node', 'volume', 'snapshot'):
+            group = [r for r in resources if self._kind(r) == kind]
+            if not group:
+                continue
+            if kind == 'node':
+                zones = {None: group}
+            else:
+                zones = {}
+                for resource in group:
+                    zones.setdefault(resource.extra.get('zoneId') or self.zone_id, []).append(resource)
+            for zone_id, members in zones.items():
+                if self._use_listing(kind, zone_id, len(members)):
+                    try:
+                        states.update(self._poll_listing(kind, zone_id, members))
+                        continue
+                    except CTyunListingError:
+                        # a failed page costs this round the per-item calls, not the whole wait
+                        pass
+                states.update(self._poll_each(kind, zone_id, members))
+        return states
+
+    def _use_listing(self, kind, zone_id, pending):
+        pages = self._listing_pages.get((kind, zone_id))
+        if pages is None:
+            return pending >= self.bulk_threshold
+        return pages < pending
+
+    def _poll_listing(self, kind, zone_id, members):
+        wanted = set(r.id for r in members)
+        states = {}
+        fetched = 0
+        if kind == 'node':
+            listing = self.driver.iter_nodes(page_size=self.page_size)
+        elif kind == 'volume':
+            listing = self.driver.iter_volumes(zone_id=zone_id, page_size=self.page_size)
+        else:
+            listing = self.driver.iter_snapshots(zone_id=zone_id, page_size=self.page_size)
+        for resource in listing:
+            fetched += 1
+            if resource.id in wanted:
+                states[(kind, resource.id)] = resource.state
+                if len(states) == len(wanted):
+                    break
+        pages = max(1, (fetched + self.page_size - 1) // self.page_size)
+        self._listing_pages[(kind, zone_id)] = pages
+        self.api_calls += pages
+        return states
+
+    def _poll_each(self, kind, zone_id, members):
+        if kind == 'node':
+            def call(node):
+                return self.driver.get_vm_status(node.id)
+        elif kind == 'volume':
+            def call(volume):
+                return self.driver.get_disk_status(volume.extra.get('diskId') or volume.id)
+        else:
+            def call(snapshot):
+                return self.driver.get_vm_snapshot_status(snapshot.id, zone_id)
+
+        states = {}
+        for result in self.driver._run_bulk(call, members, self.concurrency):
+            self.api_calls += 1
+            if not result.success:
+                continue
+            if kind == 'node':
+                status = _status_of(result.result, 'vmStatus')
+                state = CTYUN_NODE_STATE.get(status, status)
+            elif kind == 'volume':
+                status = _status_of(result.result, 'diskStatus')
+                state = CTYUN_VOLUME_STATE.get(status, status)
+            else:
+                state = _status_of(result.result, 'status')
+            states[(kind, result.item.id)] = state
+        return states
+
+    @staticmethod
+    def _target(kind, target_state):
+        if kind == 'node':
+            return CTYUN_NODE_STATE.get(target_state, target_state)
+        if kind == 'volume':
+            return CTYUN_VOLUME_STATE.get(target_state, target_state)
+        return target_state
+
+    @staticmethod
+    def _kind(resource):
+        if isinstance(resource, Node):
+            return 'node'
+        if isinstance(resource, StorageVolume):
+            return 'volume'
+        if isinstance(resource, VolumeSnapshot):
+            return 'snapshot'
+        raise Exception('Invalid param resource %r is not a Node, StorageVolume or VolumeSnapshot' % resource)
+
+
+def wait_until_state(driver, resources, target_state, timeout=600, **kwargs):
+    """
+    Wait with a CTyunWaiter built from kwargs
+    :return: (resources which reached target_state, resources still pending at timeout)
+    """
+    return CTyunWaiter(driver, **kwargs).wait_until_state(resources, target_state, timeout)
@@ -0,0 +1,214 @@
+import json
+
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+class Vm(db.Model):
+    __tablename__ = 'ctyun_vms'
+
+    id = db.Column(db.String(64), primary_key=True)
+    name = db.Column(db.String(255))
+    state = db.Column(db.Integer, index=True)
+    public_ip = db.Column(db.String(64), index=True)
+    private_ip = db.Column(db.String(64), index=True)
+    zone_id = db.Column(db.String(32), index=True)
+    apply_date = db.Column(db.String(32))
+    due_date = db.Column(db.String(32), index=True)
+    synced_at = db.Column(db.DateTime, nullable=False, index=True)
+    # last sync which found the row new or changed, set by sync.stamp_changes
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # REST field name to column name
+    api_columns = {'id': 'id', 'name': 'name', 'state': 'state', 'publicIP': 'public_ip',
+            'privateIP': 'private_ip', 'zoneId': 'zone_id', 'applyDate': 'apply_date', 'dueDate': 'due_date'}
+
+    @staticmethod
+    def row_from(node, synced_at):
+        return {'id': node.id,
+                'name': node.name,
+                'state': node.state,
+                'public_ip': node.public_ips[0] if node.public_ips else None,
+                'private_ip': node.private_ips[0] if node.private_ips else None,
+                'zone_id': _str(node.extra.get('zoneId')),
+                'apply_date': node.extra.get('applyDate'),
+                'due_date': node.extra.get('dueDate'),
+                'synced_at': synced_at}
+
+    def to_dict(self):
+        return dict((field, getattr(self, column)) for field, column in self.api_columns.items())
+
+
+class Disk(db.Model):
+    __tablename__ = 'ctyun_disks'
+
+    id = db.Column(db.String(64), primary_key=True)
+    disk_id = db.Column(db.String(64))
+    name = db.Column(db.String(255))
+    size = db.Column(db.Integer)
+    state = db.Column(db.Integer, index=True)
+    status = db.Column(db.Integer)
+    zone_id = db.Column(db.String(32), index=True)
+    vm_name = db.Column(db.String(255), index=True)
+    is_sys_volume = db.Column(db.String(16))
+    is_packaged = db.Column(db.String(16))
+    apply_date = db.Column(db.String(32))
+    due_date = db.Column(db.String(32), index=True)
+    synced_at = db.Column(db.DateTime, nullable=False, index=True)
+    # last sync which found the row new or changed, set by sync.stamp_changes
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    api_columns = {'id': 'id', 'diskId': 'disk_id', 'name': 'name', 'size': 'size', 'state': 'state',
+            'status': 'status', 'zoneId': 'zone_id', 'vmName': 'vm_name', 'isSysVolume': 'is_sys_volume',
+            'isPackaged': 'is_packaged', 'applyDate': 'apply_date', 'dueDate': 'due_date'}
+
+    @staticmethod
+    def row_from(volume, synced_at):
+        return {'id': volume.id,
+                'disk_id': volume.extra.get('diskId'),
+                'name': volume.name,
+                'size': volume.size,
+                'state': volume.state,
+                'status': volume.extra.get('status'),
+                'zone_id': _str(volume.extra.get('zoneId')),
+                'vm_name': volume.extra.get('vmName'),
+                'is_sys_volume': _str(volume.extra.get('isSysVolume')),
+                'is_packaged': _str(volume.extra.get('isPackaged')),
+                'apply_date': volume.extra.get('applyDate'),
+                'due_date': volume.extra.get('dueDate'),
+                'synced_at': synced_at}
+
+    def to_dict(self):
+        return dict((field, getattr(self, column)) for field, column in self.api_columns.items())
+
+
+class Snapshot(db.Model):
+    __tablename__ = 'ctyun_snapshots'
+
+    id = db.Column(db.String(64), primary_key=True)
+    name = db.Column(db.String(255))
+    vm_id = db.Column(db.String(64), index=True)
+    zone_id = db.Column(db.String(32), index=True)
+    state = db.Column(db.String(32))
+    size = db.Column(db.Integer)
+    created = db.Column(db.String(32))
+    synced_at = db.Column(db.DateTime, nullable=False, index=True)
+    # last sync which found the row new or changed, set by sync.stamp_changes
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    api_columns = {'id': 'id', 'name': 'name', 'vmId': 'vm_id', 'zoneId': 'zone_id', 'state': 'state',
+            'size': 'size', 'created': 'created'}
+
+    @staticmethod
+    def row_from(snapshot, synced_at):
+        return {'id': snapshot.id,
+                'name': snapshot.name,
+                'vm_id': snapshot.extra.get('vmId'),
+                'zone_id': _str(snapshot.extra.get('zoneId')),
+                'state': _str(snapshot.state),
+                'size': snapshot.size,
+                'created': _str(snapshot.created),
+                'synced_at': synced_at}
+
+    def to_dict(self):
+        return dict((field, getattr(self, column)) for field, column in self.api_columns.items())
+
+
+def order_id(order):
+    """
+    :return: id of an order json of getOrderList
+    """
+    return _str(order.get('orderId', order.get('id')))
+
+
+class Order(db.Model):
+    __tablename__ = 'ctyun_orders'
+
+    id = db.Column(db.String(64), primary_key=True)
+    # the order json as returned by getOrderList, its fields are not modelled
+    data = db.Column(db.Text, nullable=False)
+    synced_at = db.Column(db.DateTime, nullable=False, index=True)
+    # last sync which found the row new or changed, set by sync.stamp_changes
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @staticmethod
+    def row_from(order, synced_at):
+        return {'id': order_id(order),
+                'data': json.dumps(order, sort_keys=True),
+                'synced_at': synced_at}
+
+    def to_dict(self):
+        return json.loads(self.data)
+
+
+def _isoformat(value):
+    return None if value is None else value.isoformat()
+
+
+class Job(db.Model):
+    __tablename__ = 'ctyun_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    operation = db.Column(db.String(64), nullable=False)
+    # json of the driver func kwargs
+    params = db.Column(db.Text, nullable=False)
+    access_key = db.Column(db.String(64))
+    status = db.Column(db.String(16), nullable=False, index=True)
+    # json response of the driver func
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(128))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # a running job past its lease lost its worker
+    lease_until = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {'id': self.id,
+                'operation': self.operation,
+                'params': json.loads(self.params),
+                'status': self.status,
+                'result': None if self.result is None else json.loads(self.result),
+                'error': self.error,
+                'createdAt': _isoformat(self.created_at),
+                'startedAt': _isoformat(self.started_at),
+                'finishedAt': _isoformat(self.finished_at)}
+
+
+class FeedEvent(db.Model):
+    __tablename__ = 'ctyun_feed_events'
+
+    # the event id of the change feed
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(32), nullable=False)
+    kind = db.Column(db.String(16), nullable=False, index=True)
+    resource_id = db.Column(db.String(64), nullable=False)
+    # json of the event data
+    data = db.Column(db.Text, nullable=False)
+    time = db.Column(db.Float, nullable=False)
+
+
+class FeedState(db.Model):
+    __tablename__ = 'ctyun_feed_states'
+
+    kind = db.Column(db.String(16), primary_key=True)
+    resource_id = db.Column(db.String(64), primary_key=True)
+    # json of the summary of the resource last published
+    data = db.Column(db.Text, nullable=False)
+
+
+class FeedLease(db.Model):
+    __tablename__ = 'ctyun_feed_leases'
+
+    name = db.Column(db.String(64), primary_key=True)
+    # process publishing to the feed until lease_until
+    worker = db.Column(db.String(128))
+    lease_until = db.Column(db.DateTime)
+    # time of the last publish, None until the first one recorded the summaries
+    published_at = db.Column(db.DateTime)
@@ -0,0 +1,69 @@
+import hashlib
+
+from flask import current_app, g, request
+from flask_restful import abort
+
+from libcloud_mods.registry import UnknownAccountError
+
+# header selecting the CTyun account of a request, it must be the account of the api token of the request
+ACCESS_KEY_HEADER = 'X-CTyun-Access-Key'
+# scheme of the Authorization header carrying the api token of a CTyun account
+TOKEN_SCHEME = 'Bearer'
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def ctyun_account():
+    """
+    :return: access key of the CTyun account of the current request: the account of its api token,
+        the default account for the requests without one
+    """
+    if 'ctyun_account' not in g:
+        access_key = current_app.config.get('CTYUN_ACCESS_KEY')
+        authorization = request.headers.get('Authorization')
+        if authorization:
+            scheme, _, token = authorization.partition(' ')
+            access_key = current_app.extensions['ctyun_tokens'].get(_digest(token.strip())) \
+                if scheme == TOKEN_SCHEME else None
+            if access_key is None:
+                abort(401, message='Invalid api token')
+        selected = request.headers.get(ACCESS_KEY_HEADER)
+        if selected and selected != access_key:
+            abort(403, message='CTyun account {} is not the account of the api token'.format(selected))
+        g.ctyun_account = access_key
+    return g.ctyun_account
+
+
+def ctyun_driver():
+    """
+    :return: the warm driver of the CTyun account of the current request, held until its teardown
+    """
+    if 'ctyun_driver' not in g:
+        access_key = ctyun_account()
+        registry = current_app.extensions['ctyun_registry']
+        try:
+            g.ctyun_driver = registry.acquire(access_key)
+        except UnknownAccountError:
+            abort(403, message='Unknown CTyun account {}'.format(access_key))
+    return g.ctyun_driver
+
+
+def init_driver_registry(app, registry, access_key=None):
+    """
+    Serve the accounts of registry, access_key being the account of the requests without api token.
+    app.config['CTYUN_API_TOKENS'] maps the api token of each other account to its access key,
+    the requests send it as Authorization: Bearer <token>.
+    """
+    app.extensions['ctyun_registry'] = registry
+    app.extensions['ctyun_tokens'] = dict((_digest(token), key)
+            for token, key in app.config.get('CTYUN_API_TOKENS', {}).items())
+    app.config.setdefault('CTYUN_ACCESS_KEY', access_key)
+
+    @app.teardown_request
+    def release_driver(exc):
+        driver = g.pop('ctyun_driver', None)
+        if driver is not None:
+            registry.release(driver)
+    return registry
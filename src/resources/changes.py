@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+
+from flask import current_app, request, Response, stream_with_context
+from flask_restful import abort, reqparse, Resource
+
+from changelog import DatabaseChangeLog
+from libcloud_mods.changefeed import CTYUN_CHANGE_FEED_INTERVAL, FEED_KINDS, ChangeFeedExpiredError, CTyunChangeFeed
+from libcloud_mods.inventory import CTyunInventory
+from resources.sources import InventorySource
+
+SSE_MIMETYPE = 'text/event-stream'
+# max seconds a long-poll waits for an event
+MAX_WAIT = 30
+# seconds between two keep-alive comments of an idle event stream
+SSE_HEARTBEAT = 10
+# seconds an event stream lasts before the client reconnects with its Last-Event-ID,
+# each stream holds a request thread of the worker meanwhile
+SSE_STREAM_SECONDS = 25
+# long-polls and event streams waiting at the same time in a worker, half the request threads of
+# uwsgi.ini: the others answer the pending events at once so that they never hold every request thread,
+# their clients fall back to polling every SSE_RETRY ms (streams) or as soon as answered (long-polls)
+MAX_WAITERS = 4
+# milliseconds the client waits before reconnecting
+SSE_RETRY = 3000
+
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('after')
+changes_parser.add_argument('wait', type=float, default=MAX_WAIT)
+changes_parser.add_argument('kind')
+changes_parser.add_argument('format')
+
+
+def change_feed():
+    return current_app.extensions['change_feed']
+
+
+def change_waiters():
+    """
+    :return: the semaphore bounding the clients waiting in this worker, None for no bound
+    """
+    return current_app.extensions.get('change_waiters')
+
+
+def event_dict(feed, event):
+    return {'id': feed.event_id(event), 'type': event.type, 'kind': event.kind, 'resourceId': event.resource_id,
+            'time': event.time, 'data': event.data}
+
+
+def sse_message(event_type, event_id, data):
+    return ('id: %s\nevent: %s\ndata: %s\n\n' % (event_id, event_type, json.dumps(data))).encode('utf-8')
+
+
+def sse_chunks(feed, after, kinds, heartbeat, duration, waiters=None):
+    """
+    Server-sent events following the event id after for duration seconds, a keep-alive comment every heartbeat
+    seconds without event and a reset event with the id to go on from when after is no longer held.
+    Without a free slot in waiters the stream only sends the pending events and ends.
+    """
+    yield ('retry: %d\n\n' % SSE_RETRY).encode('utf-8')
+    waiting = waiters is None or waiters.acquire(blocking=False)
+    try:
+        deadline = time.monotonic() + (duration if waiting else 0)
+        while True:
+            try:
+                events, after = feed.read(after, max(min(heartbeat, deadline - time.monotonic()), 0), kinds)
+            except ChangeFeedExpiredError:
+                after = feed.last_event_id
+                yield sse_message('reset', after, {'lastEventId': after})
+                continue
+            if not events and waiting:
+                yield b': keep-alive\n\n'
+            for event in events:
+                yield sse_message(event.type, feed.event_id(event), event_dict(feed, event))
+            if time.monotonic() >= deadline:
+                return
+    finally:
+        if waiting and waiters is not None:
+            waiters.release()
+
+
+class Changes(Resource):
+    """
+    Typed changes of the fleet: created, deleted, state_changed, ip_changed and due_date_changed.
+
+    One backend poll feeds every client. With Accept: text/event-stream (or ?format=sse) the events are
+    server-sent and resumed from the Last-Event-ID header on reconnect, otherwise GET ?after=<lastEventId>
+    long-polls up to ?wait seconds and answers {"events": [...], "lastEventId": ...}.
+    ?kind=nodes,volumes narrows the kinds. An id no longer held answers 410 with the lastEventId to go on from,
+    the client reloads the fleet listing first.
+    Once the worker has as many clients waiting as it allows, the others get the pending events at once:
+    an event stream then ends after them and its client reconnects SSE_RETRY ms later, so that the
+    clients beyond CHANGE_FEED_MAX_WAITERS poll instead of waiting.
+    """
+
+    def get(self):
+        args = changes_parser.parse_args()
+        kinds = None
+        if args.kind:
+            kinds = set(args.kind.split(','))
+            if not kinds.issubset(FEED_KINDS):
+                abort(400, message='kind must be among {}'.format(', '.join(FEED_KINDS)))
+        feed = change_feed()
+        after = request.headers.get('Last-Event-ID') or args.after
+
+        if args.format == 'sse' or \
+                request.accept_mimetypes.best_match(['application/json', SSE_MIMETYPE]) == SSE_MIMETYPE:
+            chunks = sse_chunks(feed, after, kinds, current_app.config.get('CHANGE_FEED_HEARTBEAT', SSE_HEARTBEAT),
+                    current_app.config.get('CHANGE_FEED_STREAM_SECONDS', SSE_STREAM_SECONDS), change_waiters())
+            response = Response(stream_with_context(chunks), mimetype=SSE_MIMETYPE)
+            response.cache_control.no_cache = True
+            # keep a proxy from buffering the stream
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+
+        wait = min(max(args.wait, 0), MAX_WAIT)
+        waiters = change_waiters()
+        waiting = wait > 0 and (waiters is None or waiters.acquire(blocking=False))
+        try:
+            events, last_event_id = feed.read(after, wait if waiting else 0, kinds)
+        except ChangeFeedExpiredError as e:
+            abort(410, message=str(e), lastEventId=feed.last_event_id)
+        finally:
+            if waiting and waiters is not None:
+                waiters.release()
+        return {'events': [event_dict(feed, event) for event in events], 'lastEventId': last_event_id}
+
+
+def init_change_feed(app, driver):
+    """
+    Reconcile the fleet every app.config['CHANGE_FEED_INTERVAL'] seconds while clients read the changes,
+    sharing the inventory of the fleet source when it serves from the driver.
+    With app.config['CHANGE_FEED_LOG'] 'database', the default, the events are kept in the database
+    and their ids are valid in every worker, 'memory' keeps them in each worker.
+    At most app.config['CHANGE_FEED_MAX_WAITERS'] clients of a worker wait for events at the same time.
+    """
+    source = app.extensions.get('fleet_source')
+    if isinstance(source, InventorySource):
+        inventory = source.inventory
+    else:
+        inventory = CTyunInventory(driver, compact=app.config.get('FLEET_COMPACT', True))
+    log = DatabaseChangeLog(app) if app.config.get('CHANGE_FEED_LOG', 'database') == 'database' else None
+    feed = CTyunChangeFeed(inventory, log=log,
+            interval=app.config.get('CHANGE_FEED_INTERVAL', CTYUN_CHANGE_FEED_INTERVAL))
+    app.extensions['change_feed'] = feed
+    app.extensions['change_waiters'] = threading.BoundedSemaphore(app.config.get('CHANGE_FEED_MAX_WAITERS',
+            MAX_WAITERS))
+    return feed
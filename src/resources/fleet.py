@@ -0,0 +1,178 @@
+import base64
+import hashlib
+import json
+
+from flask import current_app, request, url_for
+from flask_restful import abort, reqparse, Resource
+
+from libcloud_mods.ctyun import CTYUN_NODE_STATE, CTYUN_VOLUME_STATE
+from models import order_id
+from resources.accounts import ctyun_driver
+from resources.sources import FLEET_FIELDS, ORDERS, ListingQuery
+from resources.streaming import NDJSON_MIMETYPE, conditional_response, json_object_chunks, ndjson_chunks, \
+    send_chunks, wants_ndjson
+
+MAX_PAGE_LIMIT = 1000
+
+listing_parser = reqparse.RequestParser()
+listing_parser.add_argument('state')
+listing_parser.add_argument('zoneId')
+listing_parser.add_argument('dueFrom')
+listing_parser.add_argument('dueTo')
+listing_parser.add_argument('namePrefix')
+listing_parser.add_argument('fields')
+listing_parser.add_argument('cursor')
+listing_parser.add_argument('limit', type=int)
+
+
+def abort_if_missing(item, kind, item_id):
+    if item is None:
+        abort(404, message="{} {} doesn't exist".format(kind, item_id))
+
+
+def fleet_source():
+    return current_app.extensions['fleet_source']
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({'after': last_id}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))['after']
+    except (ValueError, KeyError, TypeError):
+        abort(400, message='Invalid cursor {}'.format(cursor))
+
+
+class FleetList(Resource):
+    """
+    Listing with server-side filters (state, zoneId, dueFrom/dueTo, namePrefix), sparse fields
+    (?fields=id,name) and keyset pages (?limit=50, then ?cursor=<next>).
+    Without limit the whole filtered listing is streamed.
+    """
+    kind = None
+    states = {}
+    filters = ('state', 'zoneId', 'dueFrom', 'dueTo', 'namePrefix')
+
+    def get(self):
+        query = self.parse_query()
+        source = fleet_source()
+        etag, last_modified = source.version(self.kind)
+        etag = '%s-%s' % (etag, hashlib.md5(request.query_string).hexdigest()[:12])
+        ndjson = wants_ndjson()
+        response = conditional_response(etag, last_modified, NDJSON_MIMETYPE if ndjson else 'application/json')
+        if response.status_code == 304:
+            return response
+
+        extra = None
+        if query.limit is None:
+            items = source.iter_items(self.kind, query)
+        else:
+            items = list(source.iter_items(self.kind, query._replace(limit=query.limit + 1)))
+            cursor = encode_cursor(self.item_id(items[query.limit - 1])) if len(items) > query.limit else None
+            items = items[:query.limit]
+            extra = {'next': cursor}
+            if cursor is not None:
+                response.headers['X-Next-Cursor'] = cursor
+                response.headers['Link'] = '<%s>; rel="next"' % url_for(request.endpoint, **dict(
+                        request.args.items(), cursor=cursor))
+        chunks = ndjson_chunks(items) if ndjson else json_object_chunks(self.kind, items, extra)
+        return send_chunks(response, chunks)
+
+    @staticmethod
+    def item_id(item):
+        return item['id']
+
+    def parse_query(self):
+        args = listing_parser.parse_args()
+        for name in ('state', 'zoneId', 'dueFrom', 'dueTo', 'namePrefix'):
+            if args[name] is not None and name not in self.filters:
+                abort(400, message='{} can not be filtered by {}'.format(self.kind, name))
+
+        fields = None
+        if args['fields']:
+            if self.kind not in FLEET_FIELDS:
+                abort(400, message='{} can not be projected'.format(self.kind))
+            fields = [field for field in args['fields'].split(',') if field]
+            unknown = [field for field in fields if field not in FLEET_FIELDS[self.kind]]
+            if unknown:
+                abort(400, message='Unknown fields {}'.format(', '.join(unknown)))
+            if 'id' not in fields:
+                fields.insert(0, 'id')
+
+        limit = args['limit']
+        if limit is not None and not 0 < limit <= MAX_PAGE_LIMIT:
+            abort(400, message='limit must be between 1 and {}'.format(MAX_PAGE_LIMIT))
+
+        state = args['state']
+        if state is not None:
+            state = self.states.get(state, state)
+            if self.states and not isinstance(state, int):
+                if not state.lstrip('-').isdigit():
+                    abort(400, message='Unknown state {}'.format(args['state']))
+                state = int(state)
+
+        return ListingQuery(state=state, zone_id=args['zoneId'], due_from=args['dueFrom'],
+                due_to=args['dueTo'], name_prefix=args['namePrefix'], fields=fields,
+                after=decode_cursor(args['cursor']) if args['cursor'] else None, limit=limit)
+
+
+class NodeList(FleetList):
+    kind = 'nodes'
+    states = CTYUN_NODE_STATE
+
+
+class Node(Resource):
+    def get(self, node_id):
+        node = fleet_source().get('nodes', node_id)
+        abort_if_missing(node, 'Node', node_id)
+        return node
+
+
+class VolumeList(FleetList):
+    kind = 'volumes'
+    states = CTYUN_VOLUME_STATE
+
+
+class SnapshotList(FleetList):
+    kind = 'snapshots'
+    filters = ('state', 'zoneId', 'namePrefix')
+
+
+def _fields(kind, resource):
+    return dict((field, getter(resource)) for field, getter in FLEET_FIELDS[kind].items())
+
+
+class Topology(Resource):
+    """
+    Each VM of a zone with its data disks and snapshots, joined from one walk of the zone listings
+    whatever the count of VMs. volumes or snapshots is null for a VM whose own listing failed.
+    """
+
+    def get(self, zone_id):
+        topology = ctyun_driver().ex_get_fleet_topology(zone_id=zone_id)
+        nodes = []
+        for entry in topology.entries:
+            node = _fields('nodes', entry.node)
+            node['volumes'] = None if entry.volumes is None else [_fields('volumes', volume)
+                    for volume in entry.volumes]
+            node['snapshots'] = None if entry.snapshots is None else [_fields('snapshots', snapshot)
+                    for snapshot in entry.snapshots]
+            nodes.append(node)
+        return {'zoneId': zone_id, 'nodes': nodes,
+                'unattachedVolumes': [_fields('volumes', volume) for volume in topology.unattached_volumes],
+                'unattachedSnapshots': [_fields('snapshots', snapshot)
+                    for snapshot in topology.unattached_snapshots]}
+
+
+class OrderList(FleetList):
+    """
+    The order json as listed by getOrderList, with the etag, streaming and keyset pages of the other listings
+    """
+    kind = ORDERS
+    filters = ()
+
+    @staticmethod
+    def item_id(item):
+        return order_id(item)
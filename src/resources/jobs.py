@@ -0,0 +1,67 @@
+from flask import current_app, request
+from flask_restful import abort, Resource
+
+from jobs import JOB_OPERATIONS, JobQueue, JobWorkerPool
+from resources.accounts import ctyun_driver
+from resources.warmup import postfork
+
+# seconds a client should wait before polling a queued job
+JOB_RETRY_AFTER = 2
+
+
+def job_pool():
+    return current_app.extensions.get('job_pool')
+
+
+class JobList(Resource):
+    """
+    POST {"operation": "buy_cloud", "params": {"cpu": 2, "memory": 4, ...}} queues a long-running driver call
+    and answers 202 right away, its status is then polled at the Location of the job
+    """
+
+    def post(self):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400, message='Expected a json object')
+        operation = body.get('operation')
+        params = body.get('params', {})
+        if operation not in JOB_OPERATIONS:
+            abort(400, message='operation must be among {}'.format(', '.join(JOB_OPERATIONS)))
+        if not isinstance(params, dict):
+            abort(400, message='params must be a json object')
+        access_key = ctyun_driver().accesskey if 'ctyun_registry' in current_app.extensions else None
+        try:
+            job = JobQueue().enqueue(operation, params, access_key)
+        except TypeError as e:
+            abort(400, message=str(e))
+        pool = job_pool()
+        if pool is not None:
+            pool.notify()
+        return job.to_dict(), 202, {'Location': '%s/%s' % (request.path.rstrip('/'), job.id),
+                'Retry-After': str(JOB_RETRY_AFTER)}
+
+
+class JobStatus(Resource):
+    def get(self, job_id):
+        job = JobQueue().get(job_id)
+        if job is None:
+            abort(404, message="Job {} doesn't exist".format(job_id))
+        if job.status in ('queued', 'running'):
+            return job.to_dict(), 200, {'Retry-After': str(JOB_RETRY_AFTER)}
+        return job.to_dict()
+
+
+def init_job_workers(app, driver):
+    """
+    Run app.config['JOB_WORKERS'] job threads in each worker once forked, none by default:
+    the jobs are then run by `flask run-jobs` in its own process
+    """
+    pool = JobWorkerPool(app, driver, size=app.config.get('JOB_WORKERS', 0))
+    app.extensions['job_pool'] = pool
+    if not pool.size:
+        return pool
+    if postfork is not None:
+        postfork(pool.start)
+    else:
+        pool.start()
+    return pool
@@ -0,0 +1,53 @@
+import time
+
+from flask import Response, g, request
+from flask_restful import Resource
+
+from libcloud_mods.metrics import REGISTRY
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds',
+        'Latency of the api requests until the response starts', ['method', 'endpoint'])
+HTTP_REQUESTS = REGISTRY.counter('http_requests_total', 'Api requests by response status',
+        ['method', 'endpoint', 'status'])
+HTTP_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'Api requests being handled')
+
+
+class Metrics(Resource):
+    def get(self):
+        return Response(REGISTRY.exposition(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def init_request_metrics(app):
+    """
+    Record every request of app in the http_* metrics, share the samples of the uwsgi
+    processes through app.config['METRICS_DIR'] when set
+    """
+    if app.config.get('METRICS_DIR'):
+        REGISTRY.configure(app.config['METRICS_DIR'])
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.labels().inc()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            HTTP_IN_FLIGHT.labels().dec()
+            HTTP_REQUEST_SECONDS.labels(request.method, _endpoint()).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(request.method, _endpoint(), response.status_code).inc()
+        return response
+
+    @app.teardown_request
+    def record_failure(exc):
+        # after_request is skipped when a view raised
+        if g.pop('metrics_started', None) is not None:
+            HTTP_IN_FLIGHT.labels().dec()
+            HTTP_REQUESTS.labels(request.method, _endpoint(), 500).inc()
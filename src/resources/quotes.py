@@ -0,0 +1,60 @@
+from flask import current_app, request
+from flask_restful import abort, Resource
+
+from libcloud_mods.quotes import CTyunQuoteEngine
+from resources.accounts import ctyun_driver
+
+# max configurations of one grid
+MAX_GRID_SIZE = 400
+
+
+def quote_engine():
+    return current_app.extensions['quote_engine']
+
+
+def _numbers(body, name, default):
+    values = body.get(name, default)
+    if not isinstance(values, list) or not values or \
+            not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        abort(400, message='{} must be a non empty list of numbers'.format(name))
+    return values
+
+
+class QuoteGrid(Resource):
+    """
+    POST {"cpu": [1, 2], "memory": [2, 4], "datahd": [40], "bw": [1], "periods": [[1, 1], [1, 12]], "zones": [1]}
+    quotes every combination with getNewOrderPrice in one go
+    """
+
+    def post(self):
+        driver = ctyun_driver() if 'ctyun_registry' in current_app.extensions else None
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400, message='Expected a json object')
+        cpu = _numbers(body, 'cpu', None)
+        memory = _numbers(body, 'memory', None)
+        datahd = _numbers(body, 'datahd', [0])
+        bw = _numbers(body, 'bw', [1])
+        zones = _numbers(body, 'zones', [1])
+        periods = body.get('periods', [[1, 1]])
+        if not isinstance(periods, list) or not periods or \
+                not all(isinstance(period, list) and len(period) == 2 for period in periods):
+            abort(400, message='periods must be a non empty list of [periodType, periodNum]')
+        size = len(cpu) * len(memory) * len(datahd) * len(bw) * len(zones) * len(periods)
+        if size > MAX_GRID_SIZE:
+            abort(400, message='{} configurations, at most {} are quoted at once'.format(size, MAX_GRID_SIZE))
+
+        quotes = quote_engine().new_order_grid(cpu, memory, datahd=datahd, bw=bw,
+                periods=[tuple(period) for period in periods], zones=zones, os=body.get('os', 1), driver=driver)
+        return {'quotes': [dict(quote.params, price=quote.price,
+                returnCode=quote.response.get('returnCode') if quote.response else None,
+                error=str(quote.error) if quote.error is not None else None) for quote in quotes]}
+
+
+def init_quote_engine(app, driver):
+    """
+    Quote engine of the app, its warm-up is started after fork by resources.warmup
+    """
+    engine = CTyunQuoteEngine(driver, ttl=app.config.get('QUOTE_TTL', 300))
+    app.extensions['quote_engine'] = engine
+    return engine
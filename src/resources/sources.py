@@ -0,0 +1,226 @@
+import datetime
+import json
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+
+from sqlalchemy import func
+
+from libcloud_mods.inventory import CTyunInventory
+from models import Disk, Order, Snapshot, Vm, db, order_id
+
+# filters, field projection and keyset position of a listing, None means unrestricted
+ListingQuery = namedtuple('ListingQuery', ['state', 'zone_id', 'due_from', 'due_to', 'name_prefix', 'fields',
+        'after', 'limit'], defaults=(None,) * 8)
+
+NODE_FIELDS = {
+    'id': lambda node: node.id,
+    'name': lambda node: node.name,
+    'state': lambda node: node.state,
+    'publicIP': lambda node: node.public_ips[0] if node.public_ips else None,
+    'privateIP': lambda node: node.private_ips[0] if node.private_ips else None,
+    'zoneId': lambda node: node.extra.get('zoneId'),
+    'applyDate': lambda node: node.extra.get('applyDate'),
+    'dueDate': lambda node: node.extra.get('dueDate'),
+}
+
+VOLUME_FIELDS = {
+    'id': lambda volume: volume.id,
+    'diskId': lambda volume: volume.extra.get('diskId'),
+    'name': lambda volume: volume.name,
+    'size': lambda volume: volume.size,
+    'state': lambda volume: volume.state,
+    'status': lambda volume: volume.extra.get('status'),
+    'zoneId': lambda volume: volume.extra.get('zoneId'),
+    'vmName': lambda volume: volume.extra.get('vmName'),
+    'isSysVolume': lambda volume: volume.extra.get('isSysVolume'),
+    'isPackaged': lambda volume: volume.extra.get('isPackaged'),
+    'applyDate': lambda volume: volume.extra.get('applyDate'),
+    'dueDate': lambda volume: volume.extra.get('dueDate'),
+}
+
+SNAPSHOT_FIELDS = {
+    'id': lambda snapshot: snapshot.id,
+    'name': lambda snapshot: snapshot.name,
+    'vmId': lambda snapshot: snapshot.extra.get('vmId'),
+    'zoneId': lambda snapshot: snapshot.extra.get('zoneId'),
+    'state': lambda snapshot: snapshot.state,
+    'size': lambda snapshot: snapshot.size,
+    'created': lambda snapshot: snapshot.created,
+}
+
+FLEET_FIELDS = {'nodes': NODE_FIELDS, 'volumes': VOLUME_FIELDS, 'snapshots': SNAPSHOT_FIELDS}
+# the order json is served as listed by getOrderList, without filters nor projection
+ORDERS = 'orders'
+
+
+class DatabaseSource(object):
+    """
+    Serves the fleet from the tables filled by sync.InventorySync
+    """
+    models = {'nodes': Vm, 'volumes': Disk, 'snapshots': Snapshot, ORDERS: Order}
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+
+    def version(self, kind):
+        """
+        Rows keep their changed_at across the syncs finding them unchanged, a row added or changed
+        moves the max and a row deleted the count
+        :return: (etag, last modified datetime or None) of the listing
+        """
+        model = self.models[kind]
+        count, changed_at = db.session.query(func.count(model.id), func.max(model.changed_at)).one()
+        return '%s-%d-%s' % (kind, count, changed_at.isoformat() if changed_at else '0'), changed_at
+
+    def iter_items(self, kind, query=ListingQuery()):
+        """
+        Filtering, ordering, keyset and projection all run in the database, only the selected columns are read
+        :return: generator of dicts with the fields of the query
+        """
+        if kind == ORDERS:
+            return self._iter_orders(query)
+        return self._iter_resources(kind, query)
+
+    def _iter_resources(self, kind, query):
+        model = self.models[kind]
+        fields = query.fields or list(model.api_columns)
+        rows = db.session.query(*[getattr(model, model.api_columns[field]) for field in fields])
+        if query.state is not None:
+            rows = rows.filter(model.state == query.state)
+        if query.zone_id is not None:
+            rows = rows.filter(model.zone_id == str(query.zone_id))
+        if query.due_from is not None:
+            rows = rows.filter(model.due_date >= query.due_from)
+        if query.due_to is not None:
+            rows = rows.filter(model.due_date <= query.due_to)
+        if query.name_prefix:
+            rows = rows.filter(model.name.startswith(query.name_prefix, autoescape=True))
+        if query.after is not None:
+            rows = rows.filter(model.id > query.after)
+        rows = rows.order_by(model.id)
+        if query.limit is not None:
+            rows = rows.limit(query.limit)
+        for row in rows.yield_per(self.batch_size):
+            yield dict(zip(fields, row))
+
+    def _iter_orders(self, query):
+        rows = db.session.query(Order.data)
+        if query.after is not None:
+            rows = rows.filter(Order.id > query.after)
+        rows = rows.order_by(Order.id)
+        if query.limit is not None:
+            rows = rows.limit(query.limit)
+        for row in rows.yield_per(self.batch_size):
+            yield json.loads(row[0])
+
+    def get(self, kind, item_id):
+        row = self.models[kind].query.get(item_id)
+        return None if row is None else row.to_dict()
+
+
+class InventorySource(object):
+    """
+    Serves the fleet live from the driver through a CTyunInventory refreshed once older than max_age seconds
+    """
+
+    def __init__(self, inventory, max_age=60):
+        self.inventory = inventory
+        self.max_age = max_age
+        self._refresh_lock = threading.Lock()
+        # orders are not held by the inventory: the sorted ids and the orders by id of the last listing
+        self._order_ids = []
+        self._orders = {}
+        self._orders_version = 0
+        self._orders_modified = None
+        self._orders_refreshed_at = None
+
+    def version(self, kind):
+        if kind == ORDERS:
+            self._ensure_fresh_orders()
+            return ('%s-%d' % (kind, self._orders_version),
+                    datetime.datetime.utcfromtimestamp(self._orders_modified))
+        self._ensure_fresh()
+        return ('%s-%d' % (kind, self.inventory.version),
+                datetime.datetime.utcfromtimestamp(self.inventory.last_modified))
+
+    def iter_items(self, kind, query=ListingQuery()):
+        """
+        Filtering and keyset run on the inventory indexes, only the fields of the query are serialized
+        :return: generator of dicts with the fields of the query
+        """
+        if kind == ORDERS:
+            return self._iter_orders(query)
+        return self._iter_resources(kind, query)
+
+    def _iter_resources(self, kind, query):
+        self._ensure_fresh()
+        getters = FLEET_FIELDS[kind]
+        if query.fields:
+            getters = dict((field, getters[field]) for field in query.fields)
+        resources = self.inventory.query(kind, state=query.state, zone_id=query.zone_id,
+                due_from=query.due_from, due_to=query.due_to, name_prefix=query.name_prefix,
+                after=query.after, limit=query.limit)
+        for resource in resources:
+            yield dict((field, getter(resource)) for field, getter in getters.items())
+
+    def _iter_orders(self, query):
+        self._ensure_fresh_orders()
+        ids, orders = self._order_ids, self._orders
+        start = 0 if query.after is None else bisect_right(ids, str(query.after))
+        end = len(ids) if query.limit is None else start + query.limit
+        for item_id in ids[start:end]:
+            yield orders[item_id]
+
+    def get(self, kind, item_id):
+        if kind == ORDERS:
+            self._ensure_fresh_orders()
+            return self._orders.get(item_id)
+        self._ensure_fresh()
+        resource = getattr(self.inventory, kind).rows.get(item_id)
+        if resource is None:
+            return None
+        return dict((field, getter(resource)) for field, getter in FLEET_FIELDS[kind].items())
+
+    def _ensure_fresh(self):
+        refreshed_at = self.inventory.refreshed_at
+        if refreshed_at is not None and time.time() - refreshed_at < self.max_age:
+            return
+        with self._refresh_lock:
+            # another thread may have refreshed while this one waited
+            refreshed_at = self.inventory.refreshed_at
+            if refreshed_at is None or time.time() - refreshed_at >= self.max_age:
+                self.inventory.refresh()
+
+    def _ensure_fresh_orders(self):
+        refreshed_at = self._orders_refreshed_at
+        if refreshed_at is not None and time.time() - refreshed_at < self.max_age:
+            return
+        with self._refresh_lock:
+            refreshed_at = self._orders_refreshed_at
+            if refreshed_at is not None and time.time() - refreshed_at < self.max_age:
+                return
+            orders = dict((order_id(order), order) for order in self.inventory.driver.iter_orders(
+                    page_size=self.inventory.page_size, concurrency=self.inventory.concurrency))
+            now = time.time()
+            if self._orders_modified is None or orders != self._orders:
+                # a listing finding the same orders keeps the etag
+                self._order_ids = sorted(orders)
+                self._orders = orders
+                self._orders_version += 1
+                self._orders_modified = now
+            self._orders_refreshed_at = now
+
+
+def init_fleet_source(app, driver):
+    """
+    Pick the fleet source from app.config['FLEET_SOURCE']: 'database' (default) or 'driver'
+    """
+    if app.config.get('FLEET_SOURCE', 'database') == 'driver':
+        source = InventorySource(CTyunInventory(driver, compact=app.config.get('FLEET_COMPACT', True)),
+                max_age=app.config.get('FLEET_MAX_AGE', 60))
+    else:
+        source = DatabaseSource()
+    app.extensions['fleet_source'] = source
+    return source
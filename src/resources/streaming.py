@@ -0,0 +1,78 @@
+import json
+import zlib
+from itertools import islice
+
+from flask import Response, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# items serialized per written chunk
+STREAM_CHUNK_ITEMS = 200
+
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_chunks(items):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, STREAM_CHUNK_ITEMS))
+        if not chunk:
+            return
+        yield ''.join(json.dumps(item) + '\n' for item in chunk).encode('utf-8')
+
+
+def json_object_chunks(key, items, extra=None):
+    """
+    Stream {key: [items...], **extra} without building it in memory
+    """
+    yield ('{%s: [' % json.dumps(key)).encode('utf-8')
+    items = iter(items)
+    first = True
+    while True:
+        chunk = list(islice(items, STREAM_CHUNK_ITEMS))
+        if not chunk:
+            break
+        body = ', '.join(json.dumps(item) for item in chunk)
+        yield (body if first else ', ' + body).encode('utf-8')
+        first = False
+    tail = ''.join(', %s: %s' % (json.dumps(name), json.dumps(value)) for name, value in (extra or {}).items())
+    yield (']%s}\n' % tail).encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def conditional_response(etag, last_modified, mimetype):
+    """
+    :return: an empty response carrying the validators, already turned into a 304
+        when the client holds this etag/last modified version.
+        The representations negotiated with Accept differ, the etag is suffixed by the mimetype
+    """
+    response = Response(mimetype=mimetype)
+    response.set_etag('%s-%s' % (etag, mimetype.rsplit('/', 1)[-1]), weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+
+def send_chunks(response, chunks):
+    """
+    Stream the chunks of bytes as the response body, gzip compressed when the client accepts it
+    """
+    if 'gzip' in request.accept_encodings:
+        response.content_encoding = 'gzip'
+        chunks = gzip_chunks(chunks)
+    response.response = stream_with_context(chunks)
+    return response
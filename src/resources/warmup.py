@@ -0,0 +1,45 @@
+import threading
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # not running under uwsgi
+    postfork = None
+
+
+def warm_up(app, driver):
+    """
+    Fill the catalog cache and the connection pool of driver when app.config['CTYUN_WARM_UP'] is set,
+    keep the common quotes warm when app.config['QUOTE_WARM_UP'] is set
+    """
+    if app.config.get('CTYUN_WARM_UP'):
+        try:
+            driver.ex_warm_up()
+        except Exception:
+            # requests fetch the catalog on demand meanwhile
+            app.logger.exception('CTyun warm-up failed')
+    if app.config.get('QUOTE_WARM_UP') and 'quote_engine' in app.extensions:
+        app.extensions['quote_engine'].start_warm_up()
+
+
+def start_warm_up(app, driver):
+    """
+    Run warm_up in a daemon thread, the worker serves requests meanwhile
+    """
+    thread = threading.Thread(target=warm_up, args=(app, driver), name='ctyun-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_warm_up(app, driver):
+    """
+    Warm up every worker once forked when app.config['CTYUN_WARM_UP'] or app.config['QUOTE_WARM_UP'] is set.
+    Under uwsgi this runs in each worker after fork, nothing is connected nor started in the master,
+    otherwise it starts right away.
+    """
+    if not app.config.get('CTYUN_WARM_UP') and not app.config.get('QUOTE_WARM_UP'):
+        return
+    if postfork is not None:
+        postfork(lambda: start_warm_up(app, driver))
+    else:
+        start_warm_up(app, driver)
@@ -0,0 +1,123 @@
+import datetime
+from itertools import islice
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from libcloud_mods.ctyun import CTYUN_DEFAULT_PAGE_SIZE
+from models import Disk, Order, Snapshot, Vm, db
+
+SYNC_BATCH_SIZE = 500
+
+
+def upsert_rows(session, model, rows):
+    """
+    Write rows with one multi-row statement.
+    PostgreSQL uses INSERT ... ON CONFLICT (id) DO UPDATE, other databases (sqlite in tests)
+    delete the ids of the batch and insert them again within the same transaction.
+    """
+    if not rows:
+        return
+    # a row listed twice, e.g. moved across a page boundary during the walk, may only be written once
+    rows = list(dict((row['id'], row) for row in rows).values())
+    table = model.__table__
+    if session.bind.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_=dict((column.name, statement.excluded[column.name])
+                    for column in table.columns if column.name != 'id'))
+        session.execute(statement)
+    else:
+        session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+        session.execute(table.insert().values(rows))
+
+
+def stamp_changes(session, model, rows, synced_at):
+    """
+    Set changed_at of the rows: synced_at for the new and changed ones, the stored one for the others,
+    so that the versions of the listings only move when their content did
+    """
+    table = model.__table__
+    if 'changed_at' not in table.c or not rows:
+        return rows
+    columns = [column for column in table.columns if column.name not in ('id', 'synced_at', 'changed_at')]
+    stored = dict((row[0], row[1:]) for row in session.execute(
+            select([table.c.id, table.c.changed_at] + columns).where(table.c.id.in_([row['id'] for row in rows]))))
+    for row in rows:
+        previous = stored.get(row['id'])
+        unchanged = previous is not None and \
+            tuple(previous[1:]) == tuple(row.get(column.name) for column in columns)
+        row['changed_at'] = previous[0] if unchanged else synced_at
+    return rows
+
+
+class InventorySync(object):
+    """
+    Streams VMs, disks, snapshots and orders from the driver into the database.
+
+    Pages are written as they arrive in batches of batch_size rows with bulk upserts,
+    rows not seen by a run are deleted at its end. synced_at is bumped on every row seen,
+    changed_at only on the rows new or changed.
+    """
+
+    def __init__(self, driver, session=None, zone_ids=(1,), batch_size=SYNC_BATCH_SIZE,
+            page_size=CTYUN_DEFAULT_PAGE_SIZE, concurrency=1):
+        self.driver = driver
+        self.session = session or db.session
+        self.zone_ids = tuple(zone_ids)
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.concurrency = concurrency
+
+    def run(self):
+        """
+        :return: dict of synced row count per table
+        """
+        synced_at = datetime.datetime.utcnow()
+        counts = {
+            'vms': self._sync(Vm, (Vm.row_from(node, synced_at) for node in self.driver.iter_nodes(
+                page_size=self.page_size, concurrency=self.concurrency)), synced_at),
+            'disks': self._sync(Disk, (Disk.row_from(volume, synced_at) for volume in self._iter_volumes()),
+                synced_at),
+            'snapshots': self._sync(Snapshot, (Snapshot.row_from(snapshot, synced_at)
+                for snapshot in self._iter_snapshots()), synced_at),
+            'orders': self._sync(Order, (Order.row_from(order, synced_at) for order in self.driver.iter_orders(
+                page_size=self.page_size, concurrency=self.concurrency)), synced_at),
+        }
+        return counts
+
+    def _sync(self, model, rows, synced_at):
+        """
+        Rows not seen are only deleted once the walk completed, a failed walk rolls the table back as it was
+        """
+        count = 0
+        rows = iter(rows)
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                upsert_rows(self.session, model, stamp_changes(self.session, model, batch, synced_at))
+                count += len(batch)
+            self.session.execute(model.__table__.delete().where(model.__table__.c.synced_at < synced_at))
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            raise
+        return count
+
+    def _iter_volumes(self):
+        for zone_id in self.zone_ids:
+            for volume in self.driver.iter_volumes(zone_id=zone_id, page_size=self.page_size,
+                    concurrency=self.concurrency):
+                volume.extra.setdefault('zoneId', zone_id)
+                yield volume
+
+    def _iter_snapshots(self):
+        for zone_id in self.zone_ids:
+            for snapshot in self.driver.iter_snapshots(zone_id=zone_id, page_size=self.page_size,
+                    concurrency=self.concurrency):
+                if snapshot.extra.get('zoneId') is None:
+                    snapshot.extra['zoneId'] = zone_id
+                yield snapshot
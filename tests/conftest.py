@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark-json', default=None, help='write the benchmark results to this json file')
+
+
+def pytest_configure(config):
+    config.benchmark_report = BenchmarkReport()
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    report = config.benchmark_report
+    if not report.results:
+        return
+    terminalreporter.write_sep('=', 'benchmark')
+    for line in report.lines():
+        terminalreporter.write_line(line)
+    path = config.getoption('--benchmark-json')
+    if path:
+        with open(path, 'w') as f:
+            json.dump(report.results, f, indent=2)
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of samples, p between 0 and 100
+    """
+    ordered = sorted(samples)
+    return ordered[max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)]
+
+
+class BenchmarkReport(object):
+    """
+    Throughput and latency percentiles of the benchmark runs, printed at the end of the session
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def record(self, name, samples, elapsed, items=None, errors=0):
+        """
+        :param samples: seconds of each call
+        :param elapsed: wall seconds of the whole run
+        :param items: items processed, defaults to one per sample
+        """
+        items = len(samples) if items is None else items
+        result = {'name': name, 'calls': len(samples), 'errors': errors,
+                'throughput': items / elapsed if elapsed else 0.0,
+                'p50': percentile(samples, 50), 'p95': percentile(samples, 95), 'p99': percentile(samples, 99)}
+        self.results.append(result)
+        return result
+
+    def lines(self):
+        yield '%-36s %7s %6s %12s %9s %9s %9s' % ('name', 'calls', 'errors', 'items/s', 'p50 ms', 'p95 ms',
+                'p99 ms')
+        for r in self.results:
+            yield '%-36s %7d %6d %12.1f %9.2f %9.2f %9.2f' % (r['name'], r['calls'], r['errors'], r['throughput'],
+                    r['p50'] * 1000, r['p95'] * 1000, r['p99'] * 1000)
+
+
+@pytest.fixture
+def benchmark_report(request):
+    return request.config.benchmark_report
+
+
+@pytest.fixture
+def ctyun_simulator():
+    from .simulator import CTyunSimulator
+
+    with CTyunSimulator(vms=25, zone_ids=(1, 2)) as simulator:
+        yield simulator
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every POST with returnCode 200 and echoes the api path and form back in returnObj
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        form = dict(parse_qsl(self.rfile.read(int(self.headers['Content-Length'])).decode()))
+        self.server.peers.add(self.client_address)
+        self.server.requests.append((self.path, form))
+        body = json.dumps({'returnCode': 200, 'returnObj': {'path': self.path, 'form': form}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.daemon_threads = True
+    httpd.peers = set()
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def db_app():
+    from flask import Flask
+    from flask_restful import Api
+
+    from models import db
+    from resources.fleet import Node, NodeList, OrderList, SnapshotList, VolumeList
+    from resources.sources import DatabaseSource
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.extensions['fleet_source'] = DatabaseSource()
+    api = Api(app)
+    api.add_resource(NodeList, '/api/nodes')
+    api.add_resource(Node, '/api/nodes/<node_id>')
+    api.add_resource(VolumeList, '/api/volumes')
+    api.add_resource(SnapshotList, '/api/snapshots')
+    api.add_resource(OrderList, '/api/orders')
+    with app.app_context():
+        db.create_all()
+        yield app
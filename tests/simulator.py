@@ -0,0 +1,527 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from libcloud_mods.endpoints import CTYUN_ENDPOINTS, CTYUN_FIELD_NAMES
+
+# transient state of a vm while an operation runs, and the state it settles in
+CTYUN_SIM_TRANSITIONS = {'startVM': ('starting', 'running'), 'stopVM': ('stopping', 'stopped'),
+        'restartVM': ('restarting', 'running'), 'reinstallVM': ('restarting', 'running'),
+        'rollbackSnapshot': ('restoreing', 'running')}
+
+CTYUN_SIM_ZONES = [{'zoneId': 1, 'zoneName': 'sim-zone-1'}, {'zoneId': 2, 'zoneName': 'sim-zone-2'}]
+CTYUN_SIM_VM_TYPES = [{'cpu': cpu, 'memory': memory, 'name': '%sC%sG' % (cpu, memory)}
+        for cpu, memory in ((1, 1), (1, 2), (2, 4), (4, 8), (8, 16), (16, 32))]
+CTYUN_SIM_OS = [{'os': 1, 'osName': 'CentOS 7.6'}, {'os': 2, 'osName': 'Ubuntu 18.04'},
+        {'os': 3, 'osName': 'Windows Server 2016'}]
+
+
+class CTyunApiError(Exception):
+    def __init__(self, return_code, message):
+        super(CTyunApiError, self).__init__(message)
+        self.return_code = return_code
+        self.message = message
+
+
+def _vkey(access_key, secret_key, *args):
+    return hashlib.md5('_'.join([access_key] + [str(arg) for arg in args] + [secret_key])
+            .encode('utf-8')).hexdigest()
+
+
+def _per_path(value, path, default=0):
+    """
+    :param value: number for every api, or dict of api path to number
+    """
+    if isinstance(value, dict):
+        return value.get(path, default)
+    return value
+
+
+class CTyunSimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, without this every keep-alive call waits on a delayed ack
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True))
+        status, response_json = self.server.simulator.handle(self.path, form)
+        body = json.dumps(response_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CTyunSimulator(object):
+    """
+    Local stand-in of the CTyun api serving a generated fleet.
+
+    Every /api/* path used by CTyunNodeDriver is served with its vKey checked, listings are
+    paginated with totalCount, vm operations pass through their transient state for
+    transition_time seconds, and latency, jitter and failures can be injected per api path.
+    """
+
+    def __init__(self, accounts=None, vms=100, disks_per_vm=1, snapshots_per_vm=1, zone_ids=(1,),
+            latency=0, jitter=0, error_rate=0, api_error_rate=0, transition_time=0, seed=0,
+            host='127.0.0.1', port=0):
+        """
+        :param accounts: dict of access key to secret key, defaults to {'simulator': 'simulator'}
+        :param vms: vms generated, spread over zone_ids
+        :param disks_per_vm: data disks generated and bound to each vm
+        :param snapshots_per_vm: snapshots generated for each vm
+        :param latency: seconds added to each response, or dict of api path to seconds
+        :param jitter: max random seconds added on top of latency, or dict of api path to seconds
+        :param error_rate: share of requests answered with http 503, or dict of api path to share
+        :param api_error_rate: share of requests answered with returnCode 500, or dict of api path to share
+        :param transition_time: seconds a vm stays starting, stopping, restarting...
+        :param port: 0 picks a free port
+        """
+        self.accounts = accounts or {'simulator': 'simulator'}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.api_error_rate = api_error_rate
+        self.transition_time = transition_time
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.vms = {}
+        self.disks = {}
+        self.snapshots = {}
+        self.orders = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._httpd = None
+        self._thread = None
+        self._endpoints = dict((endpoint.path, endpoint) for endpoint in CTYUN_ENDPOINTS)
+        self._populate(vms, disks_per_vm, snapshots_per_vm, tuple(zone_ids))
+
+    # server #
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), CTyunSimulatorHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.simulator = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='ctyun-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def driver_kwargs(self):
+        """
+        :return: kwargs of CTyunNodeDriver talking to this simulator with its first account
+        """
+        key, secret = next(iter(self.accounts.items()))
+        return {'key': key, 'secret': secret, 'host': self.host, 'port': self.port, 'secure': False}
+
+    def handle(self, path, form):
+        """
+        :return: (http status, response json)
+        """
+        self.calls[path] += 1
+        delay = _per_path(self.latency, path) + self._random.uniform(0, _per_path(self.jitter, path))
+        if delay > 0:
+            time.sleep(delay)
+        if self._random.random() < _per_path(self.error_rate, path):
+            return 503, {'returnCode': 503, 'message': 'simulated service unavailable'}
+        if self._random.random() < _per_path(self.api_error_rate, path):
+            return 200, {'returnCode': 500, 'message': 'simulated api error'}
+
+        endpoint = self._endpoints.get(path)
+        if endpoint is None:
+            return 404, {'returnCode': 404, 'message': 'no api %s' % path}
+        secret = self.accounts.get(form.get('accessKey'))
+        if secret is None:
+            return 401, {'returnCode': 401, 'message': 'unknown accessKey'}
+        values = [form.get(CTYUN_FIELD_NAMES.get(param, param), '') for param in endpoint.signed]
+        if form.get('vKey') != _vkey(form['accessKey'], secret, *values):
+            return 200, {'returnCode': 900, 'message': 'vKey check failed'}
+
+        with self._lock:
+            try:
+                return_obj = getattr(self, '_api_%s' % endpoint.name)(form)
+            except CTyunApiError as e:
+                return 200, {'returnCode': e.return_code, 'message': e.message}
+        return 200, {'returnCode': 200, 'message': 'success', 'returnObj': return_obj}
+
+    # fleet #
+    def _populate(self, vms, disks_per_vm, snapshots_per_vm, zone_ids):
+        states = ['running'] * 8 + ['stopped', 'dueed']
+        for i in range(vms):
+            zone_id = zone_ids[i % len(zone_ids)]
+            vm = self._new_vm(zone_id, state=self._random.choice(states))
+            for _ in range(disks_per_vm):
+                self._new_disk(zone_id, size=self._random.choice((10, 20, 50, 100)), vm=vm)
+            for _ in range(snapshots_per_vm):
+                self._new_snapshot(vm)
+
+    def _next_id(self, prefix):
+        self._sequence += 1
+        return '%s-%08d' % (prefix, self._sequence)
+
+    def _new_vm(self, zone_id, state='running', cpu=1, memory=1, os_type=1, bw=1):
+        vm_id = self._next_id('vm')
+        host = self._sequence
+        vm = {'id': vm_id, 'vmName': 'sim%s' % vm_id[3:], 'vmStatus': state,
+                'publicIP': '100.%d.%d.%d' % (host >> 16 & 255, host >> 8 & 255, host & 255),
+                'privateIP': '192.168.%d.%d' % (host >> 8 & 255, host & 255),
+                'applyDate': '2021-01-01 00:00:00', 'dueDate': '2022-%02d-%02d 00:00:00' % (host % 12 + 1,
+                host % 28 + 1), 'zoneId': zone_id, 'cpu': cpu, 'memory': memory, 'os': os_type, 'bw': bw,
+                'password': 'Sim%06d!' % (host % 1000000)}
+        self.vms[vm_id] = vm
+        return vm
+
+    def _new_disk(self, zone_id, size, vm=None):
+        disk_id = self._next_id('disk')
+        disk = {'id': disk_id, 'diskId': 'sd' + disk_id[5:], 'diskName': 'data%s' % disk_id[5:],
+                'diskStatus': 'bind' if vm else 'unbind', 'diskSize': size, 'isSysVolume': '0',
+                'isPackaged': '0', 'status': 1, 'applyDate': '2021-01-01 00:00:00',
+                'dueDate': '2022-01-01 00:00:00', 'vmName': vm['vmName'] if vm else '',
+                'vmId': vm['id'] if vm else '', 'zoneId': zone_id}
+        self.disks[disk_id] = disk
+        return disk
+
+    def _new_snapshot(self, vm, name=None):
+        snapshot_id = self._next_id('snap')
+        snapshot = {'snapshotId': snapshot_id, 'snapshotName': name or 'snap%s' % snapshot_id[5:],
+                'vmId': vm['id'], 'zoneId': vm['zoneId'], 'status': 'available', 'size': 40,
+                'createDate': '2021-06-01 00:00:00'}
+        self.snapshots[snapshot_id] = snapshot
+        return snapshot
+
+    def _new_order(self, kind, amount, resources=()):
+        order_id = self._next_id('order')
+        order = {'orderId': order_id, 'type': kind, 'amount': amount, 'status': 'unpaid',
+                'resources': list(resources), 'createDate': time.strftime('%Y-%m-%d %H:%M:%S')}
+        self.orders[order_id] = order
+        return order
+
+    def _vm(self, form):
+        vm = self.vms.get(form.get('id'))
+        if vm is None:
+            raise CTyunApiError(404, 'no vm %s' % form.get('id'))
+        self._settle(vm)
+        return vm
+
+    def _disk(self, form):
+        disk = self.disks.get(form.get('diskId'))
+        if disk is None:
+            raise CTyunApiError(404, 'no disk %s' % form.get('diskId'))
+        return disk
+
+    def _order(self, form):
+        order = self.orders.get(form.get('orderId'))
+        if order is None:
+            raise CTyunApiError(404, 'no order %s' % form.get('orderId'))
+        return order
+
+    def _snapshot(self, form):
+        snapshot = self.snapshots.get(form.get('snapshotId'))
+        if snapshot is None:
+            raise CTyunApiError(404, 'no snapshot %s' % form.get('snapshotId'))
+        return snapshot
+
+    def _transition(self, vm, api):
+        transient, settled = CTYUN_SIM_TRANSITIONS[api]
+        if self.transition_time > 0:
+            vm['vmStatus'] = transient
+            vm['_settles_at'] = (time.monotonic() + self.transition_time, settled)
+        else:
+            vm['vmStatus'] = settled
+        return {'id': vm['id'], 'vmStatus': vm['vmStatus']}
+
+    @staticmethod
+    def _settle(vm):
+        settles = vm.get('_settles_at')
+        if settles is not None and time.monotonic() >= settles[0]:
+            vm['vmStatus'] = settles[1]
+            del vm['_settles_at']
+
+    @staticmethod
+    def _public(item):
+        return dict((name, value) for name, value in item.items() if not name.startswith('_'))
+
+    def _page(self, items, form, list_key):
+        page_no = max(int(form.get('pageNo') or 1), 1)
+        page_size = max(int(form.get('pageSize') or 10), 1)
+        start = (page_no - 1) * page_size
+        return {list_key: [self._public(item) for item in items[start:start + page_size]],
+                'totalCount': len(items), 'pageNo': page_no, 'pageSize': page_size}
+
+    @staticmethod
+    def _price(*units):
+        return round(sum(units), 2)
+
+    # catalog #
+    def _api_list_zone(self, form):
+        return CTYUN_SIM_ZONES
+
+    def _api_list_vm_type(self, form):
+        return CTYUN_SIM_VM_TYPES
+
+    def _api_list_os(self, form):
+        return CTYUN_SIM_OS
+
+    # prices and orders #
+    def _api_get_new_order_price(self, form):
+        months = int(form['periodNum']) * (12 if form['periodType'] == '2' else 1)
+        unit = self._price(int(form['cpu']) * 40, float(form['memory']) * 15, int(form['datahd']) * 0.5,
+                int(form['bw']) * 20)
+        return {'price': round(unit * months * int(form['orderNum']), 2)}
+
+    def _api_buy_cloud(self, form):
+        vms = [self._new_vm(int(form['zoneId']), cpu=int(form['cpu']), memory=form['memory'],
+                os_type=form['os'], bw=int(form['bw'])) for _ in range(int(form['orderNum']))]
+        for vm in vms:
+            if int(form['datahd']):
+                self._new_disk(vm['zoneId'], int(form['datahd']), vm)
+        order = self._new_order('new', self._api_get_new_order_price(form)['price'], [vm['id'] for vm in vms])
+        return {'orderId': order['orderId']}
+
+    def _api_buy_trial_cloud(self, form):
+        vm = self._new_vm(int(form['zoneId']), cpu=int(form['cpu']), memory=form['memory'],
+                os_type=form['os'], bw=int(form['bw']))
+        return {'orderId': self._new_order('trial', 0, [vm['id']])['orderId']}
+
+    def _api_get_renew_order_price(self, form):
+        vm = self._vm(form)
+        return {'price': self._price(vm['cpu'] * 40, float(vm['memory']) * 15) * int(form['periodNum'])}
+
+    def _api_renew_cloud(self, form):
+        price = self._api_get_renew_order_price(form)['price']
+        return {'orderId': self._new_order('renew', price, [form['id']])['orderId']}
+
+    def _api_get_upgrade_order_price(self, form):
+        vm = self._vm(form)
+        return {'price': max(self._price((int(form['cpu']) - vm['cpu']) * 40,
+                (float(form['memory']) - float(vm['memory'])) * 15), 0)}
+
+    def _api_upgrade_cloud(self, form):
+        price = self._api_get_upgrade_order_price(form)['price']
+        vm = self._vm(form)
+        vm['cpu'], vm['memory'] = int(form['cpu']), form['memory']
+        return {'orderId': self._new_order('upgrade', price, [vm['id']])['orderId']}
+
+    def _api_get_data_disk_price(self, form):
+        return {'price': self._price(int(form['datahd']) * 0.5) * int(form['periodNum'])}
+
+    def _api_buy_data_disk(self, form):
+        disk = self._new_disk(int(form['zoneId']), int(form['datahd']))
+        price = self._api_get_data_disk_price(form)['price']
+        return {'orderId': self._new_order('disk', price, [disk['id']])['orderId'], 'diskId': disk['diskId']}
+
+    def _api_get_renew_data_disk_price(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        return {'price': self._price(disk['diskSize'] * 0.5) * int(form['periodNum'])}
+
+    def _api_renew_data_disk(self, form):
+        price = self._api_get_renew_data_disk_price(form)['price']
+        return {'orderId': self._new_order('renew_disk', price, [form['diskId']])['orderId']}
+
+    def _api_get_upgrade_bandwidth_price(self, form):
+        vm = self._vm(form)
+        return {'price': max(self._price((int(form['bw']) - vm['bw']) * 20), 0)}
+
+    def _api_upgrade_bandwidth(self, form):
+        price = self._api_get_upgrade_bandwidth_price(form)['price']
+        self._vm(form)['bw'] = int(form['bw'])
+        return {'orderId': self._new_order('bandwidth', price, [form['id']])['orderId']}
+
+    def _api_pay_order(self, form):
+        order = self._order(form)
+        if order['status'] != 'unpaid':
+            raise CTyunApiError(400, 'order %s is %s' % (order['orderId'], order['status']))
+        order['status'] = 'paid'
+        return {'orderId': order['orderId'], 'status': order['status']}
+
+    def _api_refund_cloud(self, form):
+        vm = self._vm(form)
+        del self.vms[vm['id']]
+        return {'orderId': self._new_order('refund', 0, [vm['id']])['orderId']}
+
+    def _api_refund_disk(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        del self.disks[disk['id']]
+        return {'orderId': self._new_order('refund_disk', 0, [disk['id']])['orderId']}
+
+    def _api_get_order_list(self, form):
+        return self._page(list(self.orders.values()), form, 'orderList')
+
+    def _api_get_order_detail(self, form):
+        return self._public(self._order(form))
+
+    def _api_cancel_order(self, form):
+        order = self._order(form)
+        order['status'] = 'canceled'
+        return {'orderId': order['orderId'], 'status': order['status']}
+
+    # vms #
+    def _api_get_vm_list(self, form):
+        for vm in self.vms.values():
+            self._settle(vm)
+        return self._page(list(self.vms.values()), form, 'VMList')
+
+    def _api_get_vm_list_by_orderid(self, form):
+        resources = set(self._order(form)['resources'])
+        return {'VMList': [self._public(vm) for vm in self.vms.values() if vm['id'] in resources]}
+
+    def _api_get_vm_detail_info(self, form):
+        return self._public(self._vm(form))
+
+    def _api_get_vm_password(self, form):
+        return {'password': self._vm(form)['password']}
+
+    def _api_reset_vm_password(self, form):
+        vm = self._vm(form)
+        vm['password'] = 'Sim%06d!' % self._random.randrange(1000000)
+        return {'password': vm['password']}
+
+    def _api_get_vm_status(self, form):
+        vm = self._vm(form)
+        return {'id': vm['id'], 'vmStatus': vm['vmStatus']}
+
+    def _api_start_vm(self, form):
+        return self._transition(self._vm(form), 'startVM')
+
+    def _api_stop_vm(self, form):
+        return self._transition(self._vm(form), 'stopVM')
+
+    def _api_restart_vm(self, form):
+        return self._transition(self._vm(form), 'restartVM')
+
+    def _api_get_reinstall_os(self, form):
+        self._vm(form)
+        return CTYUN_SIM_OS
+
+    def _api_reinstall_vm(self, form):
+        vm = self._vm(form)
+        vm['os'] = form['os']
+        return self._transition(vm, 'reinstallVM')
+
+    # disks #
+    def _disk_by_disk_id(self, disk_id):
+        for disk in self.disks.values():
+            if disk['diskId'] == disk_id or disk['id'] == disk_id:
+                return disk
+        raise CTyunApiError(404, 'no disk %s' % disk_id)
+
+    def _api_get_data_disk_list(self, form):
+        zone_id = int(form.get('zoneId') or 1)
+        return self._page([disk for disk in self.disks.values() if disk['zoneId'] == zone_id], form, 'DiskList')
+
+    def _api_get_disk_list_by_orderid(self, form):
+        resources = set(self._order(form)['resources'])
+        return {'DiskList': [self._public(disk) for disk in self.disks.values() if disk['id'] in resources]}
+
+    def _api_get_disk_list_by_vmid(self, form):
+        vm = self._vm(form)
+        return {'DiskList': [self._public(disk) for disk in self.disks.values() if disk['vmId'] == vm['id']]}
+
+    def _api_rename_data_disk(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        disk['diskName'] = form['newName']
+        return self._public(disk)
+
+    def _api_band_data_disk(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        vm = self._vm(form)
+        if disk['diskStatus'] == 'bind':
+            raise CTyunApiError(400, 'disk %s is already bound' % form['diskId'])
+        disk.update(diskStatus='bind', vmId=vm['id'], vmName=vm['vmName'])
+        return self._public(disk)
+
+    def _api_unband_data_disk(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        if disk['vmId'] != form['id']:
+            raise CTyunApiError(400, 'disk %s is not bound to %s' % (form['diskId'], form['id']))
+        disk.update(diskStatus='unbind', vmId='', vmName='')
+        return self._public(disk)
+
+    def _api_get_disk_status(self, form):
+        disk = self._disk_by_disk_id(form['diskId'])
+        return {'diskId': disk['diskId'], 'diskStatus': disk['diskStatus']}
+
+    # snapshots #
+    def _api_get_snapshot_list(self, form):
+        zone_id = int(form.get('zoneId') or 1)
+        return self._page([snapshot for snapshot in self.snapshots.values() if snapshot['zoneId'] == zone_id],
+                form, 'snapshotList')
+
+    def _api_create_snapshot(self, form):
+        return self._public(self._new_snapshot(self._vm(form), form.get('snapshotName')))
+
+    def _api_get_vm_snapshot_status(self, form):
+        snapshot = self._snapshot(form)
+        return {'snapshotId': snapshot['snapshotId'], 'status': snapshot['status']}
+
+    def _api_remove_snapshot(self, form):
+        snapshot = self._snapshot(form)
+        del self.snapshots[snapshot['snapshotId']]
+        return {'snapshotId': snapshot['snapshotId']}
+
+    def _api_rollback_snapshot(self, form):
+        snapshot = self._snapshot(form)
+        vm = self.vms.get(snapshot['vmId'])
+        if vm is None:
+            raise CTyunApiError(404, 'no vm %s' % snapshot['vmId'])
+        return self._transition(vm, 'rollbackSnapshot')
+
+    def _api_get_snapshots_by_vmid(self, form):
+        vm = self._vm(form)
+        return {'snapshotList': [self._public(snapshot) for snapshot in self.snapshots.values()
+                if snapshot['vmId'] == vm['id']]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a simulated CTyun api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--access-key', default='simulator')
+    parser.add_argument('--secret-key', default='simulator')
+    parser.add_argument('--vms', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.02, help='max random seconds added on top')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of http 503 responses')
+    parser.add_argument('--api-error-rate', type=float, default=0, help='share of returnCode 500 responses')
+    parser.add_argument('--transition-time', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    simulator = CTyunSimulator(accounts={args.access_key: args.secret_key}, vms=args.vms,
+            zone_ids=range(1, args.zones + 1), latency=args.latency, jitter=args.jitter,
+            error_rate=args.error_rate, api_error_rate=args.api_error_rate,
+            transition_time=args.transition_time, host=args.host, port=args.port).start()
+    print('CTyun simulator on http://%s:%d, CTYUN_API_HOST=%s CTYUN_API_PORT=%d' % (
+            args.host, simulator.port, args.host, simulator.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
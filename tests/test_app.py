@@ -1,5 +1,18 @@
+import os
+import subprocess
+import sys
+
 from app import __version__
 
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_import_connects_nothing():
+    # an unreachable CTyun api must not stop nor slow down the import
+    env = dict(os.environ, CTYUN_API_HOST='127.0.0.1', CTYUN_API_PORT='9', CTYUN_WARM_UP='')
+    code = 'import app, libcloud_mods; assert libcloud_mods.registry.stats()["created"] == 0'
+    subprocess.run([sys.executable, '-c', code], cwd=SRC_DIR, env=env, check=True, timeout=30)
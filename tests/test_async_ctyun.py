@@ -0,0 +1,59 @@
+import asyncio
+from urllib.parse import parse_qsl
+
+from libcloud_mods.async_ctyun import AsyncCTyunNodeDriver
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.endpoints import CTYUN_ENDPOINTS, build_form
+from libcloud_mods.utils import md5
+
+
+class Recorded(Exception):
+    pass
+
+
+def test_endpoint_table_matches_blocking_driver():
+    driver = CTyunNodeDriver('ak', 'sk')
+
+    def request(action, headers=None, data=None, method='GET'):
+        raise Recorded(action, data)
+    driver.connection.request = request
+
+    for endpoint in CTYUN_ENDPOINTS:
+        args = ['%s-%d' % (param, i) for i, param in enumerate(endpoint.params)
+                if param not in endpoint.defaults]
+        try:
+            getattr(driver, endpoint.name)(*args)
+        except Recorded as e:
+            action, data = e.args
+        assert action == endpoint.path
+        assert dict(parse_qsl(data)) == dict(parse_qsl(build_form(endpoint, 'ak', 'sk', *args)))
+
+
+def test_async_driver_runs_many_calls_concurrently(stub_server):
+    async def poll_fleet():
+        async with AsyncCTyunNodeDriver('ak', 'sk', host='127.0.0.1', port=stub_server.server_address[1],
+                max_connections=20) as driver:
+            return await asyncio.gather(*[driver.get_vm_status('vm-%d' % i) for i in range(500)])
+
+    results = asyncio.run(poll_fleet())
+
+    assert len(stub_server.requests) == 500
+    assert len(stub_server.peers) <= 20
+    for i, response_json in enumerate(results):
+        form = response_json['returnObj']['form']
+        assert response_json['returnObj']['path'] == '/api/getVMStatus'
+        assert form == {'accessKey': 'ak', 'vKey': md5('ak', 'sk', 'vm-%d' % i), 'id': 'vm-%d' % i}
+
+
+def test_async_driver_serves_successive_event_loops(stub_server):
+    driver = AsyncCTyunNodeDriver('ak', 'sk', host='127.0.0.1', port=stub_server.server_address[1],
+            max_connections=5)
+
+    async def poll_fleet():
+        return await asyncio.gather(*[driver.get_vm_status('vm-%d' % i) for i in range(50)])
+
+    # the slots and keep-alive sockets of the first loop are not used by the second one
+    for _ in range(2):
+        assert len(asyncio.run(poll_fleet())) == 50
+    asyncio.run(driver.close())
+    assert len(stub_server.requests) == 100
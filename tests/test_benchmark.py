@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+from libcloud.utils.py3 import urlencode
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.endpoints import CTYUN_ENDPOINTS_BY_NAME, CTYUN_FORM_BUILDERS, endpoint_signature
+from sync import InventorySync
+
+from .simulator import CTyunSimulator
+
+pytestmark = pytest.mark.benchmark
+
+BENCH_VMS = 2000
+BENCH_CALLS = 400
+BENCH_CONCURRENCY = 8
+# simulated round trip of the CTyun api, seconds
+BENCH_LATENCY = 0.005
+BENCH_JITTER = 0.005
+# cold imports of the app, each in a new interpreter like a respawned uwsgi worker with lazy-apps
+BENCH_STARTUPS = 5
+BENCH_STARTUP_MAX_SECONDS = 5
+# forms built per run of the request builder microbenchmark
+BENCH_FORMS = 20000
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+ENDPOINTS = {
+    'get_vm_list': lambda driver, vm_id: driver.get_vm_list(page_no=1, page_size=100),
+    'get_vm_detail_info': lambda driver, vm_id: driver.get_vm_detail_info(vm_id),
+    'get_vm_status': lambda driver, vm_id: driver.get_vm_status(vm_id),
+    'start_vm': lambda driver, vm_id: driver.start_vm(vm_id),
+    'get_data_disk_list': lambda driver, vm_id: driver.get_data_disk_list(zone_id=1, page_no=1, page_size=100),
+    'get_snapshot_list': lambda driver, vm_id: driver.get_snapshot_list(zone_id=1, page_no=1, page_size=100),
+    'get_new_order_price': lambda driver, vm_id: driver.get_new_order_price(2, 4, 50, 1, 5, 1, 1, 12, 1),
+}
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    with CTyunSimulator(vms=BENCH_VMS, zone_ids=(1, 2), latency=BENCH_LATENCY, jitter=BENCH_JITTER) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def driver(simulator):
+    return CTyunNodeDriver(ex_pool_size=BENCH_CONCURRENCY, ex_catalog_cache=False, **simulator.driver_kwargs())
+
+
+@pytest.mark.parametrize('name', sorted(ENDPOINTS))
+def test_endpoint_latency(name, simulator, driver, benchmark_report):
+    vm_ids = sorted(simulator.vms)
+    call = ENDPOINTS[name]
+    samples = []
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            return call(driver, vm_ids[i % len(vm_ids)])
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    results = driver._run_bulk(timed, range(BENCH_CALLS), BENCH_CONCURRENCY)
+    elapsed = time.perf_counter() - started
+
+    errors = sum(1 for result in results if not result.success)
+    benchmark_report.record(name, samples, elapsed, errors=errors)
+    assert errors == 0
+
+
+@pytest.mark.parametrize('concurrency', [1, BENCH_CONCURRENCY])
+def test_full_inventory_sync(concurrency, simulator, driver, db_app, benchmark_report):
+    samples = []
+    started = time.perf_counter()
+    for _ in range(3):
+        run_started = time.perf_counter()
+        counts = InventorySync(driver, zone_ids=(1, 2), concurrency=concurrency).run()
+        samples.append(time.perf_counter() - run_started)
+    elapsed = time.perf_counter() - started
+
+    items = counts['vms'] + counts['disks'] + counts['snapshots'] + counts['orders']
+    benchmark_report.record('inventory_sync[concurrency=%d]' % concurrency, samples, elapsed, items=items * 3)
+    assert counts['vms'] == len(simulator.vms)
+
+
+def test_app_startup(simulator, benchmark_report):
+    env = dict(os.environ, CTYUN_API_HOST=simulator.host, CTYUN_API_PORT=str(simulator.port),
+            CTYUN_ACCESS_KEY='simulator', CTYUN_SECRET_KEY='simulator')
+    calls = sum(simulator.calls.values())
+    samples = []
+    for _ in range(BENCH_STARTUPS):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=SRC_DIR, env=env, check=True)
+        samples.append(time.perf_counter() - started)
+    benchmark_report.record('app_startup', samples, sum(samples))
+    assert sum(simulator.calls.values()) == calls
+    assert max(samples) < BENCH_STARTUP_MAX_SECONDS
+
+
+@pytest.mark.parametrize('warm', [False, True])
+def test_first_requests_of_a_worker(warm, simulator, benchmark_report):
+    driver = CTyunNodeDriver(ex_pool_size=BENCH_CONCURRENCY, **simulator.driver_kwargs())
+    if warm:
+        driver.ex_warm_up()
+    samples = []
+    started = time.perf_counter()
+    for call in (driver.list_zone, driver.list_vm_type, lambda: driver.list_os(1), lambda: driver.list_os(2)):
+        call_started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - call_started)
+    benchmark_report.record('first_requests[warm=%s]' % warm, samples, time.perf_counter() - started)
+
+
+def _legacy_form(signature, accesskey, secretkey, *args):
+    # how every driver func built its form before the endpoint table was compiled
+    values = signature.bind(*args)
+    values.apply_defaults()
+    vkey = '' + accesskey
+    for value in values.arguments.values():
+        vkey = vkey + '_' + str(value)
+    vkey = vkey + '_' + secretkey
+    data = dict({'accessKey': accesskey, 'vKey': hashlib.md5(vkey.encode('utf-8')).hexdigest()},
+            id=values.arguments['vm_id'])
+    return urlencode(data)
+
+
+def test_status_polling_form_cpu(simulator, benchmark_report):
+    signature = endpoint_signature(CTYUN_ENDPOINTS_BY_NAME['get_vm_status'])
+    builder = CTYUN_FORM_BUILDERS['get_vm_status']
+    driver = CTyunNodeDriver(**simulator.driver_kwargs())
+    vm_ids = sorted(simulator.vms)
+    cpu = {}
+    for name, build in [('legacy', lambda vm_id: _legacy_form(signature, 'simulator', 'simulator', vm_id)),
+            ('compiled', lambda vm_id: builder.build(driver.signer, (vm_id,), {}))]:
+        started = time.process_time()
+        for i in range(BENCH_FORMS):
+            build(vm_ids[i % len(vm_ids)])
+        cpu[name] = time.process_time() - started
+        benchmark_report.record('get_vm_status_form[%s]' % name, [cpu[name] / BENCH_FORMS] * BENCH_FORMS,
+                cpu[name])
+    assert cpu['compiled'] < cpu['legacy']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_fleet_in_memory(compact, simulator, benchmark_report):
+    driver = CTyunNodeDriver(**simulator.driver_kwargs())
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        nodes = list(driver.iter_nodes(page_size=500, compact=compact))
+        elapsed = time.perf_counter() - started
+        held = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    benchmark_report.record('fleet_in_memory[compact=%s] %d bytes/node' % (compact, held // len(nodes)),
+            [elapsed / len(nodes)] * len(nodes), elapsed)
+    assert len(nodes) == BENCH_VMS
+
+
+@pytest.fixture(scope='module')
+def remote_simulator():
+    # in its own process, so tracemalloc only sees the driver side
+    process = subprocess.Popen([sys.executable, '-u', '-m', 'tests.simulator', '--port', '0',
+            '--vms', str(BENCH_VMS), '--latency', '0', '--jitter', '0'], cwd=os.path.dirname(SRC_DIR),
+            env=dict(os.environ, PYTHONPATH=SRC_DIR), stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        port = int(re.search(r'CTYUN_API_PORT=(\d+)', process.stdout.readline()).group(1))
+        yield {'key': 'simulator', 'secret': 'simulator', 'host': '127.0.0.1', 'port': port, 'secure': False}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_large_page_peak_memory(stream, remote_simulator, benchmark_report):
+    driver = CTyunNodeDriver(**remote_simulator)
+    driver.list_zone()
+    count = 0
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        for _ in driver.iter_nodes(page_size=BENCH_VMS, stream=stream):
+            count += 1
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    benchmark_report.record('large_page[stream=%s] peak %d KiB' % (stream, peak // 1024),
+            [elapsed / count] * count, elapsed)
+    assert count == BENCH_VMS
+
+
+def test_job_burst_keeps_api_latency_flat(simulator, tmp_path, benchmark_report):
+    from flask import Flask
+    from flask_restful import Api
+
+    from jobs import JobWorkerPool
+    from models import Job, db
+    from resources.jobs import JobList, JobStatus
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % tmp_path.joinpath('jobs.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    pool = app.extensions['job_pool'] = JobWorkerPool(app, CTyunNodeDriver(**simulator.driver_kwargs()), size=4,
+            poll_interval=0.05)
+    api = Api(app)
+    api.add_resource(JobList, '/api/jobs')
+    api.add_resource(JobStatus, '/api/jobs/<job_id>')
+    buy = {'cpu': 1, 'memory': 2, 'datahd': 0, 'os': 1, 'bw': 1, 'ordernum': 1, 'periodtype': 1, 'periodnum': 1,
+            'zoneid': 1}
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        pool.start()
+        try:
+            samples = []
+            started = time.perf_counter()
+            for _ in range(BENCH_CALLS // 4):
+                call_started = time.perf_counter()
+                assert client.post('/api/jobs', json={'operation': 'buy_cloud', 'params': buy}).status_code == 202
+                samples.append(time.perf_counter() - call_started)
+            benchmark_report.record('job_enqueue', samples, time.perf_counter() - started)
+
+            while Job.query.filter(Job.status.in_(('queued', 'running'))).count():
+                db.session.commit()
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+            assert Job.query.filter_by(status='succeeded').count() == BENCH_CALLS // 4
+            benchmark_report.record('job_run', [elapsed], elapsed, items=BENCH_CALLS // 4)
+        finally:
+            pool.stop(timeout=5)
+
+
+@pytest.mark.parametrize('join', [False, True])
+def test_fleet_view_page(join, simulator, driver, benchmark_report):
+    nodes = [node for node in driver.iter_nodes() if node.extra['zoneId'] == 1][:BENCH_CALLS // 4]
+    calls = sum(simulator.calls.values())
+    started = time.perf_counter()
+    if join:
+        driver.ex_get_fleet_topology(zone_id=1, nodes=nodes, concurrency=BENCH_CONCURRENCY)
+    else:
+        driver._run_bulk(lambda node: (driver.get_disk_list_by_vmid(node.id),
+                driver.get_snapshots_by_vmid(node.id, 1)), nodes, BENCH_CONCURRENCY)
+    elapsed = time.perf_counter() - started
+    benchmark_report.record('fleet_view_page[join=%s]' % join, [elapsed], elapsed, items=len(nodes))
+    api_calls = sum(simulator.calls.values()) - calls
+    # two zone listings walked page by page against two calls per VM
+    assert api_calls < len(nodes) if join else api_calls == 2 * len(nodes)
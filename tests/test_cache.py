@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from libcloud_mods.cache import TTLCache
+from libcloud_mods.ctyun import CTyunNodeDriver
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_stale_while_revalidate():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=4, clock=clock)
+    loads = []
+    refreshed = threading.Event()
+
+    def loader():
+        loads.append(clock.now)
+        if len(loads) > 1:
+            refreshed.set()
+        return len(loads)
+
+    assert cache.get_or_load('k', loader, ttl=10, stale_ttl=5) == 1
+    clock.now = 9
+    assert cache.get_or_load('k', loader, ttl=10, stale_ttl=5) == 1
+    clock.now = 12
+    assert cache.get_or_load('k', loader, ttl=10, stale_ttl=5) == 1
+    assert refreshed.wait(1)
+    while cache._refreshing:
+        time.sleep(0.001)
+    assert cache.get_or_load('k', loader, ttl=10, stale_ttl=5) == 2
+    clock.now = 100
+    assert cache.get_or_load('k', loader, ttl=10, stale_ttl=5) == 3
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['stale_hits'], stats['misses']) == (2, 1, 2)
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, clock=FakeClock())
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get_or_load(key, lambda: key, ttl=10)
+
+    assert cache.stats()['size'] == 2
+    assert cache.get_or_load('b', lambda: 'reloaded', ttl=10) == 'reloaded'
+
+
+def test_driver_catalog_is_cached_per_params():
+    driver = CTyunNodeDriver('ak', 'sk')
+    calls = []
+
+    def request(action, headers=None, data=None, method='GET'):
+        calls.append((action, data))
+        return type('Response', (), {'body': '{"returnCode": 200, "returnObj": []}'})()
+    driver.connection.request = request
+
+    for _ in range(3):
+        driver.list_vm_type()
+        driver.list_os(1)
+        driver.list_os(2)
+        driver.list_os(zoneid=1)
+
+    assert len(calls) == 3
+    assert driver.ex_catalog_cache_stats()['hits'] == 9
+    with pytest.raises(TypeError):
+        driver.list_os(zone=1)
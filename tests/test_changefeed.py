@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+from changelog import DatabaseChangeLog
+from libcloud_mods.changefeed import ChangeFeedExpiredError, CTyunChangeFeed
+from libcloud_mods.inventory import CTyunInventory
+from models import db
+from resources.changes import Changes
+
+from .test_inventory import make_driver, make_vm
+
+
+def make_feed(fleet, **kwargs):
+    feed = CTyunChangeFeed(CTyunInventory(make_driver(fleet), compact=True), interval=3600, **kwargs)
+    # the first refresh is the baseline, it publishes nothing
+    feed.poll()
+    return feed
+
+
+def change_fleet(fleet):
+    fleet[1] = make_vm(1, status='stopped')
+    fleet[2] = make_vm(2, public_ip='2.2.2.2')
+    fleet[3] = make_vm(3, due_date='2023-01-01')
+    del fleet[4]
+    fleet.append(make_vm(7))
+
+
+def test_refresh_diffs_become_typed_events():
+    fleet = [make_vm(i) for i in range(5)]
+    feed = make_feed(fleet)
+    start = feed.last_event_id
+    assert not feed.log.events
+
+    change_fleet(fleet)
+    feed.poll()
+    try:
+        events, last_event_id = feed.read(start)
+    finally:
+        feed.stop()
+
+    assert sorted((event.type, event.resource_id) for event in events) == [
+        ('created', 'vm-7'), ('deleted', 'vm-4'), ('due_date_changed', 'vm-3'), ('ip_changed', 'vm-2'),
+        ('state_changed', 'vm-1')]
+    by_type = dict((event.type, event) for event in events)
+    assert by_type['state_changed'].data == {'from': 'running', 'to': 'stopped'}
+    assert by_type['ip_changed'].data['to']['publicIP'] == ['2.2.2.2']
+    assert by_type['due_date_changed'].data == {'from': '2022-01-01', 'to': '2023-01-01'}
+    assert last_event_id == feed.event_id(events[-1])
+    assert feed.read(last_event_id) == ([], last_event_id)
+
+
+def test_resuming_from_an_id_no_longer_held_raises():
+    fleet = [make_vm(i) for i in range(5)]
+    feed = make_feed(fleet, maxlen=2)
+    start = feed.last_event_id
+    change_fleet(fleet)
+    feed.poll()
+    try:
+        with pytest.raises(ChangeFeedExpiredError):
+            feed.read(start)
+        with pytest.raises(ChangeFeedExpiredError):
+            feed.read('deadbeef-1')
+        assert len(feed.read(feed.event_id(feed.log.events[0]))[0]) == 1
+    finally:
+        feed.stop()
+
+
+def test_changes_long_poll_and_event_stream():
+    fleet = [make_vm(i) for i in range(5)]
+    feed = make_feed(fleet)
+    start = feed.last_event_id
+    change_fleet(fleet)
+    feed.poll()
+
+    app = Flask(__name__)
+    app.config['CHANGE_FEED_STREAM_SECONDS'] = 0.2
+    app.config['CHANGE_FEED_HEARTBEAT'] = 0.1
+    app.extensions['change_feed'] = feed
+    Api(app).add_resource(Changes, '/api/changes')
+    client = app.test_client()
+    try:
+        body = client.get('/api/changes', query_string={'after': start, 'wait': 0, 'kind': 'nodes'}).get_json()
+        assert len(body['events']) == 5
+        assert body['lastEventId'] == feed.last_event_id
+        assert client.get('/api/changes', query_string={'after': 'deadbeef-1'}).get_json()['lastEventId'] == \
+            feed.last_event_id
+        assert client.get('/api/changes', query_string={'after': 'deadbeef-1'}).status_code == 410
+        assert client.get('/api/changes', query_string={'kind': 'vms'}).status_code == 400
+
+        response = client.get('/api/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': start})
+        assert response.mimetype == 'text/event-stream'
+        messages = [dict(line.split(': ', 1) for line in message.splitlines())
+                for message in response.get_data(as_text=True).split('\n\n') if message.startswith('id:')]
+        assert sorted(message['event'] for message in messages) == [
+            'created', 'deleted', 'due_date_changed', 'ip_changed', 'state_changed']
+        assert messages[-1]['id'] == feed.last_event_id
+        assert json.loads(messages[0]['data'])['kind'] == 'nodes'
+        assert ': keep-alive' in response.get_data(as_text=True)
+
+        # a worker with every waiting slot taken answers at once
+        app.extensions['change_waiters'] = threading.BoundedSemaphore(1)
+        app.extensions['change_waiters'].acquire()
+        started = time.monotonic()
+        assert client.get('/api/changes', query_string={'wait': 5}).get_json()['events'] == []
+        response = client.get('/api/changes', headers={'Accept': 'text/event-stream'})
+        assert ': keep-alive' not in response.get_data(as_text=True)
+        assert time.monotonic() - started < 1
+    finally:
+        feed.stop()
+
+
+def test_database_log_ids_are_valid_in_every_worker(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % tmp_path.joinpath('feed.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    fleet = [make_vm(i) for i in range(5)]
+    # two workers, each with its own inventory
+    feeds = [CTyunChangeFeed(CTyunInventory(make_driver(fleet), compact=True),
+            log=DatabaseChangeLog(app, poll_interval=0.05), interval=3600) for _ in range(2)]
+    feeds[0].poll()
+    start = feeds[1].last_event_id
+    change_fleet(fleet)
+    assert feeds[0].poll() == 5
+    # a worker without the lease does not reconcile
+    other = CTyunChangeFeed(CTyunInventory(make_driver(fleet), compact=True), log=feeds[1].log, interval=3600)
+    other.inventory.refresh = lambda: pytest.fail('refreshed without the lease')
+    monkeypatch.setattr(CTyunChangeFeed, 'worker', 'other-worker')
+    assert other.poll() == 0
+    monkeypatch.undo()
+    try:
+        events, last_event_id = feeds[1].read(start)
+        assert sorted(event.type for event in events) == [
+            'created', 'deleted', 'due_date_changed', 'ip_changed', 'state_changed']
+        assert last_event_id == feeds[0].last_event_id
+        assert feeds[0].read(start) == (events, last_event_id)
+        assert not feeds[1].log.claim('other-worker', 60)
+        with pytest.raises(ChangeFeedExpiredError):
+            feeds[1].read('deadbeef-1')
+    finally:
+        for feed in feeds:
+            feed.stop()
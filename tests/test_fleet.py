@@ -0,0 +1,139 @@
+import gzip
+import json
+
+from flask_restful import Api
+
+from libcloud_mods.inventory import CTyunInventory
+from libcloud_mods.registry import CTyunDriverRegistry
+from resources.accounts import init_driver_registry
+from resources.fleet import Topology
+from resources.sources import InventorySource
+from sync import InventorySync
+
+from .test_sync import make_driver, make_vm
+
+
+def test_listing_streams_json_and_ndjson(db_app):
+    InventorySync(make_driver([make_vm(i) for i in range(3)])).run()
+    client = db_app.test_client()
+
+    response = client.get('/api/nodes')
+    assert response.is_streamed
+    assert [node['id'] for node in response.get_json()['nodes']] == ['vm-0', 'vm-1', 'vm-2']
+
+    response = client.get('/api/nodes', headers={'Accept': 'application/x-ndjson'})
+    lines = response.get_data(as_text=True).splitlines()
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in lines] == ['vm-0', 'vm-1', 'vm-2']
+
+    assert client.get('/api/nodes/vm-1').get_json()['publicIP'] == '1.1.1.1'
+    assert client.get('/api/nodes/vm-9').status_code == 404
+
+
+def test_listing_is_conditional_and_gzipped(db_app):
+    fleet = [make_vm(i) for i in range(3)]
+    InventorySync(make_driver(fleet)).run()
+    client = db_app.test_client()
+
+    response = client.get('/api/nodes', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))['nodes']) == 3
+    etag = response.headers['ETag']
+
+    assert client.get('/api/nodes', headers={'If-None-Match': etag}).status_code == 304
+    assert set(response.vary) == {'Accept', 'Accept-Encoding'}
+    assert client.get('/api/nodes', headers={'If-None-Match': etag, 'Accept': 'application/x-ndjson'}) \
+        .status_code == 200
+
+    # a sync finding the same fleet keeps the etag
+    InventorySync(make_driver(fleet)).run()
+    assert client.get('/api/nodes', headers={'If-None-Match': etag}).status_code == 304
+
+    fleet[0] = make_vm(0, status='stopped')
+    InventorySync(make_driver(fleet)).run()
+    response = client.get('/api/nodes', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    fleet.append(make_vm(3))
+    InventorySync(make_driver(fleet)).run()
+    assert client.get('/api/nodes', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_driver_source_keeps_etag_while_fleet_is_unchanged(db_app):
+    db_app.extensions['fleet_source'] = InventorySource(CTyunInventory(make_driver([make_vm(0)])), max_age=0)
+    client = db_app.test_client()
+
+    etag = client.get('/api/nodes').headers['ETag']
+
+    assert client.get('/api/nodes', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_listing_filters_projects_and_pages(db_app):
+    fleet = [make_vm(i, status='stopped' if i % 2 else 'running') for i in range(7)]
+    InventorySync(make_driver(fleet)).run()
+    client = db_app.test_client()
+
+    for source in (db_app.extensions['fleet_source'], InventorySource(CTyunInventory(make_driver(fleet)))):
+        db_app.extensions['fleet_source'] = source
+        ids, cursor = [], None
+        while True:
+            url = '/api/nodes?state=running&fields=name&limit=2' + ('&cursor=' + cursor if cursor else '')
+            body = client.get(url).get_json()
+            assert all(set(node) == {'id', 'name'} for node in body['nodes'])
+            ids.extend(node['id'] for node in body['nodes'])
+            cursor = body['next']
+            if cursor is None:
+                break
+        assert ids == ['vm-0', 'vm-2', 'vm-4', 'vm-6']
+
+        response = client.get('/api/nodes?namePrefix=vm1&format=ndjson&limit=1')
+        assert [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()] == ['vm-1']
+        assert 'X-Next-Cursor' not in response.headers
+
+    assert client.get('/api/nodes?fields=password').status_code == 400
+    assert client.get('/api/nodes?limit=0').status_code == 400
+    assert client.get('/api/nodes?cursor=garbage').status_code == 400
+    assert client.get('/api/snapshots?dueFrom=2021-01-01').status_code == 400
+
+
+def test_orders_list_through_the_fleet_source(db_app):
+    driver = make_driver([])
+    orders = [{'orderId': 'o-%d' % i, 'status': 'paid'} for i in range(5)]
+    driver.get_order_list = lambda page_no=1, page_size=2: {'returnCode': 200, 'returnObj': {
+            'orderList': orders[(page_no - 1) * page_size:page_no * page_size]}}
+    InventorySync(driver).run()
+    client = db_app.test_client()
+
+    for source in (db_app.extensions['fleet_source'], InventorySource(CTyunInventory(driver))):
+        db_app.extensions['fleet_source'] = source
+        response = client.get('/api/orders')
+        assert response.is_streamed
+        assert response.get_json()['orders'] == orders
+        assert client.get('/api/orders', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+        body = client.get('/api/orders?limit=3').get_json()
+        assert [order['orderId'] for order in body['orders']] == ['o-0', 'o-1', 'o-2']
+        body = client.get('/api/orders?limit=3&cursor=' + body['next']).get_json()
+        assert [order['orderId'] for order in body['orders']] == ['o-3', 'o-4'] and body['next'] is None
+        assert client.get('/api/orders', headers={'Accept': 'application/x-ndjson'}).get_data(
+                as_text=True).count('\n') == 5
+
+    assert client.get('/api/orders?state=1').status_code == 400
+    assert client.get('/api/orders?fields=status').status_code == 400
+
+
+def test_zone_topology_lists_each_kind_once(db_app, ctyun_simulator):
+    kwargs = ctyun_simulator.driver_kwargs()
+    registry = CTyunDriverRegistry({kwargs.pop('key'): kwargs.pop('secret')}, driver_kwargs=kwargs)
+    init_driver_registry(db_app, registry, 'simulator')
+    Api(db_app).add_resource(Topology, '/api/zones/<int:zone_id>/topology')
+
+    body = db_app.test_client().get('/api/zones/2/topology').get_json()
+
+    assert [node['id'] for node in body['nodes']] == [vm['id'] for vm in ctyun_simulator.vms.values()
+            if vm['zoneId'] == 2]
+    assert sum(len(node['volumes']) for node in body['nodes']) + len(body['unattachedVolumes']) == \
+        len([disk for disk in ctyun_simulator.disks.values() if disk['zoneId'] == 2])
+    assert ctyun_simulator.calls['/api/getDatadiskList'] == ctyun_simulator.calls['/api/snapshotList'] == 1
+    assert ctyun_simulator.calls['/api/getDiskListByVmId'] == ctyun_simulator.calls['/api/getSnapshotsByVmId'] == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from libcloud_mods.ctyun import CTYUN_NODE_STATE, CTyunListingError, CTyunNodeDriver
+from libcloud_mods.inventory import CTyunInventory
+
+
+def make_vm(i, status='running', public_ip=None, due_date='2022-01-01'):
+    return {'id': 'vm-%d' % i, 'vmName': 'vm%d' % i, 'vmStatus': status,
+            'publicIP': public_ip or '1.1.1.%d' % i, 'privateIP': '10.0.0.%d' % i,
+            'applyDate': '2021-01-01', 'dueDate': due_date, 'zoneId': i % 3}
+
+
+def make_driver(fleet):
+    driver = CTyunNodeDriver('ak', 'sk')
+
+    def get_vm_list(page_no=1, page_size=2):
+        start = (page_no - 1) * page_size
+        return {'returnCode': 200, 'returnObj': {'VMList': fleet[start:start + page_size]}}
+
+    def get_data_disk_list(zone_id=1, page_no=1, page_size=1):
+        return {'returnCode': 200, 'returnObj': {'DiskList': []}}
+    def get_snapshot_list(zone_id=1, page_no=1, page_size=1):
+        return {'returnCode': 200, 'returnObj': {'snapshotList': []}}
+    driver.get_vm_list = get_vm_list
+    driver.get_data_disk_list = get_data_disk_list
+    driver.get_snapshot_list = get_snapshot_list
+    return driver
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_lookups_use_indexes(compact):
+    fleet = [make_vm(i, due_date='2022-01-%02d' % (i + 1)) for i in range(9)]
+    fleet[4]['vmStatus'] = 'stopped'
+    inventory = CTyunInventory(make_driver(fleet), page_size=4, compact=compact)
+    inventory.refresh()
+
+    assert inventory.get_node('vm-2').name == 'vm2'
+    assert sorted(n.id for n in inventory.find_nodes(zone_id=1)) == ['vm-1', 'vm-4', 'vm-7']
+    assert sorted(n.id for n in inventory.find_nodes(zone_id='1')) == \
+        [n.id for n in inventory.query('nodes', zone_id='1')] == ['vm-1', 'vm-4', 'vm-7']
+    assert [n.id for n in inventory.find_nodes(zone_id=1, state=CTYUN_NODE_STATE['stopped'])] == ['vm-4']
+    assert [n.id for n in inventory.find_nodes(ip='10.0.0.6')] == ['vm-6']
+    assert sorted(n.id for n in inventory.find_nodes(due_from='2022-01-02', due_to='2022-01-03')) == \
+        ['vm-1', 'vm-2']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_refresh_only_touches_changes(compact):
+    fleet = [make_vm(i) for i in range(5)]
+    inventory = CTyunInventory(make_driver(fleet), compact=compact)
+    diff = inventory.refresh()['nodes']
+    assert sorted(diff.added) == ['vm-%d' % i for i in range(5)]
+    unchanged = inventory.get_node('vm-0')
+
+    fleet[1] = make_vm(1, status='stopped', public_ip='2.2.2.2')
+    del fleet[3]
+    fleet.append(make_vm(7))
+    diff = inventory.refresh()['nodes']
+
+    assert (diff.added, diff.changed, diff.removed) == (['vm-7'], ['vm-1'], ['vm-3'])
+    assert inventory.get_node('vm-0') is unchanged
+    assert inventory.version == 2
+    assert inventory.find_nodes(ip='1.1.1.1') == []
+    assert [n.id for n in inventory.find_nodes(ip='2.2.2.2')] == ['vm-1']
+    assert inventory.find_nodes(name='vm3') == []
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_failed_listing_keeps_the_previous_snapshot(compact):
+    fleet = [make_vm(i) for i in range(5)]
+    driver = make_driver(fleet)
+    inventory = CTyunInventory(driver, page_size=2, compact=compact)
+    inventory.refresh()
+    events = []
+    inventory.subscribe(lambda diffs, previous: events.append(diffs))
+
+    driver.get_vm_list = lambda page_no=1, page_size=2: {'returnCode': 500, 'message': 'simulated api error'}
+    with pytest.raises(CTyunListingError):
+        inventory.refresh()
+
+    assert sorted(node.id for node in inventory.list('nodes')) == ['vm-%d' % i for i in range(5)]
+    assert inventory.version == 1 and events == []
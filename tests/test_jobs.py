@@ -0,0 +1,87 @@
+import datetime
+import time
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+from jobs import JOB_FAILED, JOB_RUNNING, JobQueue, JobWorkerPool
+from libcloud_mods.ctyun import CTyunNodeDriver
+from models import Job, db
+from resources.jobs import JobList, JobStatus
+
+BUY = {'cpu': 1, 'memory': 2, 'datahd': 0, 'os': 1, 'bw': 1, 'ordernum': 1, 'periodtype': 1, 'periodnum': 1,
+        'zoneid': 1}
+
+
+@pytest.fixture
+def jobs_app(ctyun_simulator, tmp_path):
+    app = Flask(__name__)
+    # a file, the worker threads each use their own connection
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % tmp_path.joinpath('jobs.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.extensions['job_pool'] = JobWorkerPool(app, CTyunNodeDriver(**ctyun_simulator.driver_kwargs()), size=2,
+            poll_interval=0.05)
+    api = Api(app)
+    api.add_resource(JobList, '/api/jobs')
+    api.add_resource(JobStatus, '/api/jobs/<job_id>')
+    with app.app_context():
+        db.create_all()
+        yield app
+    app.extensions['job_pool'].stop(timeout=5)
+
+
+def test_jobs_answer_202_and_run_off_the_request(jobs_app):
+    client = jobs_app.test_client()
+    pool = jobs_app.extensions['job_pool']
+
+    response = client.post('/api/jobs', json={'operation': 'buy_cloud', 'params': BUY})
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'queued'
+    location = response.headers['Location']
+    assert client.get(location).get_json()['status'] == 'queued'
+
+    assert [job.status for job in pool.run_pending()] == ['succeeded']
+    order_id = client.get(location).get_json()['result']['returnObj']['orderId']
+
+    for expected in ('succeeded', 'failed'):
+        location = client.post('/api/jobs', json={'operation': 'pay_order',
+                'params': {'order_id': order_id, 'cash': 0}}).headers['Location']
+        pool.run_pending()
+        assert client.get(location).get_json()['status'] == expected
+    assert client.get(location).get_json()['error'].startswith('returnCode 400')
+
+    assert client.post('/api/jobs', json={'operation': 'stop_vm', 'params': {'vm_id': 'x'}}).status_code == 400
+    assert client.post('/api/jobs', json={'operation': 'pay_order', 'params': {'vm_id': 'x'}}).status_code == 400
+    assert client.get('/api/jobs/missing').status_code == 404
+
+
+def test_worker_threads_run_each_job_once(jobs_app, ctyun_simulator):
+    pool = jobs_app.extensions['job_pool']
+    queue = JobQueue()
+    calls = ctyun_simulator.calls['/api/buyCloud']
+    job_ids = [queue.enqueue('buy_cloud', BUY).id for _ in range(6)]
+    pool.start()
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        db.session.expire_all()
+        if all(queue.get(job_id).status == 'succeeded' for job_id in job_ids):
+            break
+        time.sleep(0.05)
+    assert [queue.get(job_id).status for job_id in job_ids] == ['succeeded'] * 6
+    assert ctyun_simulator.calls['/api/buyCloud'] - calls == 6
+
+
+def test_job_of_a_lost_worker_is_failed_not_run_again(jobs_app):
+    queue = JobQueue()
+    job = queue.enqueue('buy_cloud', BUY)
+    assert queue.claim('lost').id == job.id
+    Job.query.filter_by(id=job.id).update({'lease_until': datetime.datetime.utcnow() - datetime.timedelta(1)})
+    db.session.commit()
+
+    assert queue.claim('other') is None
+    job = queue.get(job.id)
+    assert job.status == JOB_FAILED and job.worker == 'lost'
+    assert JOB_RUNNING not in [job.status for job in Job.query]
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from libcloud.common.exceptions import BaseHTTPError
+
+from libcloud_mods.ctyun import CTyunListingError, CTyunNodeDriver
+from libcloud_mods.jsonstream import JsonArrayStream
+
+from .simulator import CTyunSimulator
+
+PATH = ('returnObj', 'VMList')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64, 1 << 20])
+def test_elements_are_decoded_across_chunks(chunk_size):
+    document = {'returnCode': 200, 'message': 'ok "quoted" é',
+            'returnObj': {'pageNo': 1, 'VMList': [{'id': 'vm-%d' % i, 'vmName': '云主机%d' % i,
+                'size': i * 1.5, 'tags': [True, None, {'a': [i]}]} for i in range(20)], 'totalCount': 12345}}
+    body = json.dumps(document, ensure_ascii=False, indent=1).encode('utf-8')
+    stream = JsonArrayStream((body[i:i + chunk_size] for i in range(0, len(body), chunk_size)), PATH)
+
+    assert list(stream) == document['returnObj']['VMList']
+    document['returnObj']['VMList'] = []
+    assert stream.document == document
+
+
+def test_documents_without_the_list():
+    for body, document in [('{"returnCode": 900, "message": "bad vKey"}', {'returnCode': 900, 'message': 'bad vKey'}),
+            ('{"returnCode": 200, "returnObj": null}', {'returnCode': 200, 'returnObj': None}),
+            ('[1, 2]', [1, 2])]:
+        stream = JsonArrayStream([body.encode('utf-8')], PATH)
+        assert list(stream) == [] and stream.document == document
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([b'{"returnObj": {"VMList": [1, 2'], PATH))
+
+
+def test_driver_streams_listings():
+    with CTyunSimulator(vms=23, zone_ids=(1, 2)) as simulator:
+        for pool_size in (None, 2):
+            driver = CTyunNodeDriver(ex_pool_size=pool_size, **simulator.driver_kwargs())
+            assert [node.id for node in driver.iter_nodes(page_size=5, stream=True)] == \
+                [node.id for node in driver.iter_nodes(page_size=5)]
+            assert [volume.id for volume in driver.iter_volumes(zone_id=2, page_size=100, stream=True)] == \
+                [volume.id for volume in driver.iter_volumes(zone_id=2, page_size=100)]
+
+        # an api error raises as the page walk does, instead of looking like an empty listing
+        driver = CTyunNodeDriver(**dict(simulator.driver_kwargs(), secret='wrong'))
+        for stream in (False, True):
+            with pytest.raises(CTyunListingError):
+                list(driver.iter_nodes(stream=stream))
+
+    with CTyunSimulator(vms=1, error_rate=1) as simulator:
+        driver = CTyunNodeDriver(ex_max_attempts=2, **simulator.driver_kwargs())
+        with pytest.raises(BaseHTTPError):
+            list(driver.iter_nodes(stream=True))
+        assert simulator.calls['/api/getVMList'] == 2
@@ -0,0 +1,62 @@
+import json
+import os
+import time
+
+from flask import Flask
+from flask_restful import Api
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.metrics import REGISTRY, MetricsRegistry
+from resources.metrics import Metrics, init_request_metrics
+
+
+def test_registry_adds_up_processes(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path), flush_interval=0)
+    calls = registry.counter('calls_total', 'Calls', ['path'])
+    latency = registry.histogram('latency_seconds', 'Latency', ['path'], buckets=(0.1, 1))
+    in_flight = registry.gauge('in_flight', 'In flight', ['path'])
+    calls.labels('/api/a').inc()
+    latency.labels('/api/a').observe(0.5)
+    in_flight.labels('/api/a').inc()
+
+    # the same samples from a live and from an exited worker
+    dump = json.dumps(registry.dump())
+    for pid in (os.getppid(), 2 ** 22 + 1):
+        (tmp_path / ('metrics-%d.json' % pid)).write_text(dump)
+
+    text = registry.exposition()
+    assert 'calls_total{path="/api/a"} 3' in text
+    assert 'latency_seconds_bucket{path="/api/a",le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{path="/api/a",le="1"} 3' in text
+    assert 'latency_seconds_count{path="/api/a"} 3' in text
+    assert 'in_flight{path="/api/a"} 2' in text
+
+
+def test_registry_writes_the_last_samples_of_a_burst(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path), flush_interval=0.05)
+    calls = registry.counter('calls_total', 'Calls')
+    for _ in range(3):
+        calls.labels().inc()
+
+    path = tmp_path / ('metrics-%d.json' % os.getpid())
+    deadline = time.monotonic() + 5
+    while json.loads(path.read_text())['calls_total']['samples'] != [[[], 3]] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads(path.read_text())['calls_total']['samples'] == [[[], 3]]
+
+
+def test_driver_and_flask_requests_are_exposed(stub_server):
+    driver = CTyunNodeDriver('ak', 'sk', host='127.0.0.1', port=stub_server.server_address[1])
+    driver.get_vm_status('vm-1')
+
+    app = Flask(__name__)
+    init_request_metrics(app)
+    Api(app).add_resource(Metrics, '/metrics')
+    client = app.test_client()
+    client.get('/metrics')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert 'ctyun_request_duration_seconds_count{path="/api/getVMStatus"}' in text
+    assert 'ctyun_requests_in_flight{path="/api/getVMStatus"} 0' in text
+    assert 'http_requests_total{method="GET",endpoint="/metrics",status="200"}' in text
+    assert REGISTRY.metrics['ctyun_response_bytes_total'].samples[('/api/getVMStatus',)] > 0
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.pool import CTyunConnectionPool, PoolTimeoutError
+
+
+class FakeConnection(object):
+    connection = None
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pool_reuses_and_expires_idle_connections():
+    clock = FakeClock()
+    pool = CTyunConnectionPool(FakeConnection, size=2, idle_timeout=10, clock=clock)
+
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    second = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0)
+
+    pool.release(first)
+    pool.release(second)
+    clock.now = 11
+    assert pool.acquire() not in (first, second)
+
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['expired']) == (3, 1, 2)
+
+
+def test_pooled_driver_keeps_connections_alive_across_threads(stub_server):
+    driver = CTyunNodeDriver('ak', 'sk', host='127.0.0.1', port=stub_server.server_address[1], ex_pool_size=2)
+
+    def poll():
+        for _ in range(10):
+            assert driver.get_vm_status('vm-1')['returnCode'] == 200
+    threads = [threading.Thread(target=poll) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = driver.ex_pool_stats()
+    assert stats['created'] <= 2
+    assert stats['created'] + stats['reused'] == 40
+    assert len(stub_server.peers) <= 2
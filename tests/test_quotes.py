@@ -0,0 +1,40 @@
+from flask import Flask
+from flask_restful import Api
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.quotes import CTyunQuoteEngine
+from resources.quotes import QuoteGrid, init_quote_engine
+
+from .simulator import CTyunSimulator
+
+
+def test_grid_is_fetched_in_parallel_and_memoized():
+    with CTyunSimulator(vms=1, latency=0.2) as simulator:
+        engine = CTyunQuoteEngine(CTyunNodeDriver(**simulator.driver_kwargs()), concurrency=16)
+
+        quotes = engine.new_order_grid([1, 2], [2, 4], datahd=[40], bw=[1, 5], periods=[(1, 1), (2, 1)])
+        assert len(quotes) == 16 and all(quote.price > 0 for quote in quotes)
+        assert quotes[0].params == {'cpu': 1, 'memory': 2, 'datahd': 40, 'os': 1, 'bw': 1, 'ordernum': 1,
+                'periodtype': 1, 'periodnum': 1, 'zoneid': 1}
+        assert simulator.calls['/api/getNewOrderPrice'] == 16
+
+        # the same config, whether positional or keyword, is served from memory
+        quote = engine.quote('get_new_order_price', 1, 2, 40, 1, 1, 1, 1, 1, 1)
+        assert quote.price == quotes[0].price
+        assert engine.quote('get_data_disk_price', datahd=40).price == 20
+        assert simulator.calls['/api/getNewOrderPrice'] == 16
+
+
+def test_warm_up_and_grid_resource():
+    with CTyunSimulator(vms=1) as simulator:
+        app = Flask(__name__)
+        engine = init_quote_engine(app, CTyunNodeDriver(**simulator.driver_kwargs()))
+        Api(app).add_resource(QuoteGrid, '/api/quotes')
+
+        assert len(engine.warm_up(datahd=[40])) == 6
+        calls = simulator.calls['/api/getNewOrderPrice']
+
+        body = app.test_client().post('/api/quotes', json={'cpu': [2], 'memory': [4], 'datahd': [40]}).get_json()
+        assert body['quotes'][0]['price'] > 0 and body['quotes'][0]['error'] is None
+        assert simulator.calls['/api/getNewOrderPrice'] == calls
+        assert app.test_client().post('/api/quotes', json={'cpu': 'all'}).status_code == 400
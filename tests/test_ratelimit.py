@@ -0,0 +1,55 @@
+import multiprocessing
+
+import pytest
+
+from libcloud_mods.ratelimit import CTyunRateLimiter
+from libcloud_mods.resilience import DeadlineExceededError
+
+
+def frozen_clock():
+    return 1000.0
+
+
+def reserve_reads(limiter, calls, results):
+    results.put([limiter.reserve('ak', '/api/getVMList') for _ in range(calls)])
+
+
+def test_calls_queue_after_the_burst():
+    limiter = CTyunRateLimiter({'read': (10, 3), ('vip', 'read'): (100, 1)}, clock=frozen_clock)
+
+    delays = [limiter.reserve('ak', '/api/getVMList') for _ in range(5)]
+    assert [round(delay, 3) for delay in delays] == [0, 0, 0, 0.1, 0.2]
+    assert round(limiter.reserve('vip', '/api/getVMStatus'), 3) == 0
+    assert round(limiter.reserve('vip', '/api/getVMStatus'), 3) == 0.01
+    # writes and orders have their own, here unlimited, buckets
+    assert limiter.reserve('ak', '/api/startVM') == 0
+
+
+def test_calls_fail_fast_past_their_deadline():
+    limiter = CTyunRateLimiter({'read': (10, 1)}, clock=frozen_clock)
+    assert limiter.reserve('ak', '/api/getVMList', max_wait=0.15) == 0
+
+    with pytest.raises(DeadlineExceededError):
+        limiter.reserve('ak', '/api/getVMList', max_wait=0.05)
+    # the slot was left to the next call
+    assert round(limiter.reserve('ak', '/api/getVMList', max_wait=0.15), 3) == 0.1
+
+
+def test_processes_share_the_buckets(tmp_path):
+    path = str(tmp_path / 'ratelimit')
+    limiter = CTyunRateLimiter({'read': (100, 1)}, path=path, clock=frozen_clock)
+    assert limiter.reserve('ak', '/api/getVMList') == 0
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=reserve_reads, args=(limiter, 10, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    delays = sorted(delay for _ in workers for delay in results.get(timeout=10))
+    for worker in workers:
+        worker.join()
+
+    # one schedule for all the workers: every call gets its own 10ms slot after the first one
+    assert [round(delay, 3) for delay in delays] == [round(0.01 * i, 3) for i in range(1, 31)]
+    assert round(CTyunRateLimiter({'read': (100, 1)}, path=path, clock=frozen_clock)
+            .reserve('ak', '/api/getVMList'), 3) == 0.31
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+from libcloud_mods.registry import CTyunDriverRegistry, UnknownAccountError
+from resources.accounts import ACCESS_KEY_HEADER, init_driver_registry
+from resources.quotes import QuoteGrid, init_quote_engine
+
+from .simulator import CTyunSimulator
+
+ACCOUNTS = {'ak1': 'sk1', 'ak2': 'sk2', 'ak3': 'sk3'}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _registry(simulator, **kwargs):
+    return CTyunDriverRegistry(ACCOUNTS, driver_kwargs={'host': simulator.host, 'port': simulator.port,
+            'secure': False}, **kwargs)
+
+
+def test_drivers_are_built_once_and_bounded():
+    with CTyunSimulator(accounts=ACCOUNTS, vms=1) as simulator:
+        clock = Clock()
+        registry = _registry(simulator, maxsize=2, idle_timeout=60, clock=clock)
+
+        drivers = []
+        threads = [threading.Thread(target=lambda: drivers.append(registry.get('ak1'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(map(id, drivers))) == 1 and registry.stats()['created'] == 1
+        assert drivers[0].list_zone()['returnCode'] == 200
+
+        registry.get('ak2')
+        registry.get('ak1')
+        registry.get('ak3')
+        # ak2 was the least recently used
+        assert 'ak1' in registry and 'ak2' not in registry and 'ak3' in registry
+
+        clock.now = 61
+        assert registry.evict_idle() == 2 and registry.stats()['size'] == 0
+        # an evicted driver still works, it reconnects
+        assert drivers[0].list_zone()['returnCode'] == 200
+
+        with pytest.raises(UnknownAccountError):
+            registry.get('nobody')
+        registry.close()
+
+
+def test_evicted_driver_is_closed_on_its_last_release():
+    with CTyunSimulator(accounts=ACCOUNTS, vms=1) as simulator:
+        registry = _registry(simulator, maxsize=1)
+        closed = []
+        driver = registry.acquire('ak1')
+        driver.ex_close = lambda: closed.append(driver)
+        registry.get('ak2')
+        assert 'ak1' not in registry and closed == []
+        # still usable by its holder
+        assert driver.list_zone()['returnCode'] == 200
+        registry.release(driver)
+        assert closed == [driver]
+        registry.close()
+
+
+def test_request_account_comes_from_its_api_token():
+    with CTyunSimulator(accounts=ACCOUNTS, vms=1) as simulator:
+        registry = _registry(simulator)
+        app = Flask(__name__)
+        app.config['CTYUN_API_TOKENS'] = {'token2': 'ak2', 'token9': 'nobody'}
+        init_driver_registry(app, registry, 'ak1')
+        init_quote_engine(app, registry.get('ak1'))
+        Api(app).add_resource(QuoteGrid, '/api/quotes')
+        client = app.test_client()
+
+        grid = {'cpu': [2], 'memory': [4]}
+        assert client.post('/api/quotes', json=grid).status_code == 200
+        token2 = {'Authorization': 'Bearer token2'}
+        assert client.post('/api/quotes', json=grid, headers=token2).status_code == 200
+        assert 'ak2' in registry
+        # quotes are memoized per account
+        assert simulator.calls['/api/getNewOrderPrice'] == 2
+        assert client.post('/api/quotes', json=grid, headers=dict(token2, **{ACCESS_KEY_HEADER: 'ak2'})) \
+            .status_code == 200
+        # the header alone no longer selects an account
+        assert client.post('/api/quotes', json=grid, headers={ACCESS_KEY_HEADER: 'ak2'}).status_code == 403
+        assert client.post('/api/quotes', json=grid, headers=dict(token2, **{ACCESS_KEY_HEADER: 'ak3'})) \
+            .status_code == 403
+        assert client.post('/api/quotes', json=grid, headers={'Authorization': 'Bearer ak2'}).status_code == 401
+        assert client.post('/api/quotes', json=grid, headers={'Authorization': 'Bearer token9'}).status_code == 403
+        # every request released its driver
+        assert registry._holders == {}
+        registry.close()
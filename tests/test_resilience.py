@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+from libcloud.common.exceptions import BaseHTTPError
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+from libcloud_mods.resilience import CircuitOpenError, CTyunCircuitBreaker, CTyunHttpConnection, CTyunRetryPolicy, \
+    DeadlineExceededError
+
+from .simulator import CTyunSimulator
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_only_reads_are_retried():
+    with CTyunSimulator(vms=1, error_rate={'/api/getVMStatus': 1, '/api/startVM': 1}) as simulator:
+        driver = CTyunNodeDriver(ex_breaker_threshold=None, **simulator.driver_kwargs())
+        driver.retry_policy.sleep = lambda delay: None
+
+        with pytest.raises(BaseHTTPError):
+            driver.get_vm_status('vm-00000001')
+        with pytest.raises(BaseHTTPError):
+            driver.start_vm('vm-00000001')
+
+        assert simulator.calls['/api/getVMStatus'] == 3
+        assert simulator.calls['/api/startVM'] == 1
+
+
+def test_deadline_caps_slow_calls():
+    with CTyunSimulator(vms=1, latency={'/api/getVMStatus': 1}) as simulator:
+        driver = CTyunNodeDriver(ex_call_deadline=0.2, **simulator.driver_kwargs())
+
+        started = time.monotonic()
+        with pytest.raises(requests.exceptions.Timeout):
+            driver.get_vm_status('vm-00000001')
+        assert time.monotonic() - started < 0.5
+
+
+def test_breaker_fails_fast_then_lets_one_trial_through():
+    clock = FakeClock()
+    breaker = CTyunCircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record('/api/getVMList', False)
+    breaker.before_call('/api/getVMList')
+    breaker.record('/api/getVMList', False)
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call('/api/getVMList')
+    breaker.before_call('/api/getVMStatus')
+
+    clock.now = 10
+    assert breaker.state('/api/getVMList') == 'half_open'
+    breaker.before_call('/api/getVMList')
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call('/api/getVMList')
+    breaker.record('/api/getVMList', True)
+    assert breaker.state('/api/getVMList') == 'closed'
+
+
+def test_trial_is_released_when_the_call_is_not_sent():
+    clock = FakeClock()
+    breaker = CTyunCircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    policy = CTyunRetryPolicy(deadline=5, breaker=breaker, clock=clock)
+    breaker.record('/api/getVMList', False)
+    clock.now = 10
+
+    def past_deadline(timeout):
+        raise DeadlineExceededError('rate limited')
+
+    with pytest.raises(DeadlineExceededError):
+        policy.call('/api/getVMList', past_deadline)
+    assert breaker.state('/api/getVMList') == 'half_open'
+
+    async def cancelled(timeout):
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(policy.call_async('/api/getVMList', cancelled))
+    assert policy.call('/api/getVMList', lambda timeout: 'ok') == 'ok'
+    assert breaker.state('/api/getVMList') == 'closed'
+
+
+def test_threads_sharing_a_connection_keep_their_timeout_and_response():
+    connection = CTyunHttpConnection('127.0.0.1', 80)
+    connection.session.request = lambda **kwargs: kwargs['timeout']
+    barrier = threading.Barrier(2)
+    responses = {}
+
+    def call(timeout):
+        with connection.call_timeout(timeout):
+            barrier.wait()
+            connection.request('POST', '/api/getVMStatus')
+            barrier.wait()
+            responses[timeout] = connection.getresponse()
+
+    threads = [threading.Thread(target=call, args=(timeout,)) for timeout in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert responses == {1: 1, 2: 2}
+    connection.request('POST', '/api/getVMStatus', timeout=3)
+    assert connection.getresponse() == 3
@@ -0,0 +1,31 @@
+import pytest
+
+from libcloud.common.exceptions import BaseHTTPError
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+
+from .simulator import CTyunSimulator
+
+
+def test_driver_round_trips_against_simulator(ctyun_simulator):
+    driver = CTyunNodeDriver(**ctyun_simulator.driver_kwargs())
+
+    nodes = list(driver.iter_nodes(page_size=10))
+    assert len(nodes) == 25 and ctyun_simulator.calls['/api/getVMList'] == 3
+    assert len(list(driver.iter_volumes(zone_id=2, page_size=5))) == 12
+
+    node = nodes[0]
+    assert driver.stop_node(node)
+    assert driver.get_vm_status(node.id)['returnObj']['vmStatus'] == 'stopped'
+    assert driver.get_vm_detail_info('vm-missing')['returnCode'] == 404
+
+    bad = CTyunNodeDriver('simulator', 'wrong', host=ctyun_simulator.host, port=ctyun_simulator.port)
+    assert bad.get_vm_status(node.id)['returnCode'] == 900
+
+
+def test_simulator_injects_errors():
+    with CTyunSimulator(vms=1, error_rate={'/api/getVMList': 1}) as simulator:
+        driver = CTyunNodeDriver(**simulator.driver_kwargs())
+        assert driver.list_zone()['returnCode'] == 200
+        with pytest.raises(BaseHTTPError):
+            driver.get_vm_list()
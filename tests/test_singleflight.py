@@ -0,0 +1,58 @@
+import threading
+
+from libcloud_mods.ctyun import CTyunNodeDriver
+
+from .simulator import CTyunSimulator
+
+
+def call_together(calls):
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(i):
+        barrier.wait()
+        results[i] = calls[i]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_reads_share_one_call(tmp_path):
+    with CTyunSimulator(vms=2, latency=0.3) as simulator:
+        vm_ids = sorted(simulator.vms)
+        # two drivers sharing a directory stand for two uwsgi workers
+        drivers = [CTyunNodeDriver(ex_pool_size=8, ex_coalesce_dir=str(tmp_path), **simulator.driver_kwargs())
+                for _ in range(2)]
+
+        results = call_together([lambda driver=driver: driver.get_vm_detail_info(vm_ids[0])
+                for driver in drivers for _ in range(6)] + [lambda: drivers[0].get_vm_detail_info(vm_ids[1])])
+
+        assert simulator.calls['/api/getVMDetailInfo'] == 2
+        assert all(result['returnObj']['id'] == vm_ids[0] for result in results[:-1])
+        assert results[-1]['returnObj']['id'] == vm_ids[1]
+
+        # writes are never coalesced
+        call_together([lambda: drivers[0].start_vm(vm_ids[0])] * 3)
+        assert simulator.calls['/api/startVM'] == 3
+
+
+def test_host_files_are_private_and_removed_once_read(tmp_path):
+    directory = tmp_path.joinpath('coalesce')
+    with CTyunSimulator(vms=1, latency=0.3) as simulator:
+        vm_id = list(simulator.vms)[0]
+        drivers = [CTyunNodeDriver(ex_pool_size=8, ex_coalesce_dir=str(directory), **simulator.driver_kwargs())
+                for _ in range(2)]
+        assert directory.stat().st_mode & 0o777 == 0o700
+
+        call_together([lambda driver=driver: driver.get_vm_detail_info(vm_id) for driver in drivers])
+        assert simulator.calls['/api/getVMDetailInfo'] == 1
+        assert not list(directory.glob('*.json'))
+        assert all(path.stat().st_mode & 0o777 == 0o600 for path in directory.iterdir())
+
+        # passwords are neither shared nor written to disk
+        call_together([lambda driver=driver: driver.get_vm_password(vm_id) for driver in drivers])
+        assert simulator.calls['/api/getVMPassword'] == 2
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from libcloud_mods.ctyun import CTyunListingError, CTyunNodeDriver
+from models import Order, Vm
+from sync import InventorySync, upsert_rows
+
+
+def make_vm(i, status='running'):
+    return {'id': 'vm-%d' % i, 'vmName': 'vm%d' % i, 'vmStatus': status, 'publicIP': '1.1.1.%d' % i,
+            'privateIP': '', 'applyDate': '2021-01-01', 'dueDate': '2022-01-01', 'zoneId': 1}
+
+
+def make_driver(fleet):
+    driver = CTyunNodeDriver('ak', 'sk')
+
+    def listing(key, items):
+        def fetch(page_no=1, page_size=2, zone_id=1):
+            start = (page_no - 1) * page_size
+            return {'returnCode': 200, 'returnObj': {key: items[start:start + page_size]}}
+        return fetch
+    driver.get_vm_list = listing('VMList', fleet)
+    driver.get_data_disk_list = listing('DiskList', [])
+    driver.get_snapshot_list = listing('snapshotList', [])
+    driver.get_order_list = listing('orderList', [{'orderId': 'o-1', 'status': 'paid'}])
+    return driver
+
+
+def test_sync_upserts_in_batches_and_deletes_stale_rows(db_app):
+    fleet = [make_vm(i) for i in range(25)]
+    counts = InventorySync(make_driver(fleet), batch_size=10, page_size=7).run()
+    assert counts == {'vms': 25, 'disks': 0, 'snapshots': 0, 'orders': 1}
+
+    order_changed_at = Order.query.get('o-1').changed_at
+    fleet[0] = make_vm(0, status='stopped')
+    del fleet[1]
+    InventorySync(make_driver(fleet), batch_size=10, page_size=7).run()
+
+    assert Vm.query.count() == 24
+    assert Vm.query.get('vm-1') is None
+    assert Vm.query.get('vm-0').state == 5
+    assert Order.query.get('o-1').to_dict() == {'orderId': 'o-1', 'status': 'paid'}
+    # the order did not change
+    assert Order.query.get('o-1').changed_at == order_changed_at
+
+
+def test_failed_listing_keeps_the_synced_rows(db_app):
+    fleet = [make_vm(i) for i in range(25)]
+    InventorySync(make_driver(fleet), page_size=7).run()
+
+    driver = make_driver([make_vm(i, status='stopped') for i in range(25)])
+    get_vm_list = driver.get_vm_list
+
+    def failing_second_page(page_no=1, page_size=2):
+        if page_no == 2:
+            return {'returnCode': 500, 'message': 'simulated api error'}
+        return get_vm_list(page_no=page_no, page_size=page_size)
+    driver.get_vm_list = failing_second_page
+    with pytest.raises(CTyunListingError):
+        InventorySync(driver, page_size=7).run()
+
+    assert Vm.query.count() == 25
+    assert Vm.query.get('vm-0').state == 0
+
+
+def test_postgresql_upsert_is_one_multi_row_statement():
+    statements = []
+
+    class Session(object):
+        bind = type('Bind', (), {'dialect': postgresql.dialect()})()
+
+        def execute(self, statement):
+            statements.append(str(statement.compile(dialect=postgresql.dialect())))
+
+    now = datetime.datetime.utcnow()
+    upsert_rows(Session(), Vm, [{'id': 'vm-%d' % i, 'name': 'vm', 'synced_at': now} for i in range(3)])
+
+    assert len(statements) == 1
+    assert 'ON CONFLICT (id) DO UPDATE SET' in statements[0]
+    assert statements[0].count('%(id_m') == 3
@@ -0,0 +1,80 @@
+from libcloud_mods.ctyun import CTYUN_NODE_STATE, CTyunNodeDriver
+from libcloud_mods.waiter import CTyunWaiter
+
+
+def make_vm(i, status):
+    return {'id': 'vm-%d' % i, 'vmName': 'vm%d' % i, 'vmStatus': status, 'publicIP': '',
+            'privateIP': '', 'applyDate': '', 'dueDate': '', 'zoneId': 1}
+
+
+def make_driver(fleet_size, ready_after):
+    """
+    A driver over a fake fleet where vm-i reports running from round ready_after[i] on
+    """
+    driver = CTyunNodeDriver('ak', 'sk')
+    driver.rounds = 0
+    driver.calls = 0
+
+    def status(i):
+        return 'running' if driver.rounds >= ready_after.get(i, 0) else 'starting'
+
+    def get_vm_status(vm_id):
+        driver.calls += 1
+        return {'returnCode': 200, 'returnObj': {'vmStatus': status(int(vm_id.split('-')[1]))}}
+
+    def get_vm_list(page_no=1, page_size=2):
+        driver.calls += 1
+        start = (page_no - 1) * page_size
+        vms = [make_vm(i, status(i)) for i in range(start, min(start + page_size, fleet_size))]
+        return {'returnCode': 200, 'returnObj': {'VMList': vms, 'totalCount': fleet_size}}
+
+    driver.get_vm_status = get_vm_status
+    driver.get_vm_list = get_vm_list
+    return driver
+
+
+def test_waiter_resolves_each_node_and_backs_off():
+    driver = make_driver(3, {0: 0, 1: 2, 2: 5})
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        driver.rounds += 1
+    nodes = [driver._to_node(make_vm(i, 'starting')) for i in range(3)]
+    waiter = CTyunWaiter(driver, interval=1, backoff=2, max_interval=3, sleep=sleep)
+
+    resolved = [node.id for node in waiter.iter_until_state(nodes, 'running')]
+
+    assert resolved == ['vm-0', 'vm-1', 'vm-2']
+    assert all(node.state == CTYUN_NODE_STATE['running'] for node in nodes)
+    assert sleeps == [1, 2, 1, 2, 3]
+
+
+def test_waiter_uses_listing_for_large_batches():
+    driver = make_driver(500, dict((i, 3) for i in range(200)))
+    nodes = [driver._to_node(make_vm(i, 'starting')) for i in range(200)]
+    waiter = CTyunWaiter(driver, page_size=100, sleep=lambda seconds: setattr(driver, 'rounds', driver.rounds + 1))
+
+    ready, pending = waiter.wait_until_state(nodes, 'running', timeout=60)
+
+    assert len(ready) == 200 and pending == []
+    assert driver.calls == 4 * 2
+    assert waiter.api_calls == driver.calls
+
+
+def test_waiter_polls_each_item_when_the_listing_fails():
+    driver = make_driver(20, dict((i, 1) for i in range(20)))
+    get_vm_list = driver.get_vm_list
+
+    def failing_first_round(page_no=1, page_size=2):
+        if driver.rounds == 0:
+            driver.calls += 1
+            return {'returnCode': 500, 'message': 'simulated api error'}
+        return get_vm_list(page_no=page_no, page_size=page_size)
+    driver.get_vm_list = failing_first_round
+    nodes = [driver._to_node(make_vm(i, 'starting')) for i in range(20)]
+    waiter = CTyunWaiter(driver, page_size=100, sleep=lambda seconds: setattr(driver, 'rounds', driver.rounds + 1))
+
+    ready, pending = waiter.wait_until_state(nodes, 'running', timeout=60)
+
+    assert len(ready) == 20 and pending == []